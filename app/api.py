@@ -1,12 +1,18 @@
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from pydantic import BaseModel
 import sqlite3
-from typing import Optional, List
+from typing import Optional, List, Dict
 import logging
 from datetime import datetime
 import os
+import sys
+import json
+import asyncio
+import tempfile
+from PIL import Image
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -26,6 +32,26 @@ DB_PATH = "../database/detections.db"
 class DeleteRequest(BaseModel):
     rowid: int
 
+class DetectionFilter(BaseModel):
+    video_name: Optional[str] = None
+    video_hash: Optional[str] = None
+    brand: Optional[str] = None
+    max_confidence: Optional[float] = None
+    frame_start: Optional[int] = None
+    frame_end: Optional[int] = None
+
+class DetectionSelection(BaseModel):
+    rowids: Optional[List[int]] = None
+    filter: Optional[DetectionFilter] = None
+
+class BulkDeleteRequest(DetectionSelection):
+    # Guarda lo borrado como negativos para active_learning. Por defecto solo
+    # cuando se borran ids concretos, no una limpieza por filtro
+    false_positive: Optional[bool] = None
+
+class BulkRelabelRequest(DetectionSelection):
+    new_brand: str
+
 class Detection(BaseModel):
     rowid: int
     video_name: str
@@ -46,79 +72,159 @@ DB_PATH = os.path.join(project_root, "database", "detections.db")
 # Añadir logging para debug
 logger.info(f"Usando base de datos en: {DB_PATH}")
 
-def get_db_connection():
-    try:
-        if not os.path.exists(DB_PATH):
-            logger.error(f"Base de datos no encontrada en: {DB_PATH}")
-            raise HTTPException(status_code=500, detail="Base de datos no encontrada")
-        
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        logger.info("Conexión a base de datos establecida")
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Error conectando a la base de datos: {e}")
-        raise HTTPException(status_code=500, detail=f"Error de conexión a la base de datos: {str(e)}")
+# Directorios donde están src/, runs/ y data/: la raíz del proyecto o, en
+# Docker, el de api.py (/app), donde se montan
+PROJECT_DIRS = (project_root, current_dir)
+
+# Añadir el directorio src al path
+for src_path in (os.path.join(directory, 'src') for directory in PROJECT_DIRS):
+    if os.path.isdir(src_path) and src_path not in sys.path:
+        sys.path.append(src_path)
+
+import storage
+from job_queue import JobQueue, WorkerPool
+from utils.timeline import binned_timeline, downsample_lttb
+from export_detections import EXPORT_FORMATS, iter_record_batches, write_batches
+from evaluation import dataset_class_names
+from retention import RetentionScheduler, parse_policies, run_retention
+
+# Recortes guardados por process_video y sus miniaturas cacheadas
+IMAGES_DIR = os.path.join(os.path.dirname(DB_PATH), "images")
+THUMBNAILS_DIR = os.path.join(os.path.dirname(DB_PATH), "thumbnails")
+
+# Repositorio de detecciones (SQLite en DB_PATH salvo que STORAGE_URL indique otro)
+store = storage.open_store(default_path=DB_PATH)
+
+# Número de videos que se analizan a la vez en este proceso
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
+# Pesos del detector de los workers; sin valor se usa el último entrenamiento
+MODEL_WEIGHTS = os.getenv('MODEL_WEIGHTS') or None
+# Solo se analizan videos de este directorio (POST /jobs no accede a otras rutas)
+VIDEOS_DIR = os.path.realpath(os.getenv('VIDEOS_DIR') or os.path.join(os.path.dirname(DB_PATH), "videos"))
+
+# Retención periódica (desactivada si no se indica ninguna antigüedad)
+RETENTION_POLICIES = parse_policies(os.getenv('RETENTION_MAX_AGE_DAYS'), os.getenv('RETENTION_BRAND_AGES'))
+RETENTION_INTERVAL_HOURS = float(os.getenv('RETENTION_INTERVAL_HOURS', '24'))
+ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR') or None
+
+class JobRequest(BaseModel):
+    # Ruta dentro de VIDEOS_DIR (absoluta o relativa a él)
+    video_path: str
+    conf_thresholds: Dict[str, float] = {'adidas': 0.50, 'nike': 0.50, 'puma': 0.50}
+    store_floor: Optional[float] = 0.10
+
+class RetentionRequest(BaseModel):
+    max_age_days: Optional[float] = None
+    brand_ages: Dict[str, float] = {}
+    archive: bool = True
+    dry_run: bool = False
+
+job_queue = None
+worker_pool = None
+retention_scheduler = None
+
+def find_data_yaml():
+    """data.yaml del dataset en el primer directorio de PROJECT_DIRS que lo tenga"""
+    data_yamls = [os.path.join(directory, "data", "dataset_yolo", "data.yaml") for directory in PROJECT_DIRS]
+    return next((path for path in data_yamls if os.path.exists(path)), data_yamls[0])
+
+def find_model_files():
+    """
+    Pesos y data.yaml para los workers: MODEL_WEIGHTS o el best.pt del último
+    entrenamiento en runs/detect, buscados en cada directorio de PROJECT_DIRS
+    """
+    from models.logo_detector import find_latest_weights
+    weights_path = MODEL_WEIGHTS or next(
+        filter(None, (find_latest_weights(directory) for directory in PROJECT_DIRS)), None)
+    if weights_path is None:
+        logger.warning("No se encontró ningún modelo entrenado: los workers usarán el modelo base")
+    return weights_path, find_data_yaml()
+
+def model_brands():
+    """
+    Marcas que detecta el modelo (las únicas que informan las estadísticas y la
+    línea temporal): las clases de data.yaml o, sin él, las ya guardadas
+    """
+    data_yaml = find_data_yaml()
+    if os.path.exists(data_yaml):
+        return set(dataset_class_names(data_yaml))
+    return {row['brand'] for row in store.query(['brand'], order_by=None, distinct=True)}
+
+def create_detector():
+    """Crea un detector con el último modelo entrenado para un worker"""
+    from models.logo_detector import LogoDetector
+    weights_path, data_yaml = find_model_files()
+    logger.info(f"Detector de los workers con pesos {weights_path}")
+    return LogoDetector(weights_path, data_yaml)
+
+@app.on_event("startup")
+def start_workers():
+    global job_queue, worker_pool, retention_scheduler
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    store.create_schema()
+    # La cola es local a este despliegue (fichero SQLite en DB_PATH); el avance
+    # de los trabajos se lee de los checkpoints del repositorio
+    job_queue = JobQueue(DB_PATH, store)
+    if JOB_WORKERS > 0:
+        worker_pool = WorkerPool(job_queue, create_detector, num_workers=JOB_WORKERS)
+        worker_pool.start()
+    if RETENTION_POLICIES:
+        retention_scheduler = RetentionScheduler(store, RETENTION_POLICIES, RETENTION_INTERVAL_HOURS,
+                                                 images_dir=IMAGES_DIR, thumbnails_dir=THUMBNAILS_DIR,
+                                                 archive_dir=ARCHIVE_DIR)
+        retention_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_workers():
+    if worker_pool:
+        worker_pool.stop(timeout=5)
+    if retention_scheduler:
+        retention_scheduler.stop(timeout=5)
 
 @app.get("/detections/")
-async def get_detections(
+def get_detections(
     video_name: Optional[str] = Query(None),
+    video_hash: Optional[str] = Query(None, description="Un video concreto del catálogo"),
     brand: Optional[str] = Query(None),
     min_confidence: Optional[float] = Query(None, ge=0.0, le=1.0),
     frame_start: Optional[int] = Query(None, ge=0),
-    frame_end: Optional[int] = Query(None, ge=0)
+    frame_end: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior")
 ):
+    """
+    Busca detecciones. Con limit se devuelve una sola página ordenada por
+    (timestamp, rowid); si hay más resultados la cabecera X-Next-Cursor trae el
+    cursor de la página siguiente (paginación por clave, sin OFFSET ni COUNT).
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Verificar si hay registros en la tabla
-        cursor.execute("SELECT COUNT(*) FROM detections")
-        count = cursor.fetchone()[0]
-        logger.info(f"Total de registros en la base de datos: {count}")
-        
-        query = """
-            SELECT 
-                rowid, 
-                video_name, 
-                frame_number, 
-                brand, 
-                confidence, 
-                bbox, 
-                timestamp, 
-                image_path 
-            FROM detections 
-            WHERE 1=1
-        """
-        params = []
-
+        filters = {'video_hash': video_hash or None, 'brand': brand or None,
+                   'min_confidence': min_confidence, 'frame_start': frame_start, 'frame_end': frame_end}
         if video_name:
-            query += " AND video_name LIKE ?"
-            params.append(f"%{video_name}%")
-        
-        if brand:
-            query += " AND brand = ?"
-            params.append(brand)
-        
-        if min_confidence is not None:
-            query += " AND confidence >= ?"
-            params.append(min_confidence)
-        
-        if frame_start is not None:
-            query += " AND frame_number >= ?"
-            params.append(frame_start)
-        
-        if frame_end is not None:
-            query += " AND frame_number <= ?"
-            params.append(frame_end)
+            # Se resuelven primero los videos en el catálogo (índice trigram) y
+            # después se filtra detections por hash: dos videos con el mismo
+            # nombre siguen siendo videos distintos
+            filters['video_hashes'] = store.video_hashes(video_name)
+            if not filters['video_hashes']:
+                return JSONResponse(content=[])
 
-        query += " ORDER BY timestamp"
-        
-        logger.info(f"Ejecutando query: {query}")
-        logger.info(f"Parámetros: {params}")
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
+        after = None
+        if cursor:
+            try:
+                cursor_timestamp, cursor_rowid = cursor.split(':')
+                after = (float(cursor_timestamp), int(cursor_rowid))
+            except ValueError:
+                raise HTTPException(status_code=422, detail="Cursor inválido")
+
+        # Se pide una fila de más para saber si existe una página siguiente
+        results = store.query(['rowid', 'video_name', 'frame_number', 'brand', 'confidence',
+                               'bbox', 'timestamp', 'image_path'],
+                              limit=limit + 1 if limit else None, after=after, **filters)
+
+        headers = {}
+        if limit and len(results) > limit:
+            results = results[:limit]
+            headers["X-Next-Cursor"] = f"{results[-1]['timestamp']!r}:{results[-1]['rowid']}"
         
         logger.info(f"Resultados encontrados: {len(results)}")
         
@@ -131,42 +237,357 @@ async def get_detections(
             detection['rowid'] = int(detection['rowid'])
             detections.append(detection)
         
-        return JSONResponse(content=detections)
+        return JSONResponse(content=detections, headers=headers)
 
+    except HTTPException:
+        raise
     except sqlite3.Error as e:
         logger.error(f"Error en la base de datos: {e}")
         raise HTTPException(status_code=500, detail=f"Error en la base de datos: {str(e)}")
     except Exception as e:
         logger.error(f"Error inesperado: {e}")
         raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
-    finally:
-        if 'conn' in locals():
-            conn.close()
+
+@app.get("/detections/export")
+def export_detections(
+    background_tasks: BackgroundTasks,
+    format: str = Query("parquet", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    video_name: Optional[str] = Query(None),
+    video_hash: Optional[str] = Query(None, description="Un video concreto del catálogo"),
+    brand: Optional[str] = Query(None),
+    min_confidence: Optional[float] = Query(None, ge=0.0, le=1.0)
+):
+    """
+    Exporta las detecciones filtradas a Parquet o Arrow IPC. Se leen y escriben
+    por lotes en un fichero temporal, así que la memoria usada no depende del
+    número de filas; el fichero se borra después de enviarlo.
+    """
+    try:
+        video_hashes = None
+        if video_name:
+            # Se exportan los videos cuyo nombre coincide, cada uno por su hash
+            video_hashes = store.video_hashes(video_name)
+            if not video_hashes:
+                raise HTTPException(status_code=404, detail="No hay videos que coincidan")
+
+        extension = "parquet" if format == "parquet" else "arrow"
+        fd, export_path = tempfile.mkstemp(suffix=f".{extension}")
+        os.close(fd)
+        try:
+            rows = write_batches(iter_record_batches(store, video_hashes=video_hashes, video_hash=video_hash,
+                                                     brand=brand or None, min_confidence=min_confidence),
+                                 export_path, format)
+        except Exception:
+            os.remove(export_path)
+            raise
+        logger.info(f"Exportadas {rows} detecciones a {export_path}")
+    except sqlite3.Error as e:
+        logger.error(f"Error en la base de datos: {e}")
+        raise HTTPException(status_code=500, detail=f"Error en la base de datos: {str(e)}")
+
+    background_tasks.add_task(os.remove, export_path)
+    media_type = ("application/vnd.apache.parquet" if format == "parquet"
+                  else "application/vnd.apache.arrow.file")
+    return FileResponse(export_path, media_type=media_type,
+                        filename=f"detections.{extension}",
+                        headers={"X-Row-Count": str(rows)})
+
+def build_bulk_filters(request):
+    """
+    Traduce una lista de ids y/o un filtro a filtros del repositorio. Se exige
+    al menos un criterio para que una petición vacía nunca afecte a toda la tabla.
+    """
+    filters = {}
+    if request.rowids:
+        filters['rowids'] = request.rowids
+
+    detection_filter = request.filter
+    if detection_filter:
+        if detection_filter.video_name:
+            filters['video_names'] = [detection_filter.video_name]
+        for field in ('video_hash', 'brand', 'max_confidence', 'frame_start', 'frame_end'):
+            value = getattr(detection_filter, field)
+            if value is not None and value != '':
+                filters[field] = value
+
+    if not filters:
+        raise HTTPException(status_code=422, detail="Indica rowids o al menos un filtro")
+    return filters
+
+def invalidate_cached_stats(conn, filters):
+    """Las estadísticas cacheadas de los videos afectados dejan de ser válidas"""
+    affected = store.query(['video_hash'], order_by=None, distinct=True, conn=conn, **filters)
+    for row in affected:
+        store.delete_key('analysis_cache', 'video_hash', row['video_hash'], conn)
+
+def cleanup_images(image_names):
+    """
+    Borra en segundo plano los recortes (y sus miniaturas) de las detecciones
+    eliminadas que ya no estén referenciados por ninguna otra fila.
+    """
+    if not image_names:
+        return
+    still_used = {row['image_path'] for row in store.query(['image_path'], order_by=None, distinct=True,
+                                                           image_paths=image_names)}
+
+    removed = 0
+    for image_name in set(image_names) - still_used:
+        paths = [os.path.join(IMAGES_DIR, os.path.basename(image_name))]
+        if os.path.isdir(THUMBNAILS_DIR):
+            paths += [os.path.join(THUMBNAILS_DIR, size, os.path.basename(image_name))
+                      for size in os.listdir(THUMBNAILS_DIR)]
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error borrando {path}: {e}")
+    logger.info(f"Eliminados {removed} ficheros de imágenes")
+
+def delete_where(filters, background_tasks, false_positive=False):
+    """
+    Borra en una sola transacción las detecciones que cumplen los filtros. Con
+    false_positive se guarda antes una copia en detection_tombstones.
+    """
+    try:
+        with store.transaction() as conn:
+            image_names = [row['image_path'] for row in store.query(
+                ['image_path'], order_by=None, distinct=True, conn=conn, **filters)
+                if row['image_path']]
+            invalidate_cached_stats(conn, filters)
+            if false_positive:
+                store.tombstone(conn, **filters)
+            deleted_count = store.delete(conn, **filters)
+    except sqlite3.Error as e:
+        logger.error(f"Error de base de datos: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    background_tasks.add_task(cleanup_images, image_names)
+    return deleted_count, len(image_names)
 
 @app.delete("/detections/{rowid}")
-async def delete_detection(rowid: int):
+def delete_detection(rowid: int, background_tasks: BackgroundTasks):
     logger.info(f"Recibida petición DELETE para rowid: {rowid}")
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Verificar si existe la detección
-        cursor.execute("SELECT COUNT(*) FROM detections WHERE rowid = ?", (rowid,))
-        if cursor.fetchone()[0] == 0:
-            logger.warning(f"No se encontró la detección con rowid {rowid}")
-            raise HTTPException(status_code=404, detail="Detección no encontrada")
-        
-        # Ejecutar el borrado
-        cursor.execute("DELETE FROM detections WHERE rowid = ?", (rowid,))
-        deleted_count = cursor.rowcount
-        conn.commit()
-        
-        logger.info(f"Detección {rowid} eliminada. Filas afectadas: {deleted_count}")
-        return {"message": f"Detección {rowid} eliminada", "rows_affected": deleted_count}
+    # Borrar una detección concreta es marcarla como falso positivo
+    deleted_count, _ = delete_where({'rowids': [rowid]}, background_tasks, false_positive=True)
+    if deleted_count == 0:
+        logger.warning(f"No se encontró la detección con rowid {rowid}")
+        raise HTTPException(status_code=404, detail="Detección no encontrada")
+    
+    logger.info(f"Detección {rowid} eliminada. Filas afectadas: {deleted_count}")
+    return {"message": f"Detección {rowid} eliminada", "rows_affected": deleted_count}
 
+@app.post("/detections/bulk-delete")
+def bulk_delete_detections(request: BulkDeleteRequest, background_tasks: BackgroundTasks):
+    """
+    Elimina de una vez las detecciones indicadas por id y/o por filtro (video,
+    marca, confianza por debajo de un valor, rango de frames). Los recortes se
+    borran en segundo plano después de responder. Solo los ids indicados
+    explícitamente se guardan como falsos positivos, salvo que false_positive
+    diga otra cosa.
+    """
+    false_positive = request.false_positive
+    if false_positive is None:
+        false_positive = request.filter is None
+    deleted_count, image_count = delete_where(build_bulk_filters(request), background_tasks, false_positive)
+    logger.info(f"Borrado masivo: {deleted_count} detecciones")
+    return {"rows_affected": deleted_count, "images_scheduled": image_count}
+
+@app.post("/detections/bulk-relabel")
+def bulk_relabel_detections(request: BulkRelabelRequest):
+    """
+    Cambia la marca de las detecciones indicadas por id y/o por filtro. Solo
+    se admiten marcas que el modelo conoce.
+    """
+    filters = build_bulk_filters(request)
+    brands = model_brands()
+    if request.new_brand not in brands:
+        raise HTTPException(status_code=422,
+                            detail=f"Marca desconocida: {request.new_brand}. Válidas: {', '.join(sorted(brands))}")
+    try:
+        with store.transaction() as conn:
+            invalidate_cached_stats(conn, filters)
+            updated_count = store.update({'brand': request.new_brand}, conn, **filters)
     except sqlite3.Error as e:
         logger.error(f"Error de base de datos: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+
+    logger.info(f"Reetiquetado masivo a {request.new_brand}: {updated_count} detecciones")
+    return {"rows_affected": updated_count, "new_brand": request.new_brand}
+
+def job_response(job):
+    """Añade al trabajo su avance calculado a partir del checkpoint"""
+    job['progress'] = job_queue.progress(job)
+    return job
+
+def resolve_video_path(video_path):
+    """
+    Ruta real de un video de VIDEOS_DIR (absoluta o relativa a él). Se rechaza
+    cualquier ruta que, resuelta, quede fuera del directorio.
+    """
+    path = os.path.realpath(os.path.join(VIDEOS_DIR, video_path))
+    if os.path.commonpath([path, VIDEOS_DIR]) != VIDEOS_DIR:
+        raise HTTPException(status_code=422, detail=f"El video debe estar en {VIDEOS_DIR}")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Video no encontrado: {video_path}")
+    return path
+
+@app.post("/jobs", status_code=201)
+def submit_job(request: JobRequest):
+    video_path = resolve_video_path(request.video_path)
+    if not request.conf_thresholds:
+        raise HTTPException(status_code=422, detail="Se necesita al menos un umbral de confianza")
+
+    job_id = job_queue.submit(video_path, request.conf_thresholds, request.store_floor)
+    logger.info(f"Trabajo {job_id} encolado para {video_path}")
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = Query(None), limit: int = Query(50, ge=1, le=500)):
+    return [job_response(job) for job in job_queue.list(status, limit)]
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job_response(job)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: int, interval: float = Query(1.0, ge=0.2, le=30.0)):
+    """
+    Emite el avance de un trabajo como Server-Sent Events. Se envía un evento
+    'progress' cada vez que cambia el avance y un evento final 'done' con el
+    estado y las estadísticas cuando el trabajo termina.
+    """
+    if await run_in_threadpool(job_queue.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    async def event_stream():
+        # Las consultas a la cola son bloqueantes: se ejecutan en el pool de
+        # hilos para no parar el bucle de eventos mientras dura el stream
+        last_payload = None
+        while True:
+            job = await run_in_threadpool(job_queue.get, job_id)
+            if job is None:
+                return
+            if job['status'] in ('completed', 'failed'):
+                payload = {'status': job['status'], 'stats': job['stats'], 'error': job['error']}
+                yield f"event: done\ndata: {json.dumps(payload)}\n\n"
+                return
+
+            progress = await run_in_threadpool(job_queue.progress, job)
+            payload = json.dumps(dict(progress, status=job['status']))
+            if payload != last_payload:
+                yield f"event: progress\ndata: {payload}\n\n"
+                last_payload = payload
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+def parse_thresholds(thresholds):
+    """Convierte 'adidas:0.5,nike:0.4' en un diccionario marca -> umbral"""
+    if not thresholds:
+        return None
+    try:
+        parsed = {}
+        for item in thresholds.split(','):
+            brand, conf = item.split(':')
+            parsed[brand.strip()] = float(conf)
+        return parsed
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Formato de umbrales inválido, usa marca:valor,marca:valor")
+
+@app.get("/videos")
+def list_videos(
+    search: Optional[str] = Query(None, description="Fragmento del nombre del video"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Lista los videos analizados (uno por video_hash) con su nombre y su número
+    de detecciones, buscando por cualquier fragmento del nombre en el catálogo
+    en lugar de en detections.
+    """
+    try:
+        return store.search_videos(search, limit)
+    except sqlite3.Error as e:
+        logger.error(f"Error en la base de datos: {e}")
+        raise HTTPException(status_code=500, detail=f"Error en la base de datos: {str(e)}")
+
+@app.get("/videos/{video_hash}/timeline")
+def get_timeline(
+    video_hash: str,
+    max_points: int = Query(500, ge=10, le=10000),
+    bucket_seconds: Optional[float] = Query(None, gt=0),
+    downsample: str = Query("none", pattern="^(none|lttb)$"),
+    thresholds: Optional[str] = Query(None, description="Umbrales por marca: adidas:0.5,nike:0.4")
+):
+    """
+    Línea temporal agregada de un video (por su hash, tal como lo devuelven
+    /videos y el análisis): detecciones agrupadas por intervalo de tiempo y
+    marca con su número y confianza máxima y media. El ancho del intervalo se
+    adapta a la duración para no superar max_points intervalos y, opcionalmente,
+    la serie se reduce con LTTB conservando su forma.
+    """
+    try:
+        bucket_width, points = binned_timeline(store, video_hash, max_buckets=max_points,
+                                               bucket_seconds=bucket_seconds,
+                                               conf_thresholds=parse_thresholds(thresholds))
+        if downsample == "lttb" and len(points) > max_points:
+            points = downsample_lttb(points, max_points)
+        return {"video_hash": video_hash, "bucket_seconds": bucket_width, "points": points}
+    except sqlite3.Error as e:
+        logger.error(f"Error en la base de datos: {e}")
+        raise HTTPException(status_code=500, detail=f"Error en la base de datos: {str(e)}")
+
+@app.post("/maintenance/retention")
+def apply_retention(request: RetentionRequest):
+    """
+    Aplica ahora una política de retención: borra por lotes (archivando antes en
+    Parquet si hay directorio de archivo) las detecciones de los videos más
+    antiguos que max_age_days, o solo las de una marca con brand_ages. Después
+    elimina los recortes huérfanos y, en SQLite, compacta la base de datos.
+    Con dry_run solo se devuelve la lista de videos afectados.
+    """
+    policies = parse_policies(request.max_age_days,
+                              ','.join(f"{brand}:{days}" for brand, days in request.brand_ages.items()))
+    if not policies:
+        raise HTTPException(status_code=422, detail="Indica max_age_days o brand_ages")
+    archive_dir = (ARCHIVE_DIR or os.path.join(os.path.dirname(DB_PATH), "archive")) if request.archive else None
+    try:
+        return run_retention(store, policies, images_dir=IMAGES_DIR, thumbnails_dir=THUMBNAILS_DIR,
+                             archive_dir=archive_dir, dry_run=request.dry_run)
+    except sqlite3.Error as e:
+        logger.error(f"Error en la base de datos: {e}")
+        raise HTTPException(status_code=500, detail=f"Error en la base de datos: {str(e)}")
+
+@app.get("/detections/{rowid}/thumbnail")
+def get_thumbnail(rowid: int, size: int = Query(160, ge=32, le=512)):
+    """
+    Devuelve una miniatura JPEG del recorte de una detección. La miniatura se
+    genera la primera vez y se guarda en disco para las siguientes peticiones.
+    """
+    rows = store.query(['image_path'], order_by=None, rowids=[rowid])
+    row = rows[0] if rows else None
+    if row is None or not row['image_path']:
+        raise HTTPException(status_code=404, detail="Detección sin imagen")
+
+    image_name = os.path.basename(row['image_path'])
+    thumbnail_path = os.path.join(THUMBNAILS_DIR, str(size), image_name)
+    if not os.path.exists(thumbnail_path):
+        source_path = os.path.join(IMAGES_DIR, image_name)
+        if not os.path.exists(source_path):
+            raise HTTPException(status_code=404, detail="Imagen no encontrada")
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        with Image.open(source_path) as image:
+            image.thumbnail((size, size))
+            # Escribir a un fichero temporal y renombrar evita servir miniaturas a medias
+            tmp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+            image.convert("RGB").save(tmp_path, "JPEG", quality=80)
+            os.replace(tmp_path, thumbnail_path)
+
+    return FileResponse(thumbnail_path, media_type="image/jpeg",
+                        headers={"Cache-Control": "public, max-age=86400"})
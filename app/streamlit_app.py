@@ -5,12 +5,13 @@ import tempfile
 import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
-import sqlite3
 from datetime import datetime
 import requests
-from PIL import Image
+from urllib.parse import quote
 import logging
 import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuración de la página
 st.set_page_config(
@@ -49,7 +50,17 @@ logger = logging.getLogger(__name__)
 
 # Importar LogoDetector desde models
 from models.logo_detector import LogoDetector
+from utils.detection_stats import load_detections, compute_stats
+from utils.helpers import copy_stream_with_hash
+from evaluation import load_recommended_thresholds
+import storage
 API_URL = os.getenv('API_URL', 'http://127.0.0.1:8000')  # Asegúrate de que FastAPI esté corriendo en esta dirección
+# Confianza mínima con la que se guardan las cajas para poder cambiar los umbrales después
+STORE_FLOOR = 0.10
+# Galería de detecciones: resultados por página, columnas y tamaño de miniatura
+PAGE_SIZE = 24
+GALLERY_COLUMNS = 4
+THUMBNAIL_SIZE = 160
 
 def show_header():
     # En Docker, el logo estará en el directorio actual
@@ -114,43 +125,78 @@ def clean_database_folder():
     
     # Reinicializar la base de datos
     db_path = os.path.join(database_dir, "detections.db")
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Crear las tablas necesarias
-    c.execute('''CREATE TABLE IF NOT EXISTS video_analysis
-                (video_name TEXT,
-                analysis_date TEXT,
-                total_frames INTEGER,
-                duration_seconds REAL,
-                detection_summary TEXT)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS detections
-                (video_name TEXT,
-                frame_number INTEGER,
-                brand TEXT,
-                confidence REAL,
-                bbox TEXT,
-                timestamp REAL,
-                image_path TEXT)''')
-    
-    conn.commit()
-    conn.close()
+    store = storage.open_store(default_path=db_path)
+    store.create_schema()
+    # El fichero SQLite ya se ha borrado; en otros backends se vacían detecciones,
+    # checkpoints, caché y demás tablas del repositorio
+    store.clear()
     logger.info("Base de datos reinicializada correctamente")
         
-def search_detections(video_name=None, brand=None):
-    """Llama a la API para buscar detecciones."""
+def search_detections(video_name=None, video_hash=None, brand=None, min_confidence=None, limit=None,
+                      cursor=None):
+    """
+    Llama a la API para buscar detecciones de un video concreto (video_hash) o
+    de los que contienen video_name. Devuelve la página de resultados y el
+    cursor de la página siguiente (None si no hay más).
+    """
     params = {}
-    if video_name:
+    if video_hash:
+        params["video_hash"] = video_hash
+    elif video_name:
         params["video_name"] = video_name
     if brand:
         params["brand"] = brand
+    if min_confidence is not None:
+        params["min_confidence"] = min_confidence
+    if limit:
+        params["limit"] = limit
+    if cursor:
+        params["cursor"] = cursor
     response = requests.get(f"{API_URL}/detections/", params=params)
     if response.status_code == 200:
-        return response.json()
+        return response.json(), response.headers.get("X-Next-Cursor")
     else:
         st.error("Error buscando detecciones")
-        return []
+        return [], None
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_videos(search=None, limit=200):
+    """Lista (y cachea unos segundos) los videos del catálogo con su número de detecciones"""
+    params = {"limit": limit}
+    if search:
+        params["search"] = search
+    response = requests.get(f"{API_URL}/videos", params=params)
+    if response.status_code == 200:
+        return response.json()
+    logger.error(f"Error obteniendo el catálogo de videos: {response.text}")
+    return []
+
+def bulk_update_detections(action, rowids, new_brand=None):
+    """
+    Llama a los endpoints masivos de la API ('delete' o 'relabel') con una sola
+    petición para todas las detecciones seleccionadas.
+    """
+    payload = {"rowids": rowids}
+    if action == "relabel":
+        payload["new_brand"] = new_brand
+    response = requests.post(f"{API_URL}/detections/bulk-{action}", json=payload)
+    if response.status_code == 200:
+        return response.json()["rows_affected"]
+    logger.error(f"Error en la operación masiva {action}: {response.text}")
+    return None
+
+def clear_selection():
+    """Desmarca todas las detecciones seleccionadas en la galería"""
+    for key in [key for key in st.session_state if str(key).startswith("select_")]:
+        del st.session_state[key]
+
+@st.cache_data(show_spinner=False, max_entries=2000)
+def fetch_thumbnail(rowid, size=THUMBNAIL_SIZE):
+    """Descarga (y cachea) la miniatura de una detección servida por la API"""
+    response = requests.get(f"{API_URL}/detections/{rowid}/thumbnail", params={"size": size})
+    if response.status_code == 200:
+        return response.content
+    return None
 
 def delete_detection(rowid):
     """Llama a la API para eliminar una detección."""
@@ -210,46 +256,89 @@ def manage_detections():
             logger.info(f"Delete solicitado para rowid: {rowid}")
 
     # Formulario de búsqueda
-    video_name = st.text_input("Nombre del video (opcional)")
+    video_search = st.text_input("Buscar video (opcional)")
+    videos = fetch_videos(video_search or None)
+    # Cada opción es un video (su hash): dos videos con el mismo nombre se distinguen
+    catalog = {video['video_hash']: video for video in videos}
+    video_hash = st.selectbox(
+        "Video", [""] + list(catalog), index=0,
+        format_func=lambda key: f"{catalog[key]['video_name']} ({catalog[key]['detection_count']} detecciones)"
+        if key else "Todos los que coinciden con la búsqueda"
+    )
     brand = st.selectbox("Marca", ["", "adidas", "nike", "puma"], index=0)
+    min_confidence = st.slider("Confianza mínima", min_value=0.0, max_value=1.0, value=0.5, step=0.05)
     
     if st.button("Buscar detecciones"):
         logger.info("Botón de búsqueda presionado")
-        detections = search_detections(video_name, brand)
+        # La búsqueda se guarda para que la página siga visible entre reruns
+        st.session_state.search = {'video_name': video_search, 'video_hash': video_hash,
+                                   'brand': brand, 'min_confidence': min_confidence}
+        st.session_state.page_cursors = [None]
+
+    if 'search' in st.session_state:
+        # Solo se pide a la API la página visible
+        page_cursors = st.session_state.page_cursors
+        detections, next_cursor = search_detections(**st.session_state.search, limit=PAGE_SIZE,
+                                                    cursor=page_cursors[-1])
         
         if detections:
-            for detection in detections:
-                with st.container():
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
+            st.caption(f"Página {len(page_cursors)}")
+            for start in range(0, len(detections), GALLERY_COLUMNS):
+                columns = st.columns(GALLERY_COLUMNS)
+                for column, detection in zip(columns, detections[start:start + GALLERY_COLUMNS]):
+                    with column:
+                        thumbnail = fetch_thumbnail(detection['rowid']) if detection['image_path'] else None
+                        if thumbnail:
+                            st.image(thumbnail, use_container_width=True)
                         st.markdown(f"""
                             **ID:** {detection['rowid']}  
                             **Marca:** {detection['brand']}  
                             **Frame:** {detection['frame_number']}  
                             **Confianza:** {detection['confidence']:.2f}
                         """)
-                        
-                        if detection['image_path']:
-                            try:
-                                base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                                image_path = os.path.join(base_path, "database", "images", 
-                                                        os.path.basename(detection['image_path']))
-                                
-                                if os.path.exists(image_path):
-                                    image = Image.open(image_path)
-                                    st.image(image, 
-                                           caption=f"Detección de {detection['brand']} (Frame {detection['frame_number']})",
-                                           use_container_width=True)
-                                    image.close()
-                            except Exception as e:
-                                logger.error(f"Error al cargar la imagen: {str(e)}")
-                    
-                    with col2:
+                        st.checkbox("Seleccionar", key=f"select_{detection['rowid']}")
                         if st.button("🗑️ Eliminar", key=f"delete_{detection['rowid']}", 
                                    on_click=request_delete, args=(detection['rowid'],)):
                             logger.info(f"Botón de eliminar presionado para rowid: {detection['rowid']}")
 
-                    st.markdown("---")
+            # Acciones masivas sobre las detecciones seleccionadas (una sola petición)
+            selected = [int(str(key).split("_", 1)[1]) for key, value in st.session_state.items()
+                        if str(key).startswith("select_") and value]
+            if selected:
+                st.markdown(f"**{len(selected)} detecciones seleccionadas**")
+                col_delete, col_brand, col_relabel = st.columns([1, 1, 1])
+                with col_delete:
+                    if st.button("🗑️ Eliminar seleccionadas"):
+                        affected = bulk_update_detections("delete", selected)
+                        if affected is not None:
+                            clear_selection()
+                            st.session_state.bulk_message = f"{affected} detecciones eliminadas"
+                            st.rerun()
+                        st.error("Error al eliminar las detecciones")
+                with col_brand:
+                    new_brand = st.selectbox("Nueva marca", ["adidas", "nike", "puma"],
+                                             label_visibility="collapsed")
+                with col_relabel:
+                    if st.button("🏷️ Cambiar marca"):
+                        affected = bulk_update_detections("relabel", selected, new_brand)
+                        if affected is not None:
+                            clear_selection()
+                            st.session_state.bulk_message = f"{affected} detecciones cambiadas a {new_brand}"
+                            st.rerun()
+                        st.error("Error al cambiar la marca")
+            if 'bulk_message' in st.session_state:
+                st.success(st.session_state.pop('bulk_message'))
+
+            # Navegación entre páginas
+            col_prev, col_next = st.columns(2)
+            with col_prev:
+                if len(page_cursors) > 1 and st.button("⬅️ Anterior"):
+                    page_cursors.pop()
+                    st.rerun()
+            with col_next:
+                if next_cursor and st.button("Siguiente ➡️"):
+                    page_cursors.append(next_cursor)
+                    st.rerun()
         else:
             st.info("No se encontraron detecciones.")
 
@@ -283,28 +372,127 @@ def load_detector():
     
     return LogoDetector(last_model, data_yaml)
 
-def plot_brand_timeline(video_name, db_path):
-    """Genera un gráfico de líneas mostrando las detecciones a lo largo del tiempo"""
-    conn = sqlite3.connect(db_path)
-    query = """
-    SELECT brand, timestamp, confidence
-    FROM detections
-    WHERE video_name = ?
-    ORDER BY timestamp
+@st.cache_data(show_spinner=False, ttl=60)
+def fetch_timeline(video_hash, thresholds=None, max_points=500):
+    """Pide a la API la línea temporal agregada y reducida de un video"""
+    params = {"max_points": max_points, "downsample": "lttb"}
+    if thresholds:
+        params["thresholds"] = thresholds
+    response = requests.get(f"{API_URL}/videos/{quote(video_hash, safe='')}/timeline", params=params)
+    response.raise_for_status()
+    return response.json()
+
+def plot_brand_timeline(video_hash, conf_thresholds=None):
     """
-    df = pd.read_sql_query(query, conn, params=(video_name,))
-    conn.close()
-    
+    Genera un gráfico de líneas mostrando las detecciones a lo largo del tiempo.
+    Los puntos son intervalos agregados por la API (confianza máxima por intervalo),
+    de modo que el número de puntos no depende de la duración del video.
+    """
+    thresholds = None
+    if conf_thresholds:
+        thresholds = ','.join(f"{brand}:{conf}" for brand, conf in sorted(conf_thresholds.items()))
+    try:
+        timeline = fetch_timeline(video_hash, thresholds)
+    except requests.RequestException as e:
+        logger.error(f"Error obteniendo la línea temporal: {str(e)}")
+        return None
+
+    df = pd.DataFrame(timeline['points'])
     if df.empty:
         return None
         
-    fig = px.line(df, x='timestamp', y='confidence', color='brand',
+    fig = px.line(df, x='time', y='max_confidence', color='brand',
+                  hover_data=['count', 'mean_confidence'],
                   title='Detección de logos a lo largo del tiempo',
-                  labels={'timestamp': 'Tiempo (segundos)',
-                         'confidence': 'Confianza',
+                  labels={'time': 'Tiempo (segundos)',
+                         'max_confidence': 'Confianza',
+                         'mean_confidence': 'Confianza media',
+                         'count': 'Detecciones',
                          'brand': 'Marca'})
     return fig
 
+@st.cache_data(show_spinner=False)
+def load_video_detections(_store, video_hash):
+    """Carga una sola vez las detecciones guardadas de un video para recalcular umbrales"""
+    # El repositorio no forma parte de la clave de la caché (el guion bajo evita hashearlo)
+    return load_detections(_store, video_hash)
+
+def show_analysis(detector, conf_thresholds):
+    """
+    Muestra las gráficas del último video procesado recalculando las estadísticas
+    con los umbrales actuales de los sliders, sin volver a ejecutar el modelo.
+    """
+    analysis = st.session_state.analysis
+    df = load_video_detections(detector.store, analysis['video_hash'])
+    stats = compute_stats(df, conf_thresholds, analysis['total_frames'], analysis['duration'])
+    stats['video_hash'] = analysis['video_hash']
+
+    # Mostrar gráficas
+    st.subheader("Análisis de detecciones")
+
+    # Gráfico de resumen
+    fig_summary = plot_brand_summary(stats)
+    st.plotly_chart(fig_summary)
+
+    # Gráfico de línea temporal
+    fig_timeline = plot_brand_timeline(analysis['video_hash'], conf_thresholds)
+    if fig_timeline:
+        st.plotly_chart(fig_timeline)
+
+    # Mostrar estadísticas detalladas
+    st.subheader("Estadísticas detalladas")
+    st.json(stats)
+
+def show_progress(progress):
+    """Muestra el avance parcial de un procesamiento en curso"""
+    if not progress or not progress['total_frames']:
+        st.progress(0.0, text="Procesando video...")
+        return
+
+    done = min(progress['frames_done'] / progress['total_frames'], 1.0)
+    st.progress(done, text=f"Procesando video... {progress['frames_done']}/{progress['total_frames']} "
+                           f"frames ({progress['fps']:.1f} fps)")
+    columns = st.columns(len(progress['detections']) or 1)
+    for column, (brand, data) in zip(columns, progress['detections'].items()):
+        column.metric(brand.upper(), f"{data['total_detections']} detecciones",
+                      f"{data['percentage_time']:.1f}% en pantalla", delta_color="off")
+
+@st.cache_resource
+def get_processing_executor():
+    """Ejecutor compartido para procesar videos sin bloquear el hilo del script"""
+    return ThreadPoolExecutor(max_workers=1)
+
+def discard_uploaded_video():
+    """Elimina la copia en disco del último video subido"""
+    upload = st.session_state.pop('upload', None)
+    if upload:
+        shutil.rmtree(upload['dir'], ignore_errors=True)
+
+def save_uploaded_video(uploaded_file):
+    """
+    Copia el video subido a disco por bloques conservando su nombre original, de
+    modo que el video_name guardado coincide con uploaded_file.name. El hash del
+    contenido se calcula durante la copia y la copia se reutiliza entre reruns.
+    """
+    upload = st.session_state.get('upload')
+    if upload and upload['file_id'] == uploaded_file.file_id and os.path.exists(upload['path']):
+        return upload
+
+    discard_uploaded_video()
+    upload_dir = tempfile.mkdtemp(prefix="upload_")
+    video_path = os.path.join(upload_dir, os.path.basename(uploaded_file.name))
+    uploaded_file.seek(0)
+    video_hash = copy_stream_with_hash(uploaded_file, video_path)
+
+    upload = {
+        'file_id': uploaded_file.file_id,
+        'dir': upload_dir,
+        'path': video_path,
+        'hash': video_hash
+    }
+    st.session_state.upload = upload
+    return upload
+
 def plot_brand_summary(stats):
     """Genera dos gráficos: un gráfico de barras para las detecciones totales
     y un gráfico circular para los porcentajes de tiempo en pantalla."""
@@ -389,6 +577,25 @@ def main():
             if 'detector' in st.session_state:
                 st.session_state.detector.setup_database()
         st.sidebar.success("Base de datos limpiada correctamente")
+
+    # Retención: borra (archivando antes) solo los videos antiguos
+    with st.sidebar.expander("Mantenimiento"):
+        max_age_days = st.number_input("Conservar videos de los últimos (días)", min_value=1, value=90)
+        archive = st.checkbox("Archivar en Parquet antes de borrar", value=True)
+        preview = st.button("Ver videos afectados")
+        apply = st.button("Aplicar retención")
+        if preview or apply:
+            response = requests.post(f"{API_URL}/maintenance/retention",
+                                     json={"max_age_days": max_age_days, "archive": archive,
+                                           "dry_run": preview})
+            if response.status_code == 200:
+                report = response.json()
+                st.write(f"{len(report['videos'])} videos afectados")
+                if apply:
+                    st.success(f"{report['deleted']} detecciones borradas, "
+                               f"{report['crops_removed']} recortes eliminados")
+            else:
+                st.error("Error aplicando la retención")
         
     # Selección de modo
     app_mode = st.sidebar.radio(
@@ -422,15 +629,17 @@ def process_video_logic(detector):
     )
 
     # Umbrales de confianza solo para las marcas seleccionadas
+    # Por defecto, los umbrales recomendados por evaluation.py para el modelo cargado
+    recommended = load_recommended_thresholds(detector.weights_path, detector.model_hash) or {}
     conf_thresholds = {}
     if selected_brands:
         st.sidebar.header("Umbrales de confianza")
         for brand in selected_brands:
             conf_thresholds[brand] = st.sidebar.slider(
                 f"Umbral de confianza para {brand.upper()}",
-                min_value=0.0,
+                min_value=STORE_FLOOR,
                 max_value=1.0,
-                value=0.5,
+                value=max(STORE_FLOOR, float(recommended.get(brand, 0.5))),
                 step=0.05,
                 key=f"conf_{brand}"
             )
@@ -438,45 +647,63 @@ def process_video_logic(detector):
     # Subir video
     uploaded_file = st.file_uploader("Selecciona un video", type=['mp4', 'avi', 'mov'])
     if uploaded_file:
-        # Guardar el archivo subido temporalmente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            video_path = tmp_file.name
+        # Guardar el archivo subido en disco por bloques
+        upload = save_uploaded_video(uploaded_file)
 
-        process_button = st.button("Procesar video")
+        resume = st.checkbox("Reanudar desde el último checkpoint", value=True,
+                             help="Continúa un procesamiento interrumpido sin repetir los frames ya guardados")
+        job = st.session_state.get('processing_job')
+        process_button = st.button("Procesar video", disabled=job is not None)
         if process_button:
             if not selected_brands:
                 st.error("Por favor, selecciona al menos una marca para detectar")
             else:
-                try:
-                    with st.spinner("Procesando video..."):
-                        stats = detector.process_video(video_path, conf_thresholds)
-                        if stats:
-                            st.success("¡Video procesado exitosamente!")
-
-                            # Mostrar gráficas
-                            st.subheader("Análisis de detecciones")
-
-                            # Gráfico de resumen
-                            fig_summary = plot_brand_summary(stats)
-                            st.plotly_chart(fig_summary)
-
-                            # Gráfico de línea temporal
-                            fig_timeline = plot_brand_timeline(uploaded_file.name, detector.db_path)
-                            if fig_timeline:
-                                st.plotly_chart(fig_timeline)
-
-                            # Mostrar estadísticas detalladas
-                            st.subheader("Estadísticas detalladas")
-                            st.json(stats)
-                        else:
-                            st.error("Error al procesar el video")
-                except Exception as e:
-                    st.error(f"Error durante el procesamiento: {str(e)}")
-                    logger.error(f"Error detallado: {str(e)}")
-                finally:
-                    # Limpiar archivo temporal
-                    os.unlink(video_path)
+                # El procesamiento corre en segundo plano y el script solo consulta su estado.
+                # process_video deja su último avance en job['progress']
+                job = {'video_hash': upload['hash'], 'video_name': uploaded_file.name, 'progress': None}
+                job['future'] = get_processing_executor().submit(
+                    detector.process_video, upload['path'], dict(conf_thresholds),
+                    resume=resume, video_hash=upload['hash'], store_floor=STORE_FLOOR,
+                    display=False, progress_callback=lambda progress: job.update(progress=progress))
+                st.session_state.processing_job = job
+                st.rerun()
+    elif 'upload' in st.session_state and 'processing_job' not in st.session_state:
+        discard_uploaded_video()
+
+    job = st.session_state.get('processing_job')
+    if job:
+        future = job['future']
+        if not future.done():
+            show_progress(job['progress'])
+            time.sleep(1)
+            st.rerun()
+
+        del st.session_state.processing_job
+        try:
+            stats = future.result()
+            if stats:
+                if stats.get('cache_hit'):
+                    st.info("Este video ya se había analizado: resultados recuperados sin volver a procesarlo")
+                st.success("¡Video procesado exitosamente!")
+
+                # Guardar el análisis para recalcularlo al mover los sliders
+                load_video_detections.clear()
+                fetch_timeline.clear()
+                st.session_state.analysis = {
+                    'video_hash': stats['video_hash'],
+                    'video_name': job['video_name'],
+                    'total_frames': stats['total_frames'],
+                    'duration': stats['duration']
+                }
+            else:
+                st.error("Error al procesar el video")
+        except Exception as e:
+            st.error(f"Error durante el procesamiento: {str(e)}")
+            logger.error(f"Error detallado: {str(e)}")
+
+    # Las gráficas se actualizan en cada cambio de umbral sin tocar el modelo
+    if 'analysis' in st.session_state and conf_thresholds:
+        show_analysis(detector, conf_thresholds)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# Mapa de clases único para todo el pipeline del dataset (y el orden de data.yaml)
+CLASS_NAMES = ('adidas', 'puma', 'nike')
+CLASS_MAP = {name: index for index, name in enumerate(CLASS_NAMES)}
+
+BOX_TAGS = ('xmin', 'ymin', 'xmax', 'ymax')
+
+
+def read_annotation(xml_path):
+    """
+    Lee una anotación Pascal VOC en una sola pasada con iterparse y devuelve
+    un diccionario con width y height de la imagen (None si falta <size>),
+    los nombres de los objetos en minúsculas y sus cajas en píxeles como un
+    array (n, 4) xmin, ymin, xmax, ymax. Cada objeto se libera al leerlo.
+    """
+    width = height = None
+    names, boxes = [], []
+    for _, elem in ET.iterparse(xml_path, events=('end',)):
+        if elem.tag == 'size':
+            if elem.findtext('width') and elem.findtext('height'):
+                width = float(elem.findtext('width'))
+                height = float(elem.findtext('height'))
+        elif elem.tag == 'object':
+            # Solo hijos directos: las <part> de VOC también tienen name y bndbox
+            name = elem.findtext('name')
+            bbox = elem.find('bndbox')
+            if name is not None and bbox is not None:
+                names.append(name.strip().lower())
+                boxes.append([float(bbox.findtext(tag)) for tag in BOX_TAGS])
+            elem.clear()
+    return {
+        'width': width,
+        'height': height,
+        'names': names,
+        'boxes': np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    }
+
+
+def normalize_boxes(boxes, width, height, clip=False):
+    """
+    Convierte todas las cajas xmin, ymin, xmax, ymax en píxeles a formato YOLO
+    (x_center, y_center, width, height normalizados) con una sola operación
+    sobre el array. Con clip se limitan los valores a [0, 1].
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    size = np.array([width, height], dtype=np.float64)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / (2.0 * size)
+    dimensions = (boxes[:, 2:] - boxes[:, :2]) / size
+    normalized = np.hstack([centers, dimensions])
+    if clip:
+        np.clip(normalized, 0.0, 1.0, out=normalized)
+    return normalized
+
+
+def yolo_objects(annotation, class_map=CLASS_MAP, clip=False):
+    """
+    Objetos de una anotación cuyas clases están en class_map: devuelve sus
+    nombres, un array con los índices de clase y las cajas normalizadas.
+    Lanza ValueError si hay objetos pero la anotación no tiene <size>.
+    """
+    keep = [i for i, name in enumerate(annotation['names']) if name in class_map]
+    names = [annotation['names'][i] for i in keep]
+    class_ids = np.array([class_map[name] for name in names], dtype=np.int64)
+    if not keep:
+        return names, class_ids, np.empty((0, 4))
+    if not annotation['width'] or not annotation['height']:
+        raise ValueError("La anotación no indica las dimensiones de la imagen")
+    boxes = normalize_boxes(annotation['boxes'][keep], annotation['width'], annotation['height'], clip)
+    return names, class_ids, boxes
+
+
+def format_yolo_lines(class_ids, boxes, decimals=6):
+    """Líneas '<clase> <x_center> <y_center> <width> <height>' de un fichero de etiquetas"""
+    return [f"{class_id} " + ' '.join(f"{value:.{decimals}f}" for value in box)
+            for class_id, box in zip(class_ids.tolist(), boxes.tolist())]
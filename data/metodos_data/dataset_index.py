@@ -0,0 +1,199 @@
+import os
+import re
+import json
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .dataset_manifest import LINK_MODES, is_placed, place_file
+    from .near_duplicates import DEFAULT_MAX_DISTANCE, build_hash_index, cluster_near_duplicates, split_by_cluster
+except ImportError:
+    # Ejecutado como script desde data/metodos_data
+    from dataset_manifest import LINK_MODES, is_placed, place_file
+    from near_duplicates import DEFAULT_MAX_DISTANCE, build_hash_index, cluster_near_duplicates, split_by_cluster
+
+INDEX_NAME = 'dataset_index.json'
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ORGANIZER_SPLITS = (('train', 0.7), ('valid', 0.2), ('test', 0.1))
+
+
+def pair_by_stem(images_dir, annotations_dir=None, image_extensions=IMAGE_EXTENSIONS):
+    """
+    Empareja cada imagen con el XML de su mismo nombre base (no por posición
+    en dos listas ordenadas por separado). Devuelve, ordenados por nombre, los
+    pares (imagen, xml o None) y la lista de XML sin imagen.
+    """
+    annotations_dir = annotations_dir or images_dir
+    with os.scandir(images_dir) as entries:
+        images = {os.path.splitext(entry.name)[0]: entry.path for entry in entries
+                  if entry.is_file() and entry.name.lower().endswith(image_extensions)}
+    with os.scandir(annotations_dir) as entries:
+        annotations = {os.path.splitext(entry.name)[0]: entry.path for entry in entries
+                       if entry.is_file() and entry.name.lower().endswith('.xml')}
+    pairs = [(os.path.abspath(images[stem]), os.path.abspath(annotations[stem]) if stem in annotations else None)
+             for stem in sorted(images)]
+    orphans = sorted(os.path.abspath(path) for stem, path in annotations.items() if stem not in images)
+    return pairs, orphans
+
+
+def load_index(index_path):
+    """Entradas de un índice (nombre -> marca, imagen, xml, split...), o vacío si no existe"""
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index.get('entries', {})
+
+
+def save_index(index_path, entries):
+    """Guarda el índice sustituyendo el anterior de forma atómica"""
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'entries': entries}, f, indent=1, sort_keys=True)
+    os.replace(temp_path, index_path)
+
+
+def register_pairs(entries, brand, pairs, prefix=None):
+    """
+    Da nombre a los pares de una marca dentro del índice. Con prefix los
+    nombres son prefix_0001, prefix_0002... y una imagen ya registrada
+    conserva el suyo; sin prefix se usa el nombre base de la imagen. Las
+    entradas de la marca cuyas imágenes ya no están se eliminan.
+    Devuelve las entradas de la marca.
+    """
+    previous = {entry['image']: name for name, entry in entries.items() if entry['brand'] == brand}
+    images = {image for image, _ in pairs}
+    for image, name in previous.items():
+        if image not in images:
+            del entries[name]
+
+    numbering = re.compile(rf"^{re.escape(prefix)}_(\d+)$") if prefix else None
+    next_number = 1 + max((int(match.group(1)) for match in map(numbering.match, entries) if match),
+                          default=0) if prefix else None
+    registered = {}
+    for image, annotation in pairs:
+        name = previous.get(image)
+        if name is None:
+            if prefix:
+                name = f"{prefix}_{str(next_number).zfill(4)}"
+                next_number += 1
+            else:
+                name = os.path.splitext(os.path.basename(image))[0]
+            if name in entries:
+                print(f"¡Advertencia! {image} se omite: el nombre {name} ya es de {entries[name]['image']}")
+                continue
+        entries[name] = {**entries.get(name, {}), 'brand': brand, 'image': image, 'annotation': annotation}
+        registered[name] = entries[name]
+    return registered
+
+
+def assign_splits(entries, ratios=ORGANIZER_SPLITS, max_distance=DEFAULT_MAX_DISTANCE, workers=None,
+                  hash_index_path=None):
+    """
+    Asigna split a las entradas que no lo tienen sin mover las que ya lo
+    tenían. Las imágenes casi duplicadas forman un grupo: si alguna ya tenía
+    split, las nuevas del grupo van con ella; los grupos nuevos se reparten
+    enteros según ratios. Devuelve cuántas entradas se han asignado.
+    """
+    split_names = {split for split, _ in ratios}
+    names = sorted(entries)
+    hashes = build_hash_index([entries[name]['image'] for name in names], workers, hash_index_path)
+    clusters = cluster_near_duplicates(hashes, max_distance)
+
+    members = defaultdict(list)
+    for name, cluster in zip(names, clusters):
+        members[cluster].append(name)
+    new_names, new_clusters, assigned = [], [], 0
+    for cluster, group in members.items():
+        splits = Counter(entries[name].get('split') for name in group if entries[name].get('split') in split_names)
+        for name in group:
+            entries[name]['cluster'] = names[cluster]
+            if entries[name].get('split') in split_names:
+                continue
+            if splits:
+                entries[name]['split'] = splits.most_common(1)[0][0]
+                assigned += 1
+            else:
+                new_names.append(name)
+                new_clusters.append(cluster)
+    for name, split in zip(new_names, split_by_cluster(new_clusters, ratios)):
+        entries[name]['split'] = split
+        assigned += 1
+    return assigned
+
+
+def empty_annotation(name, image_path, split):
+    """Anotación XML vacía para imágenes de background"""
+    return f"""<?xml version="1.0" ?>
+<annotation>
+    <folder>{split}</folder>
+    <filename>{name}</filename>
+    <path>{image_path}</path>
+    <source>
+        <database>Unknown</database>
+    </source>
+    <size>
+        <width>1920</width>
+        <height>1080</height>
+        <depth>3</depth>
+    </size>
+</annotation>"""
+
+
+def entry_targets(name, entry):
+    """Rutas relativas ('split/images/x.jpg') de la imagen y el XML de una entrada"""
+    extension = os.path.splitext(entry['image'])[1]
+    return f"{entry['split']}/images/{name}{extension}", f"{entry['split']}/labels/{name}.xml"
+
+
+def materialize_entry(task):
+    """Enlaza (o copia) la imagen y el XML de una entrada. Devuelve cuántos ficheros ha escrito"""
+    name, entry, output_path, link_mode = task
+    image_target, label_target = (os.path.join(output_path, *target.split('/'))
+                                  for target in entry_targets(name, entry))
+    written = 0
+    if not is_placed(entry['image'], image_target, link_mode):
+        place_file(entry['image'], image_target, link_mode)
+        written += 1
+    if entry['annotation']:
+        if not is_placed(entry['annotation'], label_target, link_mode):
+            place_file(entry['annotation'], label_target, link_mode)
+            written += 1
+    elif not os.path.exists(label_target):
+        with open(label_target, 'w') as f:
+            f.write(empty_annotation(os.path.basename(image_target), entry['image'], entry['split']))
+        written += 1
+    return written
+
+
+def materialize(entries, output_path, link_mode='hardlink', workers=None, previous_outputs=()):
+    """
+    Crea la estructura split/images y split/labels a partir del índice con
+    enlaces duros o simbólicos en paralelo, sin volver a copiar el dataset.
+    Solo se escriben los ficheros que faltan o han cambiado, y se borran los
+    de previous_outputs que ya no corresponden a ninguna entrada.
+    Devuelve (ficheros escritos, ficheros borrados) y las salidas actuales.
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"link_mode debe ser uno de {LINK_MODES}")
+    outputs = set()
+    for name, entry in entries.items():
+        outputs.update(entry_targets(name, entry))
+    removed = 0
+    for relative_path in sorted(set(previous_outputs) - outputs):
+        path = os.path.join(output_path, *relative_path.split('/'))
+        if os.path.lexists(path):
+            os.remove(path)
+            removed += 1
+
+    for split in {entry['split'] for entry in entries.values()}:
+        os.makedirs(os.path.join(output_path, split, 'images'), exist_ok=True)
+        os.makedirs(os.path.join(output_path, split, 'labels'), exist_ok=True)
+    tasks = [(name, entry, output_path, link_mode) for name, entry in sorted(entries.items())]
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+        written = sum(executor.map(materialize_entry, tasks))
+    return written, removed, outputs
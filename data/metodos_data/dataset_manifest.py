@@ -0,0 +1,174 @@
+import os
+import json
+import shutil
+import hashlib
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Proporciones por defecto para asignar split a las imágenes nuevas
+DEFAULT_SPLITS = (('train', 0.7), ('val', 0.15), ('test', 0.15))
+
+# Formas de llevar las imágenes al dataset de salida
+LINK_MODES = ('copy', 'hardlink', 'symlink')
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Hash del contenido de un fichero (blake2b de 128 bits)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_hash(text):
+    """Hash de un texto, usado para las etiquetas YOLO generadas"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def file_record(path, previous=None):
+    """
+    Ruta, tamaño, mtime y hash de un fichero. Si tamaño y mtime coinciden con
+    los del registro anterior se reutiliza su hash sin volver a leer el fichero.
+    """
+    stat = os.stat(path)
+    record = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if previous and previous.get('size') == record['size'] and previous.get('mtime_ns') == record['mtime_ns']:
+        record['hash'] = previous['hash']
+    else:
+        record['hash'] = file_hash(path)
+    return record
+
+
+def same_content(record, previous):
+    """True si dos registros (o la ausencia de ambos) tienen el mismo contenido"""
+    if record is None or previous is None:
+        return record is None and previous is None
+    return record['hash'] == previous['hash']
+
+
+def load_manifest(output_path):
+    """Entradas del manifiesto de un dataset, o un diccionario vacío si no existe"""
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        print(f"Manifiesto ilegible, se reconstruye el dataset: {manifest_path}")
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('entries', {})
+
+
+def save_manifest(output_path, entries):
+    """Escribe el manifiesto junto a data.yaml sustituyendo el anterior de forma atómica"""
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'entries': entries}, f, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def assign_split(key, splits=DEFAULT_SPLITS):
+    """
+    Split de una imagen nueva a partir del hash de su clave: no depende del
+    orden ni de qué otras imágenes se añadan en la misma ejecución.
+    """
+    position = int(hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest(), 16) / 2 ** 64
+    total = sum(fraction for _, fraction in splits)
+    accumulated = 0.0
+    for split, fraction in splits:
+        accumulated += fraction / total
+        if position < accumulated:
+            return split
+    return splits[-1][0]
+
+
+def existing_outputs(output_path, splits):
+    """Rutas relativas ('split/images/x.jpg') de los ficheros ya generados"""
+    outputs = set()
+    for split in splits:
+        for folder in ('images', 'labels'):
+            directory = os.path.join(output_path, split, folder)
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                outputs.update(f"{split}/{folder}/{entry.name}" for entry in entries)
+    return outputs
+
+
+def entry_outputs(entry):
+    """Ficheros generados para una entrada del manifiesto"""
+    return [path for path in (entry.get('image_output'), entry.get('label_output')) if path]
+
+
+def is_up_to_date(entry, image_record, annotation_record, outputs):
+    """La entrada no ha cambiado en origen y sus ficheros de salida siguen ahí"""
+    return (entry is not None
+            and same_content(image_record, entry.get('image'))
+            and same_content(annotation_record, entry.get('annotation'))
+            and all(path in outputs for path in entry_outputs(entry)))
+
+
+def remove_outputs(output_path, entry):
+    """Borra la imagen y la etiqueta generadas para una entrada"""
+    for relative_path in entry_outputs(entry):
+        path = os.path.join(output_path, *relative_path.split('/'))
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+def remove_stale_outputs(output_path, outputs, expected):
+    """
+    Borra los ficheros de outputs (rutas relativas, como las de
+    existing_outputs) que no están en expected: restos de una construcción
+    anterior sin manifiesto o con otro reparto. Devuelve cuántos ha borrado.
+    """
+    removed = 0
+    for relative_path in sorted(set(outputs) - set(expected)):
+        path = os.path.join(output_path, *relative_path.split('/'))
+        if os.path.lexists(path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def place_file(src, dst, link_mode='copy'):
+    """
+    Lleva una imagen al dataset copiándola o enlazándola. Si el enlace duro no
+    es posible (por ejemplo, otro sistema de ficheros) se copia.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link_mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif link_mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return
+    shutil.copy2(src, dst)
+
+
+def is_placed(src, dst, link_mode='copy'):
+    """
+    True si dst ya es lo que dejaría place_file(src, dst, link_mode): el mismo
+    enlace simbólico, o el mismo fichero enlazado o una copia intacta (copy2
+    conserva el mtime y el enlace duro se sustituye por una copia si falla).
+    """
+    if not os.path.lexists(dst):
+        return False
+    if link_mode == 'symlink' or os.path.islink(dst):
+        return link_mode == 'symlink' and os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    return os.path.samestat(src_stat, dst_stat) or \
+        (src_stat.st_size, src_stat.st_mtime_ns) == (dst_stat.st_size, dst_stat.st_mtime_ns)
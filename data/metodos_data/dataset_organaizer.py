@@ -1,128 +1,137 @@
 import os
-import shutil
-import random
 from pathlib import Path
 import xml.etree.ElementTree as ET
 
-def organize_dataset(source_path, output_path, train_ratio=0.7, valid_ratio=0.2):
-    # Crear directorios de destino
-    for split in ['train', 'valid', 'test']:
-        os.makedirs(f"{output_path}/{split}/images", exist_ok=True)
-        os.makedirs(f"{output_path}/{split}/labels", exist_ok=True)
-
-    # Marcas que nos interesan
-    target_brands = ['adidas', 'puma', 'background']
-    all_images = []
+try:
+    from .annotations import read_annotation
+    from .dataset_index import (INDEX_NAME, assign_splits, load_index, materialize,
+                                pair_by_stem, register_pairs, save_index)
+    from .dataset_manifest import existing_outputs
+    from .near_duplicates import DEFAULT_MAX_DISTANCE, INDEX_NAME as HASH_INDEX_NAME
+except ImportError:
+    # Ejecutado como script desde data/metodos_data
+    from annotations import read_annotation
+    from dataset_index import (INDEX_NAME, assign_splits, load_index, materialize,
+                               pair_by_stem, register_pairs, save_index)
+    from dataset_manifest import existing_outputs
+    from near_duplicates import DEFAULT_MAX_DISTANCE, INDEX_NAME as HASH_INDEX_NAME
 
-    # Recopilar todas las imágenes
+def collect_sources(source_path, target_brands):
+    """
+    Imágenes de cada marca de source_path. Si el directorio de una marca
+    tiene un índice (creado por rename_logo_files) se usan sus entradas; si
+    no, se emparejan por nombre base las imágenes y los XML del directorio.
+    """
+    sources = {}
     for brand in target_brands:
         brand_path = Path(source_path) / brand
-        if brand_path.exists():
-            print(f"\nProcesando directorio: {brand_path}")
-            # Obtener todas las imágenes con diferentes extensiones
-            image_files = []
-            for ext in ['.jpg', '.jpeg', '.png']:
-                image_files.extend(list(brand_path.glob(f'*{ext}')))
-            
-            print(f"Encontradas {len(image_files)} imágenes para {brand}")
-            
-            for img_path in image_files:
-                if brand == 'background':
-                    # Para background, añadir directamente la imagen
-                    all_images.append((img_path, None, brand))
-                    print(f"Añadida imagen de background: {img_path.name}")
-                else:
-                    # Para las marcas, buscar el archivo XML correspondiente
-                    xml_path = img_path.with_suffix('.xml')
-                    if xml_path.exists():
-                        try:
-                            tree = ET.parse(xml_path)
-                            root = tree.getroot()
-                            if root.findall('.//object'):  # Verifica si hay objetos anotados
-                                all_images.append((img_path, xml_path, brand))
-                        except ET.ParseError:
-                            print(f"Error al parsear {xml_path}")
-                            continue
-            
-            print(f"Imágenes válidas para {brand}: {len([x for x in all_images if x[2] == brand])}")
+        if not brand_path.exists():
+            continue
+        print(f"\nProcesando directorio: {brand_path}")
+        if (brand_path / INDEX_NAME).exists():
+            brand_entries = {name: entry for name, entry in load_index(str(brand_path / INDEX_NAME)).items()
+                             if os.path.exists(entry['image'])}
+            for name, entry in brand_entries.items():
+                if name in sources:
+                    print(f"¡Advertencia! {entry['image']} se omite: el nombre {name} ya está en uso")
+                    continue
+                sources[name] = {'brand': brand, 'image': entry['image'], 'annotation': entry['annotation']}
+        else:
+            pairs, _ = pair_by_stem(str(brand_path))
+            brand_entries = register_pairs(sources, brand, pairs)
+        print(f"Encontradas {len(brand_entries)} imágenes para {brand}")
+    return sources
 
-    if not all_images:
-        raise Exception("No se encontraron imágenes válidas en el dataset")
+def has_objects(entry):
+    """Las marcas necesitan un XML con al menos un objeto anotado; background no"""
+    if entry['brand'] == 'background':
+        return True
+    if not entry['annotation'] or not os.path.exists(entry['annotation']):
+        return False
+    try:
+        return bool(read_annotation(entry['annotation'])['names'])
+    except ET.ParseError:
+        print(f"Error al parsear {entry['annotation']}")
+        return False
 
-    # Mezclar aleatoriamente todas las imágenes
-    random.shuffle(all_images)
+def organize_dataset(source_path, output_path, train_ratio=0.7, valid_ratio=0.2,
+                     max_distance=DEFAULT_MAX_DISTANCE, workers=None, link_mode='hardlink'):
+    """
+    Reparte las imágenes de source_path/<marca> en train/valid/test. Las
+    imágenes casi duplicadas (pHash a max_distance bits o menos) forman un
+    grupo y cada grupo va entero a un mismo split para que no haya fugas
+    entre train y test.
 
-    # Calcular índices para la división
-    n = len(all_images)
-    train_idx = int(n * train_ratio)
-    valid_idx = int(n * (train_ratio + valid_ratio))
+    El reparto se guarda en output_path/dataset_index.json y la estructura
+    YOLO se crea con enlaces (link_mode 'hardlink' o 'symlink') en lugar de
+    copias. Al volver a ejecutar, las imágenes ya repartidas mantienen su
+    split y solo se enlazan las nuevas.
+    """
+    # Marcas que nos interesan
+    target_brands = ['adidas', 'puma', 'background']
+    index_path = os.path.join(output_path, INDEX_NAME)
+    previous = load_index(index_path)
 
-    # Función para copiar imágenes y anotaciones
-    def copy_files(images_subset, split):
-        for img_path, xml_path, brand in images_subset:
-            try:
-                # Copiar imagen
-                dest_img = Path(output_path) / split / 'images' / img_path.name
-                shutil.copy(str(img_path), str(dest_img))
-                print(f"Copiada imagen {img_path.name} a {split}")
-                
-                if xml_path:  # Si hay archivo XML (para marcas)
-                    dest_xml = Path(output_path) / split / 'labels' / xml_path.name
-                    shutil.copy(str(xml_path), str(dest_xml))
-                    print(f"Copiado XML {xml_path.name} a {split}")
-                else:  # Para background, crear un archivo XML vacío
-                    create_empty_xml(img_path, split, output_path)
-                    print(f"Creado XML vacío para {img_path.name} en {split}")
-            except Exception as e:
-                print(f"Error al copiar archivo {img_path}: {str(e)}")
+    sources = {name: entry for name, entry in collect_sources(source_path, target_brands).items()
+               if has_objects(entry)}
+    for brand in target_brands:
+        print(f"Imágenes válidas para {brand}: {sum(entry['brand'] == brand for entry in sources.values())}")
+    if not sources:
+        raise Exception("No se encontraron imágenes válidas en el dataset")
 
-    def create_empty_xml(img_path, split, output_path):
-        """Crea una anotación XML vacía para imágenes de background"""
-        xml_content = f"""<?xml version="1.0" ?>
-<annotation>
-    <folder>{split}</folder>
-    <filename>{img_path.name}</filename>
-    <path>{str(img_path)}</path>
-    <source>
-        <database>Unknown</database>
-    </source>
-    <size>
-        <width>1920</width>
-        <height>1080</height>
-        <depth>3</depth>
-    </size>
-</annotation>"""
-        dest_xml = Path(output_path) / split / 'labels' / f"{img_path.stem}.xml"
-        with open(dest_xml, 'w') as f:
-            f.write(xml_content)
+    # Las imágenes que ya estaban en el índice conservan su split
+    entries = {}
+    for name, entry in sources.items():
+        old = previous.get(name)
+        entries[name] = {**old, **entry} if old and old['image'] == entry['image'] else dict(entry)
 
-    print("\nIniciando división del dataset...")
-    # Dividir y copiar archivos
-    copy_files(all_images[:train_idx], 'train')
-    copy_files(all_images[train_idx:valid_idx], 'valid')
-    copy_files(all_images[valid_idx:], 'test')
+    # Agrupar casi duplicados y repartir los grupos completos entre splits
+    print("\nCalculando pHash de las imágenes...")
+    os.makedirs(output_path, exist_ok=True)
+    ratios = (('train', train_ratio), ('valid', valid_ratio), ('test', max(0.0, 1 - train_ratio - valid_ratio)))
+    assigned = assign_splits(entries, ratios, max_distance, workers, os.path.join(output_path, HASH_INDEX_NAME))
+    group_sizes = {}
+    for entry in entries.values():
+        group_sizes[entry['cluster']] = group_sizes.get(entry['cluster'], 0) + 1
+    duplicated = [size for size in group_sizes.values() if size > 1]
+    print(f"Grupos de casi duplicados: {len(duplicated)} ({sum(duplicated)} imágenes)")
+    print(f"Imágenes nuevas repartidas: {assigned}")
+
+    print("\nCreando la estructura del dataset...")
+    # Se recorren los splits en disco y no el índice: un árbol organizado antes
+    # de existir el índice (o con otro reparto) deja ficheros que no son de
+    # ninguna entrada y que, si no, quedarían en su split antiguo
+    previous_outputs = existing_outputs(output_path, [split for split, _ in ratios])
+    written, removed, _ = materialize(entries, output_path, link_mode, workers, previous_outputs)
+    save_index(index_path, entries)
+    print(f"Ficheros enlazados o escritos: {written}, eliminados: {removed}")
 
     # Imprimir estadísticas finales
+    n = len(entries)
+    subsets = {split: [entry for entry in entries.values() if entry['split'] == split]
+               for split in ['train', 'valid', 'test']}
     print("\nDistribución final del dataset:")
-    print(f"Train: {train_idx} imágenes")
-    print(f"Validation: {valid_idx - train_idx} imágenes")
-    print(f"Test: {n - valid_idx} imágenes")
+    print(f"Train: {len(subsets['train'])} imágenes")
+    print(f"Validation: {len(subsets['valid'])} imágenes")
+    print(f"Test: {len(subsets['test'])} imágenes")
     print(f"Total: {n} imágenes")
 
     # Imprimir distribución por marca
     for brand in target_brands:
-        brand_count = len([x for x in all_images if x[2] == brand])
+        brand_count = len([x for x in entries.values() if x['brand'] == brand])
         print(f"\nTotal {brand}: {brand_count} imágenes")
-        print(f"Train {brand}: {len([x for x in all_images[:train_idx] if x[2] == brand])}")
-        print(f"Valid {brand}: {len([x for x in all_images[train_idx:valid_idx] if x[2] == brand])}")
-        print(f"Test {brand}: {len([x for x in all_images[valid_idx:] if x[2] == brand])}")
+        print(f"Train {brand}: {len([x for x in subsets['train'] if x['brand'] == brand])}")
+        print(f"Valid {brand}: {len([x for x in subsets['valid'] if x['brand'] == brand])}")
+        print(f"Test {brand}: {len([x for x in subsets['test'] if x['brand'] == brand])}")
+    return entries
 
-# Rutas
-source_path = r"C:\Users\ang01\Desktop\CURSO F5\25 Proyecto de Computer Vision\brand_detection_Angel_Leire\dataset_final"
-output_path = r"C:\Users\ang01\Desktop\CURSO F5\25 Proyecto de Computer Vision\brand_detection_Angel_Leire\dataset_ok"
+if __name__ == "__main__":
+    # Rutas
+    source_path = r"C:\Users\ang01\Desktop\CURSO F5\25 Proyecto de Computer Vision\brand_detection_Angel_Leire\dataset_final"
+    output_path = r"C:\Users\ang01\Desktop\CURSO F5\25 Proyecto de Computer Vision\brand_detection_Angel_Leire\dataset_ok"
 
-# Ejecutar la organización del dataset
-try:
-    organize_dataset(source_path, output_path)
-except Exception as e:
-    print(f"Error durante la organización del dataset: {str(e)}")
\ No newline at end of file
+    # Ejecutar la organización del dataset
+    try:
+        organize_dataset(source_path, output_path)
+    except Exception as e:
+        print(f"Error durante la organización del dataset: {str(e)}")
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import random
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+HASH_BITS = 64
+# Distancia de Hamming máxima entre pHash de 64 bits para considerar dos
+# imágenes casi duplicadas (recortes, recompresiones, cambios de tamaño)
+DEFAULT_MAX_DISTANCE = 6
+INDEX_NAME = 'phash_index.json'
+
+
+def perceptual_hash(image_path, hash_size=8, highfreq_factor=4):
+    """
+    pHash de 64 bits: DCT de la imagen en gris reducida a 32x32 y un bit por
+    coeficiente de baja frecuencia según esté por encima de la mediana.
+    Devuelve un entero, o None si la imagen no se puede leer.
+    """
+    # La decodificación reducida de JPEG es mucho más rápida y basta para 32x32
+    image = cv2.imread(str(image_path), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if image is None:
+        return None
+    size = hash_size * highfreq_factor
+    small = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:hash_size, :hash_size]
+    bits = (low_frequencies > np.median(low_frequencies)).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def build_hash_index(image_paths, workers=None, index_path=None):
+    """
+    pHash de todas las imágenes calculados en paralelo (cv2 libera el GIL al
+    decodificar). Con index_path se reutilizan los hashes de las imágenes cuyo
+    tamaño y mtime no han cambiado y se guarda el índice actualizado.
+    Devuelve la lista de hashes en el orden de image_paths.
+    """
+    image_paths = [str(path) for path in image_paths]
+    previous = {}
+    if index_path and os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+
+    signatures = []
+    for path in image_paths:
+        stat = os.stat(path)
+        signatures.append((stat.st_size, stat.st_mtime_ns))
+
+    def image_hash(position):
+        entry = previous.get(os.path.abspath(image_paths[position]))
+        if entry and (entry['size'], entry['mtime_ns']) == signatures[position]:
+            return int(entry['phash'], 16) if entry['phash'] else None
+        return perceptual_hash(image_paths[position])
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        hashes = list(executor.map(image_hash, range(len(image_paths))))
+
+    if index_path:
+        index = {os.path.abspath(path): {'size': size, 'mtime_ns': mtime_ns,
+                                         'phash': f"{value:016x}" if value is not None else None}
+                 for path, (size, mtime_ns), value in zip(image_paths, signatures, hashes)}
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+    return hashes
+
+
+def band_masks(bands, bits=HASH_BITS):
+    """Desplazamiento y máscara de cada banda, repartiendo los bits lo más igual posible"""
+    masks, shift = [], 0
+    for band in range(bands):
+        width = bits // bands + (1 if band < bits % bands else 0)
+        masks.append((shift, (1 << width) - 1))
+        shift += width
+    return masks
+
+
+def near_duplicate_pairs(hashes, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Pares (i, j) con distancia de Hamming <= max_distance usando LSH por
+    bandas: si dos hashes difieren en d bits o menos, al menos una de las d+1
+    bandas es idéntica, así que solo se comparan las imágenes que comparten
+    alguna banda en lugar de todas contra todas.
+    """
+    buckets = defaultdict(list)
+    masks = band_masks(max_distance + 1)
+    for position, value in enumerate(hashes):
+        if value is None:
+            continue
+        for band, (shift, mask) in enumerate(masks):
+            buckets[(band, (value >> shift) & mask)].append(position)
+
+    pairs = {}
+    for members in buckets.values():
+        for offset, first in enumerate(members):
+            for second in members[offset + 1:]:
+                if (first, second) not in pairs:
+                    distance = (hashes[first] ^ hashes[second]).bit_count()
+                    if distance <= max_distance:
+                        pairs[(first, second)] = distance
+    return pairs
+
+
+def cluster_near_duplicates(hashes, max_distance=DEFAULT_MAX_DISTANCE, pairs=None):
+    """
+    Agrupa las imágenes casi duplicadas (componentes conexas de los pares
+    cercanos, que se calculan si no se pasan). Devuelve para cada imagen el
+    identificador de su grupo, que es la posición de uno de sus miembros.
+    """
+    parent = list(range(len(hashes)))
+
+    def find(position):
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    if pairs is None:
+        pairs = near_duplicate_pairs(hashes, max_distance)
+    for first, second in pairs:
+        root_first, root_second = find(first), find(second)
+        if root_first != root_second:
+            parent[max(root_first, root_second)] = min(root_first, root_second)
+    return [find(position) for position in range(len(hashes))]
+
+
+def split_by_cluster(clusters, ratios=(('train', 0.7), ('valid', 0.2), ('test', 0.1)), seed=42):
+    """
+    Reparte grupos completos entre los splits: los grupos se barajan y se
+    asignan en orden hasta completar la proporción de cada split, de modo que
+    dos casi duplicados nunca acaban en splits distintos.
+    Devuelve el split de cada imagen.
+    """
+    groups = defaultdict(list)
+    for position, cluster in enumerate(clusters):
+        groups[cluster].append(position)
+    order = sorted(groups)
+    random.Random(seed).shuffle(order)
+
+    total = sum(fraction for _, fraction in ratios)
+    boundaries = np.cumsum([fraction / total * len(clusters) for _, fraction in ratios])
+    assignment = [None] * len(clusters)
+    assigned, current = 0, 0
+    for cluster in order:
+        while current < len(ratios) - 1 and assigned >= boundaries[current]:
+            current += 1
+        for position in groups[cluster]:
+            assignment[position] = ratios[current][0]
+        assigned += len(groups[cluster])
+    return assignment
+
+
+def cross_split_duplicates(paths, splits, hashes, max_distance=DEFAULT_MAX_DISTANCE, pairs=None):
+    """Pares de casi duplicados que están en splits distintos (fugas entre train y test)"""
+    if pairs is None:
+        pairs = near_duplicate_pairs(hashes, max_distance)
+    return [
+        {'first': str(paths[first]), 'second': str(paths[second]),
+         'splits': [splits[first], splits[second]], 'distance': distance}
+        for (first, second), distance in sorted(pairs.items())
+        if splits[first] != splits[second]
+    ]
+
+
+def dataset_images(dataset_path):
+    """Imágenes de un dataset YOLO (split/images) con el split de cada una"""
+    paths, splits = [], []
+    for split in sorted(os.listdir(dataset_path)):
+        images_dir = os.path.join(dataset_path, split, 'images')
+        if not os.path.isdir(images_dir):
+            continue
+        with os.scandir(images_dir) as entries:
+            names = sorted(entry.name for entry in entries if entry.name.lower().endswith(IMAGE_EXTENSIONS))
+        paths += [os.path.join(images_dir, name) for name in names]
+        splits += [split] * len(names)
+    return paths, splits
+
+
+def check_leakage(dataset_path, max_distance=DEFAULT_MAX_DISTANCE, workers=None):
+    """Informe de casi duplicados de un dataset YOLO, en especial los que cruzan splits"""
+    paths, splits = dataset_images(dataset_path)
+    hashes = build_hash_index(paths, workers, os.path.join(dataset_path, INDEX_NAME))
+    pairs = near_duplicate_pairs(hashes, max_distance)
+    clusters = cluster_near_duplicates(hashes, max_distance, pairs)
+    sizes = defaultdict(int)
+    for cluster in clusters:
+        sizes[cluster] += 1
+    leaks = cross_split_duplicates(paths, splits, hashes, max_distance, pairs)
+    by_splits = defaultdict(int)
+    for leak in leaks:
+        by_splits['/'.join(sorted(leak['splits']))] += 1
+    return {
+        'images': len(paths),
+        'unreadable': sum(value is None for value in hashes),
+        'duplicate_groups': sum(size > 1 for size in sizes.values()),
+        'images_in_groups': sum(size for size in sizes.values() if size > 1),
+        'cross_split_pairs': dict(by_splits),
+        'leaks': leaks
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detecta imágenes casi duplicadas entre los splits de un dataset YOLO")
+    parser.add_argument('dataset', help="Directorio con train/valid/test (o val)")
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--output', help="Guarda el informe completo en JSON")
+    args = parser.parse_args(argv)
+
+    report = check_leakage(args.dataset, args.max_distance, args.workers)
+    print(f"Imágenes: {report['images']} ({report['unreadable']} ilegibles)")
+    print(f"Grupos de casi duplicados: {report['duplicate_groups']} ({report['images_in_groups']} imágenes)")
+    if report['cross_split_pairs']:
+        print("Pares casi duplicados entre splits:")
+        for splits, count in report['cross_split_pairs'].items():
+            print(f"- {splits}: {count}")
+    else:
+        print("No hay casi duplicados entre splits")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if report['leaks'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,52 +1,42 @@
 import os
-import shutil
-from pathlib import Path
 
-def rename_logo_files(images_dir, annotations_dir, output_dir, prefix='logo'):
+try:
+    from .dataset_index import INDEX_NAME, load_index, pair_by_stem, register_pairs, save_index
+except ImportError:
+    # Ejecutado como script desde data/metodos_data
+    from dataset_index import INDEX_NAME, load_index, pair_by_stem, register_pairs, save_index
+
+def rename_logo_files(images_dir, annotations_dir, output_dir, prefix='logo', brand=None):
     """
-    Renombra archivos de imágenes y sus correspondientes archivos XML de anotaciones
-    con el mismo nombre base y los coloca en el directorio de salida.
+    Da un nombre común (prefix_0001, prefix_0002...) a cada imagen y a su
+    archivo XML de anotaciones, emparejados por nombre base. No copia nada:
+    los nombres se guardan en output_dir/dataset_index.json, que
+    organize_dataset usa para enlazar los ficheros originales.
     
     Args:
         images_dir (str): Directorio que contiene las imágenes
         annotations_dir (str): Directorio que contiene los archivos XML
-        output_dir (str): Directorio donde se guardarán los archivos renombrados
+        output_dir (str): Directorio de la marca donde se guarda el índice
         prefix (str): Prefijo para los nuevos nombres de archivo
+        brand (str): Marca de las imágenes (por defecto, el nombre de output_dir)
+
+    Las imágenes sin XML se registran sin anotación (background). Volver a
+    ejecutar mantiene los nombres ya asignados y numera solo las nuevas.
     """
-    # Crear el directorio de salida si no existe
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Obtener lista de imágenes
-    image_files = [f for f in os.listdir(images_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-    xml_files = [f for f in os.listdir(annotations_dir) if f.lower().endswith('.xml')]
-    
-    # Verificar que hay el mismo número de imágenes y archivos XML
-    if len(image_files) != len(xml_files):
-        print(f"¡Advertencia! Número diferente de imágenes ({len(image_files)}) y archivos XML ({len(xml_files)})")
-    
-    # Renombrar y mover archivos
-    for idx, (img_file, xml_file) in enumerate(zip(sorted(image_files), sorted(xml_files))):
-        # Generar nuevos nombres
-        new_name = f"{prefix}_{str(idx+1).zfill(4)}"
-        
-        # Obtener extensión original de la imagen
-        img_ext = Path(img_file).suffix
-        
-        # Rutas completas para los nuevos archivos
-        new_img_path = os.path.join(output_dir, f"{new_name}{img_ext}")
-        new_xml_path = os.path.join(output_dir, f"{new_name}.xml")
-        
-        # Copiar y renombrar archivos
-        shutil.copy2(
-            os.path.join(images_dir, img_file),
-            new_img_path
-        )
-        shutil.copy2(
-            os.path.join(annotations_dir, xml_file),
-            new_xml_path
-        )
-        
-        print(f"Procesado {idx+1}: {img_file} → {new_name}{img_ext}")
+    brand = brand or os.path.basename(os.path.normpath(output_dir))
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    entries = load_index(index_path)
+
+    pairs, orphans = pair_by_stem(images_dir, annotations_dir)
+    missing = sum(annotation is None for _, annotation in pairs)
+    if missing or orphans:
+        print(f"¡Advertencia! {missing} imágenes sin XML y {len(orphans)} archivos XML sin imagen")
+
+    registered = register_pairs(entries, brand, pairs, prefix)
+    save_index(index_path, entries)
+    for name, entry in sorted(registered.items()):
+        print(f"Registrado {os.path.basename(entry['image'])} → {name}")
+    return registered
 
 # Ejemplo de uso
 if __name__ == "__main__":
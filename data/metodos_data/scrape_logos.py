@@ -1,61 +1,384 @@
 from icrawler.builtin import GoogleImageCrawler
+from icrawler import ImageDownloader
 import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def scrape_logos(search_term, num_images, output_dir):
+import cv2
+import numpy as np
+import requests
+
+MANIFEST_NAME = 'downloads.db'
+# Peticiones por segundo entre todas las búsquedas y todos los hilos
+DEFAULT_RATE = 4.0
+DEFAULT_WORKERS = 8
+# Las imágenes se guardan con el lado largo como mucho MAX_SIDE y se
+# descartan las que tienen el lado corto menor que MIN_SIDE
+MAX_SIDE = 1280
+MIN_SIDE = 64
+# Intentos de una URL que falla por red antes de darla por perdida
+MAX_ATTEMPTS = 3
+# Se piden más URLs de las necesarias porque parte falla o está repetida
+OVERSAMPLE = 1.5
+# Google no devuelve más allá de los primeros 1000 resultados de una búsqueda
+GOOGLE_MAX_RESULTS = 1000
+USER_AGENT = 'Mozilla/5.0 (brand-detection dataset builder)'
+
+GOOGLE_FILTERS = {
+    'size': 'medium',
+    'license': 'commercial,modify',
+    'type': 'photo'
+}
+
+def scrape_logos(search_term, num_images, output_dir, manifest_path=None):
     """
     Descarga imágenes de Google usando icrawler
-    
+
     Args:
         search_term: término de búsqueda (ej: "adidas logo")
         num_images: número de imágenes a descargar
         output_dir: directorio donde guardar las imágenes
+        manifest_path: manifiesto de descargas (por defecto, compartido en el
+            directorio padre para no repetir imágenes entre marcas)
+
+    Las imágenes ya descargadas en ejecuciones anteriores cuentan para
+    num_images, así que volver a ejecutar solo descarga lo que falta.
     """
-    # Crear el directorio si no existe
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # Configurar el crawler
-    google_crawler = GoogleImageCrawler(
-        storage={'root_dir': output_dir},
+    manifest_path = manifest_path or os.path.join(os.path.dirname(os.path.abspath(output_dir)), MANIFEST_NAME)
+    print(f"Descargando {num_images} imágenes de '{search_term}'...")
+    summary = run_scraping([{'query': search_term, 'max_num': num_images, 'output_dir': output_dir}],
+                           manifest_path)
+    print(f"Descarga completada en {output_dir}: {summary[search_term]}")
+    return summary[search_term]
+
+def google_image_urls(query, max_num, offset=0, filters=GOOGLE_FILTERS):
+    """
+    Hasta max_num URLs de imágenes de una búsqueda de Google a partir del
+    resultado offset. icrawler solo se usa para buscar y parsear los
+    resultados; la descarga la hace run_scraping.
+    """
+    urls = []
+    max_num = min(max_num, GOOGLE_MAX_RESULTS - offset)
+    if max_num <= 0:
+        return urls
+
+    class URLCollector(ImageDownloader):
+        def download(self, task, default_ext, timeout=5, max_retry=3, overwrite=False, **kwargs):
+            with self.lock:
+                if self.reach_max_num():
+                    self.signal.set(reach_max_num=True)
+                    return
+                urls.append(task['file_url'])
+                self.fetched_num += 1
+
+    crawler = GoogleImageCrawler(
+        downloader_cls=URLCollector,
+        storage={'root_dir': os.path.join(os.path.expanduser('~'), '.cache', 'icrawler')},
         feeder_threads=1,
         parser_threads=1,
-        downloader_threads=4
+        downloader_threads=1
     )
-    
-    # Configurar los filtros de búsqueda
-    filters = {
-        'size': 'medium',
-        'license': 'commercial,modify',
-        'type': 'photo'
-    }
-    
-    print(f"Descargando {num_images} imágenes de '{search_term}'...")
-    
-    # Realizar la búsqueda y descarga
-    google_crawler.crawl(
-        keyword=search_term,
-        max_num=num_images,
-        filters=filters,
-        file_idx_offset=0
-    )
-    
-    print(f"Descarga completada en {output_dir}")
+    crawler.crawl(keyword=query, offset=offset, max_num=max_num, filters=filters)
+    return urls
+
+class RateLimiter:
+    """Reparte las peticiones de todos los hilos a como mucho `rate` por segundo"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class DownloadManifest:
+    """
+    Registro en SQLite de cada URL intentada: estado ('ok', 'duplicate',
+    'invalid' o 'error'), hash del contenido, fichero guardado y dimensiones.
+    Permite reanudar sin volver a pedir URLs y descartar contenido repetido
+    aunque venga de URLs distintas. También guarda hasta qué resultado se ha
+    recorrido cada búsqueda, para que al reanudar no se vuelva a empezar.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                url TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                status TEXT NOT NULL,
+                content_hash TEXT,
+                file_path TEXT,
+                width INTEGER,
+                height INTEGER,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_hash ON downloads(content_hash)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_query ON downloads(query, status)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS searches (
+                query TEXT PRIMARY KEY,
+                next_offset INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def pending(self, urls):
+        """URLs que hay que descargar: nuevas, con error reintentable o cuyo fichero ya no existe"""
+        with self._lock:
+            known = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT url, status, attempts, file_path FROM downloads "
+                "WHERE url IN (SELECT value FROM json_each(?))", (json.dumps(list(urls)),))}
+        result = []
+        for url in dict.fromkeys(urls):
+            status, attempts, file_path = known.get(url, (None, 0, None))
+            if status is None or (status == 'error' and attempts < MAX_ATTEMPTS) or \
+                    (status == 'ok' and not (file_path and os.path.exists(file_path))):
+                result.append(url)
+        return result
+
+    def count(self, query):
+        """Imágenes descargadas para query cuyo fichero sigue en disco"""
+        with self._lock:
+            paths = [row[0] for row in self.conn.execute(
+                "SELECT file_path FROM downloads WHERE query = ? AND status = 'ok'", (query,))]
+        return sum(1 for path in paths if path and os.path.exists(path))
+
+    def retries(self, query):
+        """URLs ya vistas de query que hay que volver a descargar (ver pending)"""
+        with self._lock:
+            urls = [row[0] for row in self.conn.execute(
+                "SELECT url FROM downloads WHERE query = ? AND status IN ('ok', 'error') ORDER BY rowid",
+                (query,))]
+        return self.pending(urls)
+
+    def search_offset(self, query):
+        """Primer resultado de la búsqueda que todavía no se ha usado"""
+        with self._lock:
+            row = self.conn.execute("SELECT next_offset FROM searches WHERE query = ?", (query,)).fetchone()
+        return row[0] if row else 0
+
+    def set_search_offset(self, query, offset):
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO searches (query, next_offset) VALUES (?, ?)
+                ON CONFLICT(query) DO UPDATE SET next_offset = MAX(next_offset, excluded.next_offset)
+            """, (query, offset))
+            self.conn.commit()
+
+    def claim_content(self, url, query, content_hash):
+        """
+        Registra que url tiene content_hash. Devuelve False (y la marca como
+        duplicada) si ese contenido ya está guardado desde otra URL.
+        """
+        with self._lock:
+            existing = self.conn.execute(
+                "SELECT url FROM downloads WHERE content_hash = ? AND status = 'ok' AND url != ?",
+                (content_hash, url)).fetchone()
+            if existing:
+                self._record(url, query, 'duplicate', content_hash=content_hash, error=existing[0])
+                return False
+            # Reserva el hash para que otro hilo con el mismo contenido lo vea
+            self._record(url, query, 'ok', content_hash=content_hash)
+            return True
+
+    def record(self, url, query, status, **fields):
+        with self._lock:
+            self._record(url, query, status, **fields)
+
+    def _record(self, url, query, status, content_hash=None, file_path=None, width=None, height=None,
+                error=None):
+        self.conn.execute("""
+            INSERT INTO downloads (url, query, status, content_hash, file_path, width, height, error, attempts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT(url) DO UPDATE SET
+                status = excluded.status,
+                content_hash = COALESCE(excluded.content_hash, downloads.content_hash),
+                file_path = COALESCE(excluded.file_path, downloads.file_path),
+                width = excluded.width, height = excluded.height, error = excluded.error,
+                attempts = downloads.attempts + (excluded.status = 'error'),
+                updated_at = datetime('now')
+        """, (url, query, status, content_hash, file_path, width, height, error))
+        self.conn.commit()
+
+def ingest_image(content, output_dir, content_hash, max_side=MAX_SIDE, min_side=MIN_SIDE):
+    """
+    Valida que el contenido es una imagen decodificable y suficientemente
+    grande, la reduce para que su lado largo no pase de max_side y la guarda
+    como JPEG con el hash del contenido como nombre. Devuelve (ruta, ancho,
+    alto), lanza ValueError si la imagen no es válida y OSError si no se puede
+    guardar.
+    """
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("El contenido no es una imagen")
+    height, width = image.shape[:2]
+    if min(height, width) < min_side:
+        raise ValueError(f"Imagen demasiado pequeña ({width}x{height})")
+    scale = max_side / max(height, width)
+    if scale < 1:
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    file_path = os.path.join(output_dir, f"{content_hash[:16]}.jpg")
+    if not cv2.imwrite(file_path, image, [cv2.IMWRITE_JPEG_QUALITY, 92]):
+        raise OSError(f"No se pudo guardar {file_path}")
+    return file_path, width, height
+
+_sessions = threading.local()
+
+def http_session():
+    """Una sesión de requests por hilo (reutiliza conexiones sin compartir estado)"""
+    if not hasattr(_sessions, 'session'):
+        _sessions.session = requests.Session()
+        _sessions.session.headers['User-Agent'] = USER_AGENT
+    return _sessions.session
+
+def fetch_one(url, job, manifest, limiter, timeout=10, max_side=MAX_SIDE, min_side=MIN_SIDE):
+    """Descarga, valida y guarda una URL. Devuelve el estado registrado en el manifiesto"""
+    query = job['query']
+    limiter.acquire()
+    try:
+        response = http_session().get(url, timeout=timeout)
+        response.raise_for_status()
+        content = response.content
+    except requests.RequestException as e:
+        status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+        # Los 4xx no se arreglan reintentando
+        status = 'invalid' if status_code and 400 <= status_code < 500 else 'error'
+        manifest.record(url, query, status, error=str(e))
+        return status
+
+    content_hash = hashlib.sha256(content).hexdigest()
+    if not manifest.claim_content(url, query, content_hash):
+        return 'duplicate'
+    try:
+        file_path, width, height = ingest_image(content, job['output_dir'], content_hash, max_side, min_side)
+    except ValueError as e:
+        manifest.record(url, query, 'invalid', content_hash=content_hash, error=str(e))
+        return 'invalid'
+    except (cv2.error, OSError) as e:
+        # OpenCV no puede decodificarla (p. ej. demasiados píxeles) o el disco
+        # falla: se registra como error para reintentarla en otra ejecución
+        manifest.record(url, query, 'error', content_hash=content_hash, error=str(e))
+        return 'error'
+    manifest.record(url, query, 'ok', content_hash=content_hash, file_path=file_path, width=width, height=height)
+    return 'ok'
+
+def run_job(job, manifest, limiter, downloads, url_source, **fetch_options):
+    """
+    Completa una búsqueda: reintenta primero las URLs suyas que fallaron o
+    cuyo fichero ha desaparecido, después pide resultados nuevos a partir de
+    donde se quedó la ejecución anterior y lanza en el pool compartido solo
+    las descargas que faltan para llegar a max_num, reponiendo las que fallan
+    con más resultados.
+    """
+    query, max_num = job['query'], job['max_num']
+    os.makedirs(job['output_dir'], exist_ok=True)
+    already = manifest.count(query)
+    summary = {'ok': 0, 'duplicate': 0, 'invalid': 0, 'error': 0, 'previous': already}
+    if already >= max_num:
+        summary['total'] = already
+        return summary
+
+    needed = max_num - already
+    requested = max(1, int(needed * OVERSAMPLE))
+    offset = manifest.search_offset(query)
+    # Pares (posición en la búsqueda, URL); los reintentos no avanzan la búsqueda
+    urls = [(None, url) for url in manifest.retries(query)]
+    # Descargas en curso: future -> URL
+    running = {}
+    while True:
+        if not urls and not running and summary['ok'] < needed:
+            # Sin candidatas suficientes se piden más resultados a la búsqueda
+            # Las búsquedas cuentan para el mismo límite que las descargas
+            limiter.acquire()
+            candidates = url_source(query, requested, offset)
+            if not candidates:
+                break
+            pending = set(manifest.pending(candidates))
+            urls = [(offset + i, url) for i, url in enumerate(candidates) if url in pending]
+            offset += len(candidates)
+            requested = int(requested * 2)
+        while urls and summary['ok'] + len(running) < needed:
+            _, url = urls.pop(0)
+            running[downloads.submit(fetch_one, url, job, manifest, limiter, **fetch_options)] = url
+        if not running:
+            if urls or summary['ok'] >= needed:
+                break
+            continue
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            url = running.pop(future)
+            try:
+                status = future.result()
+            except Exception as e:
+                # Un fallo inesperado con una URL (p. ej. del manifiesto) no
+                # detiene la búsqueda: la URL queda como error si se puede anotar
+                print(f"Error descargando {url}: {e}")
+                status = 'error'
+                try:
+                    manifest.record(url, query, status, error=str(e))
+                except sqlite3.Error:
+                    pass
+            summary[status] += 1
+    # Las candidatas que no se han llegado a usar quedan para la próxima vez
+    manifest.set_search_offset(query, min((position for position, _ in urls if position is not None),
+                                          default=offset))
+    summary['total'] = already + summary['ok']
+    return summary
+
+def run_scraping(jobs, manifest_path, url_source=google_image_urls, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE,
+                 search_workers=4, timeout=10, max_side=MAX_SIDE, min_side=MIN_SIDE):
+    """
+    Ejecuta varias búsquedas a la vez. jobs es una lista de diccionarios con
+    query, max_num y output_dir. Todas las descargas comparten un pool de
+    `workers` hilos y un límite global de `rate` peticiones por segundo, y
+    quedan registradas en el manifiesto, que sirve para reanudar y para no
+    guardar dos veces el mismo contenido. url_source(query, n, offset)
+    devuelve hasta n URLs candidatas a partir del resultado offset (Google
+    por defecto).
+    Devuelve un resumen por búsqueda.
+    """
+    manifest = DownloadManifest(manifest_path)
+    limiter = RateLimiter(rate)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as downloads, \
+                ThreadPoolExecutor(max_workers=search_workers) as searches:
+            futures = {job['query']: searches.submit(run_job, job, manifest, limiter, downloads, url_source,
+                                                     timeout=timeout, max_side=max_side, min_side=min_side)
+                       for job in jobs}
+            return {query: future.result() for query, future in futures.items()}
+    finally:
+        manifest.close()
 
 # Ejemplo de uso
 if __name__ == "__main__":
     # Directorio base para el dataset
     base_dir = "dataset"
-    
-    # Descargar logos de Adidas
-    # scrape_logos(
-    #     search_term="adidas futbol",
-    #     num_images=100,
-    #     output_dir=os.path.join(base_dir, "images", "adidas")
-    # )
-    
-    # Descargar logos de Puma
-    scrape_logos(
-        search_term="puma borussia dortmund",
-        num_images=300,
-        output_dir=os.path.join(base_dir, "images", "puma")
-    )
\ No newline at end of file
+
+    # Todas las búsquedas a la vez, con un límite de peticiones común
+    summary = run_scraping([
+        {'query': "adidas futbol", 'max_num': 100, 'output_dir': os.path.join(base_dir, "images", "adidas")},
+        {'query': "puma borussia dortmund", 'max_num': 300, 'output_dir': os.path.join(base_dir, "images", "puma")},
+    ], manifest_path=os.path.join(base_dir, "images", MANIFEST_NAME))
+    for query, result in summary.items():
+        print(f"{query}: {result}")
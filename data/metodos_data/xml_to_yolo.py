@@ -1,72 +1,47 @@
 import os
-import xml.etree.ElementTree as ET
 from pathlib import Path
 import shutil
 
+try:
+    from .annotations import CLASS_NAMES, format_yolo_lines, read_annotation, yolo_objects
+    from .dataset_manifest import (existing_outputs, file_record, is_up_to_date, load_manifest,
+                                   remove_outputs, save_manifest, text_hash)
+except ImportError:
+    # Ejecutado como script desde data/metodos_data
+    from annotations import CLASS_NAMES, format_yolo_lines, read_annotation, yolo_objects
+    from dataset_manifest import (existing_outputs, file_record, is_up_to_date, load_manifest,
+                                  remove_outputs, save_manifest, text_hash)
+
 def convert_xml_to_yolo(xml_path, image_width, image_height):
     """
     Convierte las coordenadas de formato XML a formato YOLO
     YOLO format: <class> <x_center> <y_center> <width> <height>
     Valores normalizados entre 0 y 1
     """
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    
-    yolo_annotations = []
-    
-    for obj in root.findall('.//object'):
-        # Obtener el nombre de la clase
-        class_name = obj.find('name').text.lower()
-        
-        # Mapear nombres de clase a índices
-        class_mapping = {'adidas': 0, 'puma': 1}
-        
-        # Solo procesar si la clase está en nuestro mapping
-        if class_name not in class_mapping:
-            continue
-            
-        class_idx = class_mapping[class_name]
-        
-        # Obtener el bounding box
-        bbox = obj.find('bndbox')
-        xmin = float(bbox.find('xmin').text)
-        ymin = float(bbox.find('ymin').text)
-        xmax = float(bbox.find('xmax').text)
-        ymax = float(bbox.find('ymax').text)
-        
-        # Convertir a formato YOLO (normalizado)
-        x_center = ((xmin + xmax) / 2) / image_width
-        y_center = ((ymin + ymax) / 2) / image_height
-        width = (xmax - xmin) / image_width
-        height = (ymax - ymin) / image_height
-        
-        # Asegurarse de que los valores estén entre 0 y 1
-        x_center = min(max(x_center, 0.0), 1.0)
-        y_center = min(max(y_center, 0.0), 1.0)
-        width = min(max(width, 0.0), 1.0)
-        height = min(max(height, 0.0), 1.0)
-        
-        yolo_annotations.append(f"{class_idx} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}")
-    
-    return yolo_annotations
+    annotation = read_annotation(xml_path)
+    annotation.update(width=image_width, height=image_height)
+    return annotation_to_yolo(annotation)
+
+def annotation_to_yolo(annotation):
+    """Líneas YOLO de una anotación ya leída, con las cajas limitadas a [0, 1]"""
+    _, class_ids, boxes = yolo_objects(annotation, clip=True)
+    return format_yolo_lines(class_ids, boxes)
 
 def get_image_dimensions(xml_path):
     """Obtiene las dimensiones de la imagen del archivo XML"""
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    
-    size = root.find('size')
-    if size is not None:
-        width = float(size.find('width').text)
-        height = float(size.find('height').text)
-        return width, height
-    return None, None
+    annotation = read_annotation(xml_path)
+    return annotation['width'], annotation['height']
 
-def process_dataset(input_path, output_path):
+def process_dataset(input_path, output_path, rebuild=False):
     """
     Procesa todo el dataset convirtiendo anotaciones XML a formato YOLO
-    y organizando los archivos en la estructura requerida por YOLOv8
+    y organizando los archivos en la estructura requerida por YOLOv8.
+    Con el manifiesto de la ejecución anterior solo se copian y convierten las
+    imágenes nuevas o modificadas y se borran las que ya no están en origen;
+    rebuild=True ignora el manifiesto.
     """
+    splits = ['train', 'valid', 'test']
+
     # Crear directorios de salida
     os.makedirs(output_path, exist_ok=True)
     
@@ -77,15 +52,20 @@ train: train/images
 val: valid/images
 test: test/images
 
-nc: 2
-names: ['adidas', 'puma']
-    """.format(dataset_path=output_path)
+nc: {nc}
+names: {names}
+    """.format(dataset_path=output_path, nc=len(CLASS_NAMES), names=list(CLASS_NAMES))
     
     with open(os.path.join(output_path, 'data.yaml'), 'w') as f:
         f.write(yaml_content.strip())
+
+    previous = {} if rebuild else load_manifest(output_path)
+    outputs = existing_outputs(output_path, splits)
+    entries = {}
+    updated = 0
     
     # Procesar cada split (train, valid, test)
-    for split in ['train', 'valid', 'test']:
+    for split in splits:
         # Crear directorios para el split actual
         split_img_dir = os.path.join(output_path, split, 'images')
         split_label_dir = os.path.join(output_path, split, 'labels')
@@ -95,41 +75,67 @@ names: ['adidas', 'puma']
         # Directorios de entrada
         input_images_dir = os.path.join(input_path, split, 'images')
         input_labels_dir = os.path.join(input_path, split, 'labels')
+        labels = set(os.listdir(input_labels_dir)) if os.path.isdir(input_labels_dir) else set()
         
         # Procesar cada imagen en el split
-        for img_file in os.listdir(input_images_dir):
+        for img_file in sorted(os.listdir(input_images_dir)):
             if img_file.endswith(('.jpg', '.jpeg', '.png')):
-                # Copiar imagen
+                key = f"{split}/{img_file}"
+                base_name = os.path.splitext(img_file)[0]
                 src_img = os.path.join(input_images_dir, img_file)
+                xml_file = os.path.join(input_labels_dir, f"{base_name}.xml")
+                entry = previous.get(key) or {}
+                image_record = file_record(src_img, entry.get('image'))
+                annotation_record = (file_record(xml_file, entry.get('annotation'))
+                                     if f"{base_name}.xml" in labels else None)
+
+                # Sin cambios desde la última ejecución
+                if is_up_to_date(previous.get(key), image_record, annotation_record, outputs):
+                    entries[key] = {**entry, 'image': image_record, 'annotation': annotation_record}
+                    continue
+                updated += 1
+                if key in previous:
+                    remove_outputs(output_path, previous[key])
+
+                # Copiar imagen
                 dst_img = os.path.join(split_img_dir, img_file)
                 shutil.copy2(src_img, dst_img)
+                entries[key] = {'image': image_record, 'annotation': annotation_record, 'split': split,
+                                'image_output': f"{split}/images/{img_file}", 'label_output': None,
+                                'label_hash': None}
                 
                 # Procesar anotación si existe
-                base_name = os.path.splitext(img_file)[0]
-                xml_file = os.path.join(input_labels_dir, f"{base_name}.xml")
-                
-                if os.path.exists(xml_file):
+                txt_file = os.path.join(split_label_dir, f"{base_name}.txt")
+                if annotation_record:
                     try:
-                        # Obtener dimensiones de la imagen
-                        width, height = get_image_dimensions(xml_file)
-                        if width is None or height is None:
+                        # Una sola lectura del XML para dimensiones y objetos
+                        annotation = read_annotation(xml_file)
+                        if annotation['width'] is None or annotation['height'] is None:
                             print(f"Warning: No se pudieron obtener dimensiones para {img_file}")
                             continue
                         
                         # Convertir anotaciones
-                        yolo_annotations = convert_xml_to_yolo(xml_file, width, height)
-                        
-                        # Guardar anotaciones en formato YOLO
-                        txt_file = os.path.join(split_label_dir, f"{base_name}.txt")
-                        with open(txt_file, 'w') as f:
-                            f.write('\n'.join(yolo_annotations))
+                        label = '\n'.join(annotation_to_yolo(annotation))
                     except Exception as e:
                         print(f"Error procesando {xml_file}: {str(e)}")
+                        continue
                 else:
                     # Crear archivo vacío para imágenes sin anotaciones (background)
-                    txt_file = os.path.join(split_label_dir, f"{base_name}.txt")
-                    with open(txt_file, 'w') as f:
-                        f.write("")
+                    label = ""
+
+                # Guardar anotaciones en formato YOLO
+                with open(txt_file, 'w') as f:
+                    f.write(label)
+                entries[key].update({'label_output': f"{split}/labels/{base_name}.txt",
+                                     'label_hash': text_hash(label)})
+
+    # Borrar lo generado para imágenes que ya no están en origen
+    deleted = [key for key in previous if key not in entries]
+    for key in deleted:
+        remove_outputs(output_path, previous[key])
+
+    save_manifest(output_path, entries)
+    print(f"Imágenes actualizadas: {updated}, sin cambios: {len(entries) - updated}, borradas: {len(deleted)}")
 
 if __name__ == "__main__":
     # Rutas de entrada y salida
@@ -1,64 +1,96 @@
 import os
-import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from sklearn.model_selection import train_test_split
-import glob
-import xml.etree.ElementTree as ET
+from metodos_data.annotations import CLASS_MAP, CLASS_NAMES, read_annotation, yolo_objects
+from metodos_data.dataset_manifest import (LINK_MODES, assign_split, entry_outputs, existing_outputs,
+                                          file_record, is_up_to_date, load_manifest, place_file,
+                                          remove_outputs, remove_stale_outputs, save_manifest, text_hash)
+
+# Cada cuántos ficheros se informa del avance de cada fase
+PROGRESS_EVERY = 500
 
 def read_xml_annotation(xml_path):
     """
-    Lee un archivo XML de anotación y extrae las marcas presentes
+    Lee un archivo XML de anotación y extrae las marcas presentes con su
+    bounding box en formato YOLO (x_center, y_center, width, height)
+    """
+    names, _, boxes = yolo_objects(read_annotation(xml_path))
+    return [{'name': name, 'bbox': bbox} for name, bbox in zip(names, boxes.tolist())]
+
+def report_progress(phase, done, total, progress_callback=None, every=PROGRESS_EVERY):
+    """Informa del avance de una fase cada `every` ficheros y al terminar"""
+    if progress_callback:
+        progress_callback(phase, done, total)
+    elif done % every == 0 or done == total:
+        print(f"[{phase}] {done}/{total} archivos")
+
+def scan_dataset(images_dir, annotations_dir):
+    """
+    Lista una sola vez los dos directorios y devuelve, ordenados por nombre,
+    los pares (imagen, xml) que tienen ambos ficheros. El orden fijo hace que
+    la división en splits no dependa del sistema de ficheros ni de los workers.
+    """
+    with os.scandir(images_dir) as entries:
+        images = {entry.name[:-4] for entry in entries if entry.name.endswith('.jpg')}
+    with os.scandir(annotations_dir) as entries:
+        annotations = sorted(entry.name[:-4] for entry in entries if entry.name.endswith('.xml'))
+    return [(os.path.join(images_dir, f"{name}.jpg"), os.path.join(annotations_dir, f"{name}.xml"))
+            for name in annotations if name in images]
+
+def write_split_file(task):
+    """
+    Coloca la imagen de un split y escribe su fichero de etiquetas YOLO.
+    Devuelve el hash de la etiqueta para el manifiesto.
     """
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    brands = []
-    
-    # Buscar todos los objetos en la anotación
-    for obj in root.findall('.//object'):
-        name = obj.find('name').text.lower()
-        if name in ['adidas', 'puma', 'nike']:  # Añadido nike
-            # Obtener coordenadas del bounding box
-            bbox = obj.find('bndbox')
-            xmin = float(bbox.find('xmin').text)
-            ymin = float(bbox.find('ymin').text)
-            xmax = float(bbox.find('xmax').text)
-            ymax = float(bbox.find('ymax').text)
-            
-            # Convertir a formato YOLO (x_center, y_center, width, height)
-            img_width = float(root.find('.//width').text)
-            img_height = float(root.find('.//height').text)
-            
-            x_center = (xmin + xmax) / (2.0 * img_width)
-            y_center = (ymin + ymax) / (2.0 * img_height)
-            width = (xmax - xmin) / img_width
-            height = (ymax - ymin) / img_height
-            
-            brands.append({
-                'name': name,
-                'bbox': [x_center, y_center, width, height]
-            })
-    
-    return brands
+    img_path, brands, split_dir, class_map, link_mode = task
+    place_file(img_path, os.path.join(split_dir, 'images', os.path.basename(img_path)), link_mode)
+
+    base_name = os.path.splitext(os.path.basename(img_path))[0]
+    label_path = os.path.join(split_dir, 'labels', f"{base_name}.txt")
+    label = ''.join(f"{class_map[brand['name']]} {' '.join(map(str, brand['bbox']))}\n" for brand in brands)
+    with open(label_path, 'w') as f:
+        f.write(label)
+    return text_hash(label)
 
 def prepare_yolo_dataset(
     qmul_path,
     output_path,
     train_size=0.7,
     val_size=0.15,
-    test_size=0.15
+    test_size=0.15,
+    workers=None,
+    link_mode='copy',
+    progress_callback=None,
+    rebuild=False
 ):
     """
     Prepara un dataset para YOLO a partir de QMUL-OpenLogo
+    workers: procesos para leer los XML e hilos para copiar (por defecto, los núcleos)
+    link_mode: 'copy', 'hardlink' o 'symlink' para llevar las imágenes al dataset
+        sin duplicarlas cuando origen y destino están en el mismo disco
+    progress_callback: función (fase, hechos, total) para informar del avance
+    rebuild: ignora el manifiesto y regenera todo el dataset
+    El resultado es el mismo con cualquier número de workers.
+
+    Junto a data.yaml se guarda un manifiesto con el tamaño, mtime y hash de
+    cada imagen y anotación, su split y el hash de su etiqueta. En las
+    siguientes ejecuciones solo se procesan las anotaciones nuevas, cambiadas
+    o borradas; las imágenes existentes conservan su split y las nuevas
+    reciben uno estable derivado de su nombre.
     """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"link_mode debe ser uno de {LINK_MODES}")
+    workers = workers or os.cpu_count() or 1
     print(f"Iniciando preparación del dataset...")
-    
+
     # Verificar directorios de entrada
     images_dir = os.path.join(qmul_path, 'JPEGImages')
     annotations_dir = os.path.join(qmul_path, 'Annotations')
-    
+
     if not all(os.path.exists(d) for d in [images_dir, annotations_dir]):
         print("Error: No se encuentran los directorios necesarios")
         return
-    
+
     # Crear estructura de directorios de salida
     splits = ['train', 'val', 'test']
     for split in splits:
@@ -67,66 +99,113 @@ def prepare_yolo_dataset(
     print("Directorios creados correctamente")
 
     # Mapeo de clases
-    class_map = {
-        'adidas': 0,
-        'puma': 1,
-        'nike': 2  # Añadido nike
-    }
+    class_map = CLASS_MAP
 
-    # Recolectar imágenes y anotaciones relevantes
-    relevant_files = []
+    # Fase 1: emparejar imágenes y anotaciones con un solo listado por directorio
     print("Analizando anotaciones...")
-    
-    # Listar todos los archivos XML
-    xml_files = glob.glob(os.path.join(annotations_dir, '*.xml'))
-    total_processed = 0
-    brand_counts = {'adidas': 0, 'puma': 0, 'nike': 0}
-    
-    for xml_path in xml_files:
-        base_name = os.path.splitext(os.path.basename(xml_path))[0]
-        img_path = os.path.join(images_dir, f"{base_name}.jpg")
-        
-        if not os.path.exists(img_path):
-            continue
-            
-        brands = read_xml_annotation(xml_path)
-        if brands:  # Si encontramos alguno de los logos
-            relevant_files.append((img_path, xml_path, brands))
-            # Contar logos por marca
-            for brand in brands:
-                brand_counts[brand['name']] += 1
-        
-        total_processed += 1
-        if total_processed % 100 == 0:
-            print(f"Procesados {total_processed} archivos...")
-    
-    print(f"\nEncontrados {len(relevant_files)} archivos con logos relevantes")
+    pairs = scan_dataset(images_dir, annotations_dir)
+    report_progress('escaneo', len(pairs), len(pairs), progress_callback)
+
+    # Fase 2: comparar con el manifiesto. Solo se calcula el hash de los
+    # ficheros cuyo tamaño o mtime ha cambiado
+    previous = {} if rebuild else load_manifest(output_path)
+    outputs = existing_outputs(output_path, splits)
+    keys = [os.path.splitext(os.path.basename(img_path))[0] for img_path, _ in pairs]
+
+    def source_records(item):
+        key, (img_path, xml_path) = item
+        entry = previous.get(key) or {}
+        return file_record(img_path, entry.get('image')), file_record(xml_path, entry.get('annotation'))
+
+    entries = {}
+    pending = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        records = executor.map(source_records, zip(keys, pairs))
+        for checked, (key, (img_path, xml_path), (image_record, annotation_record)) in enumerate(
+                zip(keys, pairs, records), 1):
+            entry = previous.get(key)
+            if is_up_to_date(entry, image_record, annotation_record, outputs):
+                entries[key] = {**entry, 'image': image_record, 'annotation': annotation_record}
+            else:
+                pending.append((key, img_path, xml_path, image_record, annotation_record))
+            report_progress('manifiesto', checked, len(pairs), progress_callback)
+    current = set(keys)
+    deleted = [key for key in previous if key not in current]
+    print(f"Sin cambios: {len(entries)}, nuevas o modificadas: {len(pending)}, borradas: {len(deleted)}")
+
+    for key in deleted:
+        remove_outputs(output_path, previous[key])
+
+    # Fase 3: leer y convertir en paralelo los XML pendientes. map conserva el
+    # orden de entrada, así que el resultado es igual con cualquier número de procesos
+    relevant_files = []
+    chunksize = max(1, len(pending) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        annotations = executor.map(read_xml_annotation, [item[2] for item in pending], chunksize=chunksize)
+        for processed, (item, brands) in enumerate(zip(pending, annotations), 1):
+            key, img_path, xml_path, image_record, annotation_record = item
+            if key in previous:
+                remove_outputs(output_path, previous[key])
+            entries[key] = {'image': image_record, 'annotation': annotation_record, 'split': None,
+                            'brands': [brand['name'] for brand in brands], 'label_hash': None}
+            if brands:  # Si encontramos alguno de los logos
+                relevant_files.append((img_path, xml_path, brands))
+            report_progress('anotaciones', processed, len(pending), progress_callback)
+
+    # Dividir en train/val/test. En la primera construcción se reparte todo
+    # como siempre; después cada imagen conserva su split y las nuevas reciben
+    # uno derivado de su nombre, sin mover las existentes
+    split_files = {split: [] for split in splits}
+    if previous:
+        ratios = tuple(zip(splits, (train_size, val_size, test_size)))
+        for file in relevant_files:
+            key = os.path.splitext(os.path.basename(file[0]))[0]
+            split = (previous.get(key) or {}).get('split') or assign_split(key, ratios)
+            split_files[split].append(file)
+    elif relevant_files:
+        train_files, temp_files = train_test_split(relevant_files, train_size=train_size, random_state=42)
+        val_files, test_files = train_test_split(temp_files, train_size=val_size/(val_size + test_size), random_state=42)
+        split_files = {'train': train_files, 'val': val_files, 'test': test_files}
+
+    # Fase 4: copiar (o enlazar) imágenes y escribir etiquetas con hilos
+    tasks = [(img_path, brands, os.path.join(output_path, split_name), class_map, link_mode)
+             for split_name in splits
+             for img_path, xml_path, brands in split_files[split_name]]
+    print(f"\nCopiando {len(tasks)} imágenes ({link_mode})")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for done, (task, label_hash) in enumerate(zip(tasks, executor.map(write_split_file, tasks)), 1):
+            img_path, split_dir = task[0], task[2]
+            key = os.path.splitext(os.path.basename(img_path))[0]
+            split = os.path.basename(split_dir)
+            entries[key].update({'split': split, 'label_hash': label_hash,
+                                 'image_output': f"{split}/images/{os.path.basename(img_path)}",
+                                 'label_output': f"{split}/labels/{key}.txt"})
+            report_progress('copia', done, len(tasks), progress_callback)
+
+    # Sin manifiesto (primera ejecución sobre un dataset ya generado o rebuild)
+    # las copias antiguas pueden estar en otro split: se borra todo lo que el
+    # nuevo manifiesto no asigna para que ninguna imagen quede en dos splits
+    expected = {path for entry in entries.values() for path in entry_outputs(entry)}
+    stale = remove_stale_outputs(output_path, outputs, expected)
+    if stale:
+        print(f"Eliminados {stale} ficheros que ya no corresponden a ningún split")
+
+    save_manifest(output_path, entries)
+
+    brand_counts = {brand: 0 for brand in CLASS_NAMES}
+    split_counts = {split: 0 for split in splits}
+    for entry in entries.values():
+        # Contar logos por marca
+        for brand in entry['brands']:
+            brand_counts[brand] += 1
+        if entry['split']:
+            split_counts[entry['split']] += 1
+
+    print(f"\nEncontrados {sum(split_counts.values())} archivos con logos relevantes")
     print("Distribución de logos:")
     for brand, count in brand_counts.items():
         print(f"- {brand.capitalize()}: {count} logos")
-    
-    # Dividir en train/val/test
-    train_files, temp_files = train_test_split(relevant_files, train_size=train_size, random_state=42)
-    val_files, test_files = train_test_split(temp_files, train_size=val_size/(val_size + test_size), random_state=42)
-    
-    # Procesar cada split
-    for files, split_name in zip([train_files, val_files, test_files], splits):
-        print(f"\nProcesando split {split_name} ({len(files)} archivos)")
-        
-        for img_path, xml_path, brands in files:
-            # Copiar imagen
-            shutil.copy2(img_path, os.path.join(output_path, split_name, 'images'))
-            
-            # Crear archivo de etiquetas YOLO
-            base_name = os.path.splitext(os.path.basename(img_path))[0]
-            label_path = os.path.join(output_path, split_name, 'labels', f"{base_name}.txt")
-            
-            with open(label_path, 'w') as f:
-                for brand in brands:
-                    class_id = class_map[brand['name']]
-                    bbox = brand['bbox']
-                    f.write(f"{class_id} {' '.join(map(str, bbox))}\n")
-    
+
     # Crear archivo data.yaml
     yaml_content = f"""
 train: {os.path.join(output_path, 'train')}
@@ -136,15 +215,15 @@ test: {os.path.join(output_path, 'test')}
 nc: {len(class_map)}
 names: {list(class_map.keys())}
     """
-    
+
     with open(os.path.join(output_path, 'data.yaml'), 'w') as f:
         f.write(yaml_content)
-        
+
     print(f"\nDataset preparado exitosamente en: {output_path}")
     print("\nResumen final:")
-    print(f"- Train: {len(train_files)} imágenes")
-    print(f"- Validación: {len(val_files)} imágenes")
-    print(f"- Test: {len(test_files)} imágenes")
+    print(f"- Train: {split_counts['train']} imágenes")
+    print(f"- Validación: {split_counts['val']} imágenes")
+    print(f"- Test: {split_counts['test']} imágenes")
 
 if __name__ == "__main__":
     qmul_path = r"C:\Users\ang01\Desktop\CURSO F5\25 Proyecto de Computer Vision\openlogo"
@@ -153,4 +232,4 @@ if __name__ == "__main__":
     prepare_yolo_dataset(
         qmul_path=qmul_path,
         output_path=output_path
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,359 @@
+# active_learning.py
+import os
+import sys
+import json
+import bisect
+import hashlib
+import sqlite3
+import argparse
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from evaluation import DEFAULT_THRESHOLD, dataset_class_names
+
+# Distancia al umbral de su marca dentro de la cual una detección es dudosa
+UNCERTAINTY_MARGIN = 0.1
+# Frames exportados como mucho en cada shard
+DEFAULT_MAX_IMAGES = 500
+# Separación mínima entre frames exportados de un mismo video: los frames
+# consecutivos son casi iguales y no aportan nada nuevo al entrenamiento
+MIN_GAP_SECONDS = 1.0
+# Saltos hacia delante más cortos que esto se hacen leyendo frames (grab) en
+# lugar de buscar en el video, que obliga a decodificar desde un keyframe
+SEEK_FRAMES = 60
+JPEG_QUALITY = 95
+INDEX_NAME = 'active_index.json'
+
+
+def parse_thresholds(value, brands):
+    """Umbrales por marca a partir de 'adidas:0.6,puma:0.4' (el resto, DEFAULT_THRESHOLD)"""
+    thresholds = {brand: DEFAULT_THRESHOLD for brand in brands}
+    for item in filter(None, (value or '').split(',')):
+        brand, threshold = item.split(':')
+        thresholds[brand.strip()] = float(threshold)
+    return thresholds
+
+
+def video_sources(conn):
+    """Ruta y fps de cada video analizado, según su checkpoint"""
+    return {video_hash: {'video_path': video_path, 'fps': fps or 0.0}
+            for video_hash, video_path, fps in conn.execute(
+                "SELECT video_hash, video_path, fps FROM video_checkpoints WHERE video_path IS NOT NULL")}
+
+
+def uncertain_detections(conn, conf_thresholds, margin=UNCERTAINTY_MARGIN):
+    """
+    Detecciones con confianza a menos de margin del umbral de su marca. La
+    puntuación vale 1 sobre el umbral y baja hasta 0 en los bordes del margen.
+    """
+    detections = []
+    for brand, threshold in conf_thresholds.items():
+        rows = conn.execute("""
+            SELECT video_hash, frame_number, confidence FROM detections
+            WHERE brand = ? AND confidence >= ? AND confidence < ? AND video_hash IS NOT NULL
+        """, (brand, threshold - margin, threshold + margin)).fetchall()
+        detections += [{'video_hash': video_hash, 'frame_number': frame_number, 'reason': 'uncertain',
+                        'score': 1.0 - abs(confidence - threshold) / margin}
+                       for video_hash, frame_number, confidence in rows]
+    return detections
+
+
+def deleted_detections(conn):
+    """
+    Detecciones borradas por los usuarios (falsos positivos). Van por delante
+    de todas las dudosas, y entre ellas primero las de mayor confianza, que son
+    los errores que más cuestan.
+    """
+    return [{'video_hash': video_hash, 'frame_number': frame_number, 'reason': 'deleted',
+             'score': 1.0 + confidence}
+            for video_hash, frame_number, confidence in conn.execute("""
+                SELECT video_hash, frame_number, MAX(confidence) FROM detection_tombstones
+                WHERE video_hash IS NOT NULL GROUP BY video_hash, frame_number
+            """)]
+
+
+def select_frames(candidates, sources, exported=(), max_images=DEFAULT_MAX_IMAGES, min_gap_seconds=MIN_GAP_SECONDS):
+    """
+    Elige los frames a exportar: se agrupan las detecciones por frame, se
+    ordenan por puntuación y se toman los de videos disponibles que no estén
+    a menos de min_gap_seconds de otro elegido o de uno ya exportado.
+    """
+    frames = {}
+    for candidate in candidates:
+        key = (candidate['video_hash'], candidate['frame_number'])
+        if key not in frames or candidate['score'] > frames[key]['score']:
+            frames[key] = candidate
+    ranked = sorted(frames.values(), key=lambda frame: (-frame['score'], frame['video_hash'], frame['frame_number']))
+
+    chosen, taken = [], defaultdict(list)
+    for key in exported:
+        video_hash, _, frame_number = key.rpartition(':')
+        taken[video_hash].append(int(frame_number))
+    for neighbours in taken.values():
+        neighbours.sort()
+    for frame in ranked:
+        if len(chosen) >= max_images:
+            break
+        video_hash, frame_number = frame['video_hash'], frame['frame_number']
+        source = sources.get(video_hash)
+        if source is None:
+            continue
+        gap = max(1, round(source['fps'] * min_gap_seconds))
+        neighbours = taken[video_hash]
+        position = bisect.bisect_left(neighbours, frame_number)
+        if (position < len(neighbours) and neighbours[position] - frame_number < gap) or \
+                (position > 0 and frame_number - neighbours[position - 1] < gap):
+            continue
+        neighbours.insert(position, frame_number)
+        chosen.append(frame)
+    return chosen
+
+
+def frame_key(video_hash, frame_number):
+    return f"{video_hash}:{frame_number}"
+
+
+def frame_detections(conn, video_hash, frame_numbers):
+    """Detecciones que siguen en la base de datos en los frames indicados de un video"""
+    detections = defaultdict(list)
+    for frame_number, brand, confidence, bbox in conn.execute("""
+        SELECT frame_number, brand, confidence, bbox FROM detections
+        WHERE video_hash = ? AND frame_number IN (SELECT value FROM json_each(?))
+    """, (video_hash, json.dumps(list(frame_numbers)))):
+        detections[frame_number].append((brand, confidence, json.loads(bbox)))
+    return detections
+
+
+def read_frames(video_path, frame_numbers):
+    """Devuelve (frame, imagen) de los frames pedidos, en orden y con una sola pasada por el video"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return
+    try:
+        position = 0
+        for frame_number in sorted(frame_numbers):
+            if frame_number < position or frame_number - position > SEEK_FRAMES:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                position = frame_number
+            while position < frame_number and cap.grab():
+                position += 1
+            ok, image = cap.read()
+            position += 1
+            if ok and position - 1 == frame_number:
+                yield frame_number, image
+    finally:
+        cap.release()
+
+
+def yolo_lines(boxes, class_ids, width, height):
+    """Cajas xyxy en píxeles como líneas YOLO normalizadas y recortadas a la imagen"""
+    if not boxes:
+        return []
+    boxes = np.clip(np.asarray(boxes, dtype=np.float64) / [width, height, width, height], 0.0, 1.0)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    sizes = boxes[:, 2:] - boxes[:, :2]
+    return [f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+            for class_id, (x, y), (w, h) in zip(class_ids, centers, sizes) if w > 0 and h > 0]
+
+
+def label_frame(detections, conf_thresholds, class_ids):
+    """
+    Separa las detecciones que siguen en un frame en etiquetas confirmadas (por
+    encima del umbral: el usuario las vio y no las borró) y pendientes de
+    revisar (por debajo del umbral). Las de más abajo del margen tampoco se
+    descartan: siguen guardadas, así que el frame va a revisión en lugar de
+    enseñar su zona como fondo. Las borradas ya no están, así que su zona queda
+    como negativo. Devuelve (etiquetas, pendientes) como listas de (id de
+    clase, caja).
+    """
+    labels, review = [], []
+    for brand, confidence, bbox in detections:
+        if brand not in class_ids:
+            continue
+        if confidence >= conf_thresholds.get(brand, DEFAULT_THRESHOLD):
+            labels.append((class_ids[brand], bbox))
+        else:
+            review.append((class_ids[brand], bbox))
+    return labels, review
+
+
+def export_video(task):
+    """
+    Extrae los frames elegidos de un video y escribe cada uno como imagen y
+    etiqueta YOLO. Los frames con detecciones pendientes de revisar van a
+    review/ con esas cajas como preanotación; el resto va a images/ y labels/.
+    """
+    video_path, frames, detections, shard_dir, conf_thresholds, class_ids = task
+    frames = {frame['frame_number']: frame for frame in frames}
+    records = []
+    for frame_number, image in read_frames(video_path, frames):
+        frame = frames[frame_number]
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            continue
+        labels, review = label_frame(detections.get(frame_number, []), conf_thresholds, class_ids)
+        height, width = image.shape[:2]
+        name = f"{frame['video_hash'][:16]}_{frame_number:07d}"
+        subset = 'review' if review else 'train'
+        boxes = labels + review
+        lines = yolo_lines([bbox for _, bbox in boxes], [class_id for class_id, _ in boxes], width, height)
+
+        image_dir = os.path.join(shard_dir, 'review', 'images') if review else os.path.join(shard_dir, 'images')
+        label_dir = os.path.join(os.path.dirname(image_dir), 'labels')
+        image_path = os.path.join(image_dir, f"{name}.jpg")
+        with open(image_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        with open(os.path.join(label_dir, f"{name}.txt"), 'w') as f:
+            f.write(''.join(f"{line}\n" for line in lines))
+        records.append({
+            'key': frame_key(frame['video_hash'], frame_number), 'name': name, 'subset': subset,
+            'reason': frame['reason'], 'score': frame['score'], 'labels': len(labels), 'review': len(review),
+            'hard_negative': not lines, 'bytes': len(encoded),
+            'content_hash': hashlib.sha256(encoded).hexdigest()
+        })
+    return records
+
+
+def load_index(output_dir):
+    """Frames y contenidos ya exportados en shards anteriores"""
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    if not os.path.exists(index_path):
+        return {'frames': {}, 'hashes': {}}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_index(output_dir, index):
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(temp_path, index_path)
+
+
+def remove_record(shard_dir, record):
+    """Borra la imagen y la etiqueta de un frame exportado"""
+    base_dir = os.path.join(shard_dir, 'review') if record['subset'] == 'review' else shard_dir
+    for path in (os.path.join(base_dir, 'images', f"{record['name']}.jpg"),
+                 os.path.join(base_dir, 'labels', f"{record['name']}.txt")):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def export_shard(db_path, dataset_dir, output_dir=None, conf_thresholds=None, margin=UNCERTAINTY_MARGIN,
+                 max_images=DEFAULT_MAX_IMAGES, max_bytes=None, min_gap_seconds=MIN_GAP_SECONDS,
+                 include_uncertain=True, include_deleted=True, workers=None):
+    """
+    Exporta a un shard nuevo del dataset los frames de producción que más
+    pueden enseñar al modelo: los de detecciones borradas por los usuarios
+    (negativos difíciles) y los de detecciones con confianza cerca del umbral.
+    Los frames se leen de los videos originales, se descartan los ya
+    exportados, los repetidos y los cercanos en el tiempo, y el shard se
+    limita a max_images frames y max_bytes bytes.
+
+    El shard queda en output_dir/shard_<fecha> (por defecto dentro de
+    dataset_dir/active_learning) con images/ y labels/ listos para añadir a
+    'train' en data.yaml, y review/ con los frames que hay que revisar antes.
+    Devuelve un resumen de lo exportado.
+    """
+    class_names = dataset_class_names(os.path.join(dataset_dir, 'data.yaml'))
+    class_ids = {name: class_id for class_id, name in enumerate(class_names)}
+    conf_thresholds = conf_thresholds or parse_thresholds(None, class_names)
+    output_dir = output_dir or os.path.join(dataset_dir, 'active_learning')
+    os.makedirs(output_dir, exist_ok=True)
+    index = load_index(output_dir)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        sources = video_sources(conn)
+        candidates = []
+        if include_deleted:
+            candidates += deleted_detections(conn)
+        if include_uncertain:
+            candidates += uncertain_detections(conn, conf_thresholds, margin)
+        chosen = select_frames(candidates, sources, index['frames'], max_images, min_gap_seconds)
+        by_video = defaultdict(list)
+        for frame in chosen:
+            by_video[frame['video_hash']].append(frame)
+        detections = {video_hash: frame_detections(conn, video_hash, [frame['frame_number'] for frame in frames])
+                      for video_hash, frames in by_video.items()}
+    finally:
+        conn.close()
+
+    summary = {'candidates': len(candidates), 'selected': len(chosen), 'exported': 0, 'review': 0,
+               'hard_negatives': 0, 'duplicates': 0, 'over_budget': 0, 'missing_frames': 0, 'bytes': 0}
+    if not chosen:
+        summary['shard'] = None
+        return summary
+
+    shard_name = f"shard_{datetime.now():%Y%m%d%H%M%S}"
+    shard_dir = os.path.join(output_dir, shard_name)
+    for folder in ('images', 'labels', os.path.join('review', 'images'), os.path.join('review', 'labels')):
+        os.makedirs(os.path.join(shard_dir, folder), exist_ok=True)
+
+    # Cada video se lee en un hilo (OpenCV libera el GIL al decodificar)
+    tasks = [(sources[video_hash]['video_path'], frames, detections[video_hash], shard_dir,
+              conf_thresholds, class_ids) for video_hash, frames in sorted(by_video.items())]
+    with ThreadPoolExecutor(max_workers=workers or min(8, len(tasks))) as executor:
+        records = [record for video_records in executor.map(export_video, tasks) for record in video_records]
+    summary['missing_frames'] = len(chosen) - len(records)
+
+    # Se conservan los de mayor puntuación sin repetir contenido y dentro del presupuesto
+    kept = []
+    for record in sorted(records, key=lambda record: -record['score']):
+        if record['content_hash'] in index['hashes']:
+            summary['duplicates'] += 1
+        elif max_bytes is not None and summary['bytes'] + record['bytes'] > max_bytes:
+            summary['over_budget'] += 1
+        else:
+            index['hashes'][record['content_hash']] = record['key']
+            summary['bytes'] += record['bytes']
+            kept.append(record)
+            continue
+        remove_record(shard_dir, record)
+
+    for record in kept:
+        index['frames'][record['key']] = shard_name
+    summary.update(shard=shard_dir, exported=len(kept), review=sum(record['subset'] == 'review' for record in kept),
+                   hard_negatives=sum(record['hard_negative'] for record in kept))
+    with open(os.path.join(shard_dir, 'shard.json'), 'w', encoding='utf-8') as f:
+        json.dump({'created_at': datetime.now().isoformat(timespec='seconds'), 'conf_thresholds': conf_thresholds,
+                   'margin': margin, 'classes': class_names, 'summary': summary,
+                   'frames': sorted(kept, key=lambda record: record['name'])}, f, indent=2)
+    save_index(output_dir, index)
+    return summary
+
+
+def main(argv=None):
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Exporta frames de producción dudosos o corregidos "
+                                                 "como un shard nuevo del dataset")
+    parser.add_argument('--db', default=os.path.join(project_root, 'database', 'detections.db'))
+    parser.add_argument('--dataset', default=os.path.join(project_root, 'data', 'dataset_yolo'))
+    parser.add_argument('--output', help="Directorio de los shards (por defecto, dataset/active_learning)")
+    parser.add_argument('--thresholds', help="Umbrales por marca: adidas:0.6,puma:0.4")
+    parser.add_argument('--margin', type=float, default=UNCERTAINTY_MARGIN)
+    parser.add_argument('--max-images', type=int, default=DEFAULT_MAX_IMAGES)
+    parser.add_argument('--max-mb', type=float, help="Tamaño máximo del shard en MB")
+    parser.add_argument('--min-gap', type=float, default=MIN_GAP_SECONDS,
+                        help="Segundos mínimos entre frames de un mismo video")
+    parser.add_argument('--no-uncertain', action='store_true', help="Solo detecciones borradas")
+    parser.add_argument('--no-deleted', action='store_true', help="Solo detecciones dudosas")
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+
+    class_names = dataset_class_names(os.path.join(args.dataset, 'data.yaml'))
+    summary = export_shard(args.db, args.dataset, args.output, parse_thresholds(args.thresholds, class_names),
+                           args.margin, args.max_images,
+                           int(args.max_mb * 1024 * 1024) if args.max_mb else None, args.min_gap,
+                           not args.no_uncertain, not args.no_deleted, args.workers)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
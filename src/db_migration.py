@@ -2,6 +2,122 @@
 import sqlite3
 import os
 
+import storage
+
+def create_checkpoint_schema(cursor):
+    """Crea la tabla de checkpoints de procesamiento"""
+    cursor.execute(storage.table_ddl('video_checkpoints'))
+
+def create_cache_schema(cursor):
+    """
+    Crea la tabla de caché de resultados. La clave combina el hash del video,
+    el hash de los pesos del modelo y los umbrales usados.
+    """
+    cursor.execute(storage.table_ddl('analysis_cache'))
+
+def create_tombstone_schema(cursor):
+    """Crea la tabla donde la API copia las detecciones que borran los usuarios"""
+    cursor.execute(storage.table_ddl('detection_tombstones'))
+
+def create_detection_indexes(cursor):
+    """
+    Índice único (video_hash, frame, caja) e índices para recalcular
+    estadísticas y líneas temporales por video (los mismos en todos los backends)
+    """
+    for statement in storage.index_ddl():
+        cursor.execute(statement)
+
+def create_jobs_schema(cursor):
+    """Crea la cola de trabajos de análisis usada por la API y los workers"""
+    cursor.execute(storage.table_ddl('jobs'))
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_jobs_status
+                    ON jobs (status, job_id)''')
+
+def create_video_catalog_schema(cursor):
+    """
+    Crea el catálogo de videos (un registro por video_hash con el último nombre
+    con el que se ha analizado y su número de detecciones) y su índice de texto
+    completo FTS5 con tokenizador trigram, que permite buscar por cualquier
+    fragmento del nombre sin recorrer la tabla detections. Unos triggers
+    mantienen el catálogo al insertar o borrar detecciones; las detecciones sin
+    video_hash (anteriores al hash de contenido) no se catalogan. Si SQLite no
+    tiene FTS5 se usa solo la tabla videos.
+    """
+    cursor.execute("PRAGMA table_info(videos)")
+    catalog_columns = {col[1] for col in cursor.fetchall()}
+    if catalog_columns and 'video_hash' not in catalog_columns:
+        # Catálogo antiguo indexado por nombre: se reconstruye desde detections
+        print("Reconstruyendo el catálogo de videos por video_hash...")
+        for trigger in ('detections_catalog_insert', 'detections_catalog_delete',
+                        'videos_fts_insert', 'videos_fts_delete'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute("DROP TABLE IF EXISTS videos_fts")
+        cursor.execute("DROP TABLE videos")
+        catalog_columns = set()
+    catalog_exists = bool(catalog_columns)
+
+    cursor.execute(storage.table_ddl('videos'))
+
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS detections_catalog_insert
+                    AFTER INSERT ON detections
+                    WHEN new.video_hash IS NOT NULL
+                    BEGIN
+                        INSERT INTO videos (video_hash, video_name, detection_count)
+                        VALUES (new.video_hash, new.video_name, 1)
+                        ON CONFLICT(video_hash) DO UPDATE SET detection_count = detection_count + 1,
+                                                              video_name = excluded.video_name;
+                    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS detections_catalog_delete
+                    AFTER DELETE ON detections
+                    WHEN old.video_hash IS NOT NULL
+                    BEGIN
+                        UPDATE videos SET detection_count = detection_count - 1
+                        WHERE video_hash = old.video_hash;
+                        DELETE FROM videos WHERE video_hash = old.video_hash AND detection_count <= 0;
+                    END''')
+
+    try:
+        cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts
+                        USING fts5(video_name, content='videos', content_rowid='video_id',
+                                   tokenize='trigram')''')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS videos_fts_insert
+                        AFTER INSERT ON videos
+                        BEGIN
+                            INSERT INTO videos_fts (rowid, video_name) VALUES (new.video_id, new.video_name);
+                        END''')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS videos_fts_delete
+                        AFTER DELETE ON videos
+                        BEGIN
+                            INSERT INTO videos_fts (videos_fts, rowid, video_name)
+                            VALUES ('delete', old.video_id, old.video_name);
+                        END''')
+        # El mismo video analizado con otro nombre se busca por el nombre nuevo
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS videos_fts_rename
+                        AFTER UPDATE OF video_name ON videos
+                        WHEN old.video_name IS NOT new.video_name
+                        BEGIN
+                            INSERT INTO videos_fts (videos_fts, rowid, video_name)
+                            VALUES ('delete', old.video_id, old.video_name);
+                            INSERT INTO videos_fts (rowid, video_name) VALUES (new.video_id, new.video_name);
+                        END''')
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 no disponible, el catálogo se buscará sin índice de texto: {str(e)}")
+
+    # Rellenar el catálogo con las detecciones existentes la primera vez
+    if not catalog_exists:
+        cursor.execute('''INSERT INTO videos (video_hash, video_name, detection_count)
+                        SELECT video_hash, MAX(video_name), COUNT(*)
+                        FROM detections WHERE video_hash IS NOT NULL GROUP BY video_hash''')
+
+def create_auxiliary_schema(cursor):
+    """Crea todas las tablas auxiliares que acompañan a detections"""
+    create_checkpoint_schema(cursor)
+    create_cache_schema(cursor)
+    create_tombstone_schema(cursor)
+    create_detection_indexes(cursor)
+    create_jobs_schema(cursor)
+    create_video_catalog_schema(cursor)
+
 def migrate_database(db_path):
     """
     Crea o migra la base de datos asegurando la estructura correcta
@@ -40,14 +156,7 @@ def migrate_database(db_path):
         
         if create_new_table:
             # Crear tabla con la estructura correcta
-            c.execute('''CREATE TABLE detections
-                        (video_name TEXT,
-                        frame_number INTEGER,
-                        brand TEXT,
-                        confidence REAL,
-                        bbox TEXT,
-                        timestamp REAL,
-                        image_path TEXT)''')
+            c.execute(storage.table_ddl('detections', if_not_exists=False))
             print("Tabla detections creada con la estructura correcta")
             
             # Si había datos en backup, restaurarlos
@@ -63,13 +172,18 @@ def migrate_database(db_path):
                 c.execute("DROP TABLE detections_backup")
                 print("Datos restaurados correctamente")
         
+        # Añadir las columnas de storage.SCHEMA que falten sin recrear la tabla
+        c.execute("PRAGMA table_info(detections)")
+        existing_columns = {col[1] for col in c.fetchall()}
+        for statement in storage.missing_columns_ddl('detections', existing_columns):
+            print(f"Ejecutando {statement}")
+            c.execute(statement)
+        
+        create_auxiliary_schema(c)
+        print("Tablas auxiliares verificadas")
+        
         # Crear tabla video_analysis si no existe
-        c.execute('''CREATE TABLE IF NOT EXISTS video_analysis
-                    (video_name TEXT,
-                    analysis_date TEXT,
-                    total_frames INTEGER,
-                    duration_seconds REAL,
-                    detection_summary TEXT)''')
+        c.execute(storage.table_ddl('video_analysis'))
         print("Tabla video_analysis verificada")
         
         # Verificar estructura final
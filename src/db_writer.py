@@ -0,0 +1,131 @@
+# db_writer.py
+import queue
+import threading
+from concurrent.futures import Future
+
+# Número máximo de escrituras pendientes antes de bloquear a los productores
+DEFAULT_MAX_PENDING = 64
+# Filas máximas que se agrupan en una misma transacción
+DEFAULT_MAX_BATCH_ROWS = 50000
+
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """El escritor no ha aceptado la escritura dentro del tiempo indicado"""
+
+
+class DetectionWriter:
+    """
+    Hebra única que escribe en la base de datos en nombre de todos los
+    productores (sesiones de Streamlit, workers de la API...). Cada escritura es
+    una función que recibe la conexión; el escritor junta todas las que haya en
+    cola en una sola transacción, de modo que hay un solo escritor y un solo
+    commit por grupo en lugar de uno por productor. La cola es acotada: cuando
+    se llena, submit bloquea al productor hasta que haya sitio.
+    """
+
+    def __init__(self, store, max_pending=DEFAULT_MAX_PENDING, max_batch_rows=DEFAULT_MAX_BATCH_ROWS):
+        self.store = store
+        self.max_batch_rows = max_batch_rows
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'writes': 0, 'transactions': 0, 'rows': 0, 'failed': 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="detection-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, write, rows=0, timeout=None):
+        """
+        Encola write(conn) y devuelve un Future que se resuelve cuando su
+        transacción se ha confirmado. rows es el tamaño aproximado de la
+        escritura y sirve para limitar el tamaño de cada transacción.
+        Con timeout se lanza QueueFullError si la cola sigue llena.
+        """
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((write, rows, future), timeout=timeout)
+        except queue.Full:
+            raise QueueFullError(f"Cola de escritura llena ({self._queue.maxsize} escrituras pendientes)")
+        return future
+
+    def flush(self, timeout=None):
+        """Espera a que se hayan confirmado todas las escrituras encoladas hasta ahora"""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout=None):
+        """Confirma lo pendiente y detiene la hebra"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _next_group(self):
+        """Espera una escritura y añade todas las que ya estén en cola (hasta max_batch_rows)"""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        group, rows = [first], first[1]
+        while rows < self.max_batch_rows:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return group, True
+            group.append(item)
+            rows += item[1]
+        return group, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            group, stop = self._next_group()
+            if not group:
+                continue
+            try:
+                self._apply(group)
+            except Exception:
+                # Si falla la transacción conjunta se repite cada escritura por
+                # separado para que solo falle la que tiene el problema
+                for item in group:
+                    self._apply([item])
+            for write, rows, future in group:
+                if not future.done():
+                    future.set_result(None)
+
+    def _apply(self, group):
+        if len(group) == 1:
+            write, rows, future = group[0]
+            try:
+                with self.store.transaction() as conn:
+                    write(conn)
+            except Exception as e:
+                self.stats['failed'] += 1
+                future.set_exception(e)
+                return
+        else:
+            with self.store.transaction() as conn:
+                for write, rows, future in group:
+                    write(conn)
+        self.stats['transactions'] += 1
+        self.stats['writes'] += len(group)
+        self.stats['rows'] += sum(rows for _, rows, _ in group)
+
+
+# Un escritor por base de datos y proceso, compartido por todos los detectores
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(store):
+    """Devuelve el escritor compartido de la base de datos de store"""
+    key = (type(store).__name__, getattr(store, 'db_path', None) or getattr(store, 'dsn', None))
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = DetectionWriter(store)
+        return _writers[key]
@@ -0,0 +1,402 @@
+# evaluation.py
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import yaml
+
+from utils.helpers import compute_file_hash
+from utils.image_cache import PackedImageCache
+from utils.training import IMAGE_EXTENSIONS
+
+# Umbrales de IoU de mAP50-95
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# Umbrales de confianza que se barren para recomendar conf_thresholds
+SWEEP_THRESHOLDS = np.round(np.arange(0.05, 0.951, 0.05), 2)
+SWEEP_FIELDS = ('threshold', 'precision', 'recall', 'f1', 'detections')
+# Confianza mínima al predecir: se guarda casi todo y los umbrales se aplican después
+PREDICT_CONF = 0.001
+PREDICT_BATCH = 16
+# Umbral por defecto de process_video para las marcas sin datos de evaluación
+DEFAULT_THRESHOLD = 0.5
+
+
+def dataset_class_names(data_yaml):
+    """Nombres de clase del dataset en el orden de sus índices"""
+    with open(data_yaml, 'r', encoding='utf-8') as f:
+        names = yaml.safe_load(f)['names']
+    if isinstance(names, dict):
+        return [names[i] for i in sorted(names)]
+    return list(names)
+
+
+def list_split_images(split_dir):
+    """Imágenes del split ordenadas, con la clave nombre|tamaño|mtime que identifica su contenido"""
+    images_dir = os.path.join(split_dir, 'images')
+    with os.scandir(images_dir) as entries:
+        files = sorted((entry.name, entry.stat()) for entry in entries
+                       if entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    return [(name, f"{name}|{stat.st_size}|{stat.st_mtime_ns}") for name, stat in files]
+
+
+def xywh_to_xyxy(boxes):
+    """Cajas YOLO (centro y tamaño) a esquinas, todo normalizado"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    half = boxes[:, 2:] / 2
+    return np.hstack([boxes[:, :2] - half, boxes[:, :2] + half])
+
+
+def read_ground_truth(split_dir, image_names):
+    """
+    Etiquetas YOLO del split como arrays planos: índice de imagen, clase y
+    caja xyxy normalizada. Las imágenes sin fichero de etiquetas son fondo.
+    """
+    labels_dir = os.path.join(split_dir, 'labels')
+    images, classes, boxes = [], [], []
+    for position, name in enumerate(image_names):
+        label_path = os.path.join(labels_dir, f"{os.path.splitext(name)[0]}.txt")
+        if not os.path.exists(label_path) or os.path.getsize(label_path) == 0:
+            continue
+        rows = np.loadtxt(label_path, ndmin=2)
+        images.append(np.full(len(rows), position, dtype=np.int32))
+        classes.append(rows[:, 0].astype(np.int32))
+        boxes.append(xywh_to_xyxy(rows[:, 1:5]))
+    if not images:
+        return {'image': np.empty(0, np.int32), 'cls': np.empty(0, np.int32), 'boxes': np.empty((0, 4))}
+    return {'image': np.concatenate(images), 'cls': np.concatenate(classes), 'boxes': np.vstack(boxes)}
+
+
+def box_iou(boxes_a, boxes_b):
+    """Matriz de IoU (n, m) entre dos conjuntos de cajas xyxy"""
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def match_predictions(pred_cls, pred_boxes, gt_cls, gt_boxes, iou_thresholds=IOU_THRESHOLDS):
+    """
+    Marca qué predicciones de una imagen son verdaderos positivos para cada
+    umbral de IoU: cada etiqueta se empareja con una sola predicción de su
+    clase, eligiendo primero los pares de mayor IoU. Devuelve un array
+    booleano (predicciones, umbrales).
+    """
+    correct = np.zeros((len(pred_cls), len(iou_thresholds)), dtype=bool)
+    if len(pred_cls) == 0 or len(gt_cls) == 0:
+        return correct
+    iou = box_iou(gt_boxes, pred_boxes) * (gt_cls[:, None] == pred_cls[None, :])
+    for column, threshold in enumerate(iou_thresholds):
+        matches = np.argwhere(iou >= threshold)
+        if len(matches) > 1:
+            matches = matches[np.argsort(-iou[matches[:, 0], matches[:, 1]], kind='stable')]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        correct[matches[:, 1], column] = True
+    return correct
+
+
+def average_precision(recall, precision):
+    """
+    AP como media, en 101 puntos de recall, de la mejor precisión alcanzada con
+    un recall igual o mayor (interpolación de COCO)
+    """
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision)))
+    positions = np.searchsorted(recall, np.linspace(0, 1, 101), side='left')
+    interpolated = np.where(positions < len(recall), envelope[np.minimum(positions, len(recall) - 1)], 0.0)
+    return float(interpolated.mean())
+
+
+def class_metrics(correct, confidences, num_labels, thresholds=SWEEP_THRESHOLDS):
+    """
+    AP por umbral de IoU y barrido de umbrales de confianza de una clase a
+    partir de sus predicciones ya emparejadas. Al estar ordenadas por
+    confianza, el número de aciertos con cada umbral se obtiene con una
+    búsqueda binaria sobre la suma acumulada, sin volver a emparejar.
+    """
+    order = np.argsort(-confidences, kind='stable')
+    correct, confidences = correct[order], confidences[order]
+    true_positives = np.cumsum(correct, axis=0)
+    predicted = np.arange(1, len(confidences) + 1)[:, None]
+    recall = true_positives / max(num_labels, 1)
+    precision = true_positives / predicted
+    ap = np.zeros(correct.shape[1])
+    if len(confidences) and num_labels:
+        ap = np.array([average_precision(recall[:, i], precision[:, i]) for i in range(correct.shape[1])])
+
+    # Los umbrales se comparan con la misma precisión que las confianzas (float32)
+    kept = np.searchsorted(-confidences, -np.asarray(thresholds, dtype=confidences.dtype), side='right')
+    hits = np.zeros(len(thresholds))
+    if len(confidences):
+        hits = np.where(kept > 0, true_positives[np.maximum(kept - 1, 0), 0], 0)
+    sweep_precision = np.divide(hits, kept, out=np.zeros(len(thresholds)), where=kept > 0)
+    sweep_recall = hits / max(num_labels, 1)
+    denominator = sweep_precision + sweep_recall
+    sweep_f1 = np.divide(2 * sweep_precision * sweep_recall, denominator,
+                         out=np.zeros(len(thresholds)), where=denominator > 0)
+    return {
+        'ap': ap,
+        'sweep': {'threshold': thresholds, 'precision': sweep_precision, 'recall': sweep_recall,
+                  'f1': sweep_f1, 'detections': kept}
+    }
+
+
+def recommend_threshold(sweep, beta=1.0):
+    """
+    Umbral con mayor F-beta (beta < 1 prima la precisión). En caso de empate
+    se queda el umbral más alto, que guarda menos detecciones.
+    """
+    precision, recall = sweep['precision'], sweep['recall']
+    denominator = beta ** 2 * precision + recall
+    score = np.divide((1 + beta ** 2) * precision * recall, denominator,
+                      out=np.zeros(len(precision)), where=denominator > 0)
+    if not score.any():
+        return DEFAULT_THRESHOLD, None
+    best = len(score) - 1 - int(np.argmax(score[::-1]))
+    return float(sweep['threshold'][best]), best
+
+
+def compute_metrics(predictions, ground_truth, class_names, beta=1.0):
+    """
+    Métricas por marca (precision/recall al umbral recomendado, mAP50, mAP50-95
+    y barrido de umbrales) a partir de las predicciones de la caché.
+    predictions y ground_truth usan índices de clase del dataset.
+    """
+    correct = np.zeros((len(predictions['cls']), len(IOU_THRESHOLDS)), dtype=bool)
+    # Agrupar filas por imagen una sola vez en lugar de filtrar en cada imagen
+    pred_order = np.argsort(predictions['image'], kind='stable')
+    gt_order = np.argsort(ground_truth['image'], kind='stable')
+    pred_images = predictions['image'][pred_order]
+    gt_images = ground_truth['image'][gt_order]
+    for image in np.unique(pred_images):
+        pred_rows = pred_order[np.searchsorted(pred_images, image):np.searchsorted(pred_images, image, 'right')]
+        gt_rows = gt_order[np.searchsorted(gt_images, image):np.searchsorted(gt_images, image, 'right')]
+        correct[pred_rows] = match_predictions(predictions['cls'][pred_rows], predictions['boxes'][pred_rows],
+                                               ground_truth['cls'][gt_rows], ground_truth['boxes'][gt_rows])
+
+    report = {}
+    for class_id, brand in enumerate(class_names):
+        rows = predictions['cls'] == class_id
+        num_labels = int((ground_truth['cls'] == class_id).sum())
+        metrics = class_metrics(correct[rows], predictions['conf'][rows], num_labels)
+        sweep = metrics['sweep']
+        threshold, best = recommend_threshold(sweep, beta) if num_labels else (DEFAULT_THRESHOLD, None)
+        report[brand] = {
+            'labels': num_labels,
+            'predictions': int(rows.sum()),
+            'precision': float(sweep['precision'][best]) if best is not None else 0.0,
+            'recall': float(sweep['recall'][best]) if best is not None else 0.0,
+            'map50': float(metrics['ap'][0]),
+            'map50_95': float(metrics['ap'].mean()),
+            'recommended_threshold': threshold,
+            'sweep': [dict(zip(SWEEP_FIELDS, values))
+                      for values in zip(*(np.asarray(sweep[field]).tolist() for field in SWEEP_FIELDS))]
+        }
+    return report
+
+
+def prediction_cache_path(cache_dir, model_hash, imgsz):
+    return os.path.join(cache_dir, f"predictions_{model_hash[:16]}_{imgsz}.npz")
+
+
+def load_prediction_cache(cache_path):
+    """Predicciones guardadas de un modelo: claves de imagen y arrays planos por predicción"""
+    if not os.path.exists(cache_path):
+        return {'keys': [], 'image': np.empty(0, np.int32), 'cls': np.empty(0, np.int32),
+                'conf': np.empty(0, np.float32), 'boxes': np.empty((0, 4), np.float32), 'names': []}
+    with np.load(cache_path) as cached:
+        return {'keys': cached['keys'].tolist(), 'image': cached['image'], 'cls': cached['cls'],
+                'conf': cached['conf'], 'boxes': cached['boxes'], 'names': cached['names'].tolist()}
+
+
+def save_prediction_cache(cache_path, cache):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.tmp.npz"
+    np.savez(temp_path, keys=np.array(cache['keys'], dtype=str), image=cache['image'], cls=cache['cls'],
+             conf=cache['conf'], boxes=cache['boxes'], names=np.array(cache['names'], dtype=str))
+    os.replace(temp_path, cache_path)
+
+
+def predict_images(weights, split_dir, image_names, imgsz=640, batch=PREDICT_BATCH):
+    """
+    Ejecuta el modelo sobre las imágenes indicadas con confianza mínima
+    PREDICT_CONF. Si el split tiene caché empaquetada se usan sus imágenes
+    ya decodificadas. Devuelve arrays planos con el índice de la imagen (en
+    image_names), la clase del modelo, la confianza y la caja xyxy normalizada.
+    """
+    from ultralytics import YOLO
+
+    model = YOLO(weights)
+    packed = PackedImageCache.open(split_dir, imgsz)
+    images, classes, confidences, boxes = [], [], [], []
+    for start in range(0, len(image_names), batch):
+        names = image_names[start:start + batch]
+        sources = [packed.load(name)[0] if packed is not None and name in packed
+                   else os.path.join(split_dir, 'images', name) for name in names]
+        for offset, result in enumerate(model.predict(sources, imgsz=imgsz, conf=PREDICT_CONF, verbose=False)):
+            result_boxes = result.boxes
+            images.append(np.full(len(result_boxes), start + offset, dtype=np.int32))
+            classes.append(result_boxes.cls.cpu().numpy().astype(np.int32))
+            confidences.append(result_boxes.conf.cpu().numpy().astype(np.float32))
+            boxes.append(result_boxes.xyxyn.cpu().numpy().astype(np.float32))
+        print(f"Predicciones: {min(start + batch, len(image_names))}/{len(image_names)} imágenes")
+    names = [model.names[i] for i in sorted(model.names)]
+    if not images:
+        return {'image': np.empty(0, np.int32), 'cls': np.empty(0, np.int32),
+                'conf': np.empty(0, np.float32), 'boxes': np.empty((0, 4), np.float32), 'names': names}
+    return {'image': np.concatenate(images), 'cls': np.concatenate(classes), 'conf': np.concatenate(confidences),
+            'boxes': np.vstack(boxes), 'names': names}
+
+
+def cached_predictions(weights, split_dir, images, cache_dir, imgsz=640, model_hash=None):
+    """
+    Predicciones del modelo para las imágenes del split. Solo se ejecuta el
+    modelo sobre las imágenes que no están en su caché (clave: hash de los
+    pesos e imgsz; cada imagen se identifica por nombre, tamaño y mtime).
+    Devuelve las predicciones indexadas por la posición de la imagen en images.
+    """
+    model_hash = model_hash or compute_file_hash(weights)
+    cache_path = prediction_cache_path(cache_dir, model_hash, imgsz)
+    cache = load_prediction_cache(cache_path)
+    known = {key: position for position, key in enumerate(cache['keys'])}
+
+    missing = [name for name, key in images if key not in known]
+    if missing:
+        print(f"Ejecutando el modelo sobre {len(missing)} imágenes sin predicciones en caché")
+        fresh = predict_images(weights, split_dir, missing, imgsz)
+        keys = dict(images)
+        offset = len(cache['keys'])
+        cache = {
+            'keys': cache['keys'] + [keys[name] for name in missing],
+            'image': np.concatenate([cache['image'], fresh['image'] + offset]).astype(np.int32),
+            'cls': np.concatenate([cache['cls'], fresh['cls']]).astype(np.int32),
+            'conf': np.concatenate([cache['conf'], fresh['conf']]).astype(np.float32),
+            'boxes': np.vstack([cache['boxes'], fresh['boxes']]).astype(np.float32),
+            'names': fresh['names']
+        }
+        save_prediction_cache(cache_path, cache)
+        known = {key: position for position, key in enumerate(cache['keys'])}
+    else:
+        print(f"Predicciones de {len(images)} imágenes leídas de la caché")
+
+    # Reindexar a la posición de cada imagen en el split actual
+    positions = np.full(len(cache['keys']), -1, dtype=np.int32)
+    for position, (_, key) in enumerate(images):
+        positions[known[key]] = position
+    image = positions[cache['image']] if len(cache['image']) else cache['image']
+    rows = image >= 0
+    return {'image': image[rows], 'cls': cache['cls'][rows], 'conf': cache['conf'][rows],
+            'boxes': cache['boxes'][rows].astype(np.float64), 'names': cache['names'], 'model_hash': model_hash}
+
+
+def to_dataset_classes(predictions, class_names):
+    """Traduce las clases del modelo a los índices del dataset y descarta las que no están"""
+    mapping = np.array([class_names.index(name) if name in class_names else -1 for name in predictions['names']],
+                       dtype=np.int32)
+    cls = mapping[predictions['cls']] if len(predictions['cls']) else predictions['cls']
+    rows = cls >= 0
+    return {'image': predictions['image'][rows], 'cls': cls[rows], 'conf': predictions['conf'][rows],
+            'boxes': predictions['boxes'][rows]}
+
+
+def evaluate(weights, dataset_dir, split='test', imgsz=640, cache_dir=None, beta=1.0):
+    """
+    Evalúa unos pesos sobre un split del dataset. Las predicciones se guardan
+    en cache_dir, así que volver a evaluar el mismo modelo (o con otro beta)
+    no ejecuta la inferencia. Devuelve un informe con las métricas por marca y
+    los conf_thresholds recomendados para process_video.
+    """
+    split_dir = os.path.join(dataset_dir, split)
+    cache_dir = cache_dir or os.path.join(dataset_dir, 'eval_cache')
+    class_names = dataset_class_names(os.path.join(dataset_dir, 'data.yaml'))
+    images = list_split_images(split_dir)
+
+    predictions = cached_predictions(weights, split_dir, images, cache_dir, imgsz)
+    ground_truth = read_ground_truth(split_dir, [name for name, _ in images])
+    brands = compute_metrics(to_dataset_classes(predictions, class_names), ground_truth, class_names, beta)
+    evaluated = [brand for brand in brands.values() if brand['labels']]
+    return {
+        'weights': weights,
+        'model_hash': predictions['model_hash'],
+        'split': split,
+        'images': len(images),
+        'map50': float(np.mean([brand['map50'] for brand in evaluated])) if evaluated else 0.0,
+        'map50_95': float(np.mean([brand['map50_95'] for brand in evaluated])) if evaluated else 0.0,
+        'brands': brands,
+        'conf_thresholds': {brand: metrics['recommended_threshold'] for brand, metrics in brands.items()}
+    }
+
+
+def thresholds_path(weights):
+    return os.path.join(os.path.dirname(os.path.abspath(weights)), 'conf_thresholds.json')
+
+
+def save_recommended_thresholds(report):
+    """Guarda junto a los pesos los conf_thresholds recomendados por la evaluación"""
+    with open(thresholds_path(report['weights']), 'w', encoding='utf-8') as f:
+        json.dump({'model_hash': report['model_hash'], 'split': report['split'],
+                   'conf_thresholds': report['conf_thresholds']}, f, indent=2)
+
+
+def load_recommended_thresholds(weights, model_hash=None):
+    """
+    conf_thresholds recomendados para unos pesos, o None si no se han evaluado
+    (o si el fichero corresponde a otros pesos con el mismo nombre)
+    """
+    path = thresholds_path(weights)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    if model_hash and saved.get('model_hash') != model_hash:
+        return None
+    return saved['conf_thresholds']
+
+
+def print_report(report):
+    print(f"\n=== EVALUACIÓN {os.path.basename(str(report['weights']))} ({report['split']}, "
+          f"{report['images']} imágenes) ===")
+    print(f"mAP50: {report['map50']:.3f}  mAP50-95: {report['map50_95']:.3f}")
+    for brand, metrics in report['brands'].items():
+        print(f"- {brand}: P {metrics['precision']:.3f}  R {metrics['recall']:.3f}  "
+              f"mAP50 {metrics['map50']:.3f}  mAP50-95 {metrics['map50_95']:.3f}  "
+              f"umbral {metrics['recommended_threshold']:.2f}  ({metrics['labels']} etiquetas)")
+    print(f"conf_thresholds recomendados: {report['conf_thresholds']}")
+
+
+def main(argv=None):
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Evalúa modelos sobre el split de test con predicciones en caché")
+    parser.add_argument('--weights', nargs='+', help="Uno o varios best.pt (por defecto el último entrenado)")
+    parser.add_argument('--dataset', default=os.path.join(project_root, 'data', 'dataset_yolo'))
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--beta', type=float, default=1.0, help="F-beta para elegir umbrales (<1 prima la precisión)")
+    parser.add_argument('--cache-dir')
+    parser.add_argument('--output', help="Guarda los informes en JSON")
+    args = parser.parse_args(argv)
+
+    weights = args.weights
+    if not weights:
+        from models.logo_detector import find_latest_weights
+        latest = find_latest_weights(project_root)
+        if not latest:
+            print("No se encontró ningún modelo entrenado")
+            return 1
+        weights = [latest]
+
+    reports = [evaluate(path, args.dataset, args.split, args.imgsz, args.cache_dir, args.beta) for path in weights]
+    for report in reports:
+        print_report(report)
+        save_recommended_thresholds(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# export_detections.py
+import os
+import sys
+import argparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import storage
+
+# Filas por lote leído de la base de datos; cada lote es un row group de Parquet
+# o un record batch de Arrow, de modo que la memoria no depende del tamaño total
+DEFAULT_BATCH_SIZE = 65536
+
+EXPORT_FORMATS = ('parquet', 'arrow')
+
+# La caja se exporta en cuatro columnas numéricas en lugar del texto JSON
+EXPORT_SCHEMA = pa.schema([
+    ('rowid', pa.int64()),
+    ('video_name', pa.string()),
+    ('video_hash', pa.string()),
+    ('frame_number', pa.int32()),
+    ('box_index', pa.int32()),
+    ('brand', pa.string()),
+    ('confidence', pa.float64()),
+    ('timestamp', pa.float64()),
+    ('x1', pa.float32()),
+    ('y1', pa.float32()),
+    ('x2', pa.float32()),
+    ('y2', pa.float32()),
+    ('image_path', pa.string()),
+])
+
+
+def iter_record_batches(store, batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """
+    Recorre las detecciones filtradas (filtros de DetectionStore) en lotes de
+    batch_size filas y devuelve cada lote como un RecordBatch de Arrow. La base
+    de datos separa las coordenadas de la caja del texto JSON, así que en
+    Python solo se transponen las filas.
+    """
+    columns = (['rowid', 'video_name', 'video_hash', 'frame_number', 'box_index', 'brand',
+                'confidence', 'timestamp'] +
+               [store.bbox_coordinate(index) for index in range(4)] +
+               ['image_path'])
+    for rows in store.iter_batches(columns, batch_size, **filters):
+        arrays = [pa.array(values, type=field.type)
+                  for field, values in zip(EXPORT_SCHEMA, zip(*rows))]
+        yield pa.RecordBatch.from_arrays(arrays, schema=EXPORT_SCHEMA)
+
+
+def write_batches(batches, sink, fmt='parquet'):
+    """
+    Escribe los lotes en sink (ruta o fichero) a medida que llegan. En Parquet
+    cada lote es un row group; en Arrow se usa el formato IPC de fichero, que
+    después puede abrirse con memory map sin copiar los datos.
+    Devuelve el número de filas escritas.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+
+    rows = 0
+    if fmt == 'parquet':
+        with pq.ParquetWriter(sink, EXPORT_SCHEMA, compression='zstd') as writer:
+            for batch in batches:
+                writer.write_batch(batch, row_group_size=batch.num_rows)
+                rows += batch.num_rows
+    else:
+        with pa.ipc.new_file(sink, EXPORT_SCHEMA) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return rows
+
+
+def export_detections(store, output_path, fmt='parquet', batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """Exporta las detecciones filtradas del repositorio store a output_path"""
+    return write_batches(iter_record_batches(store, batch_size, **filters), output_path, fmt)
+
+
+def read_export(path):
+    """
+    Abre una exportación como tabla de Arrow. Los ficheros Arrow se mapean en
+    memoria, así que las columnas apuntan directamente al fichero sin copias.
+    """
+    if path.endswith('.parquet'):
+        return pq.read_table(path, memory_map=True)
+    # El mapa no se cierra aquí: los buffers de la tabla lo mantienen vivo
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta detecciones a Parquet o Arrow")
+    parser.add_argument('output', help="Fichero de salida (.parquet o .arrow)")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'database', 'detections.db'))
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default=None,
+                        help="Por defecto se deduce de la extensión del fichero")
+    parser.add_argument('--video', action='append', dest='video_names',
+                        help="Nombre exacto de un video (se puede repetir)")
+    parser.add_argument('--video-hash')
+    parser.add_argument('--brand')
+    parser.add_argument('--min-confidence', type=float)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('parquet' if args.output.endswith('.parquet') else 'arrow')
+    # STORAGE_URL indica el backend; sin ella se usa el fichero SQLite de --db
+    store = storage.open_store(default_path=args.db)
+    rows = export_detections(store, args.output, fmt, args.batch_size,
+                             video_names=args.video_names, video_hash=args.video_hash,
+                             brand=args.brand, min_confidence=args.min_confidence)
+    print(f"Exportadas {rows} detecciones a {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# job_queue.py
+import sqlite3
+import json
+import threading
+import socket
+import db_migration
+import storage
+from utils.helpers import compute_file_hash
+
+# Estados posibles de un trabajo
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    Cola de trabajos de análisis de video guardada en SQLite. La usan tanto la
+    API (para encolar y consultar) como los workers (para reclamar trabajos).
+    La cola vive siempre en el fichero db_path; los checkpoints con los que se
+    estima el avance se leen de store (por defecto el mismo fichero).
+    """
+
+    def __init__(self, db_path, store=None):
+        self.db_path = db_path
+        self.store = store or storage.SQLiteStore(db_path)
+        conn = self._connect()
+        try:
+            db_migration.create_jobs_schema(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_job(row):
+        job = dict(row)
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        job['stats'] = json.loads(job['stats']) if job['stats'] else None
+        job['progress'] = json.loads(job['progress']) if job['progress'] else None
+        return job
+
+    def submit(self, video_path, conf_thresholds, store_floor=None):
+        """Encola un video para analizar y devuelve el id del trabajo"""
+        params = {'conf_thresholds': conf_thresholds, 'store_floor': store_floor}
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''INSERT INTO jobs (video_path, params, status, created_at)
+                                     VALUES (?, ?, ?, ?)''',
+                                  (video_path, json.dumps(params), QUEUED, storage.utc_now()))
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        """Devuelve un trabajo por su id (o None si no existe)"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return self._row_to_job(row) if row else None
+        finally:
+            conn.close()
+
+    def list(self, status=None, limit=50):
+        """Lista los últimos trabajos, opcionalmente filtrados por estado"""
+        query = "SELECT * FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY job_id DESC LIMIT ?"
+        params.append(limit)
+        conn = self._connect()
+        try:
+            return [self._row_to_job(row) for row in conn.execute(query, params).fetchall()]
+        finally:
+            conn.close()
+
+    def claim(self, worker_name):
+        """
+        Reclama de forma atómica el trabajo en cola más antiguo. Varias hebras o
+        procesos pueden llamar a este método a la vez sin tomar el mismo trabajo.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute('''SELECT job_id FROM jobs WHERE status = ?
+                                  ORDER BY job_id LIMIT 1''', (QUEUED,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            conn.execute('''UPDATE jobs SET status = ?, worker = ?, started_at = ?
+                            WHERE job_id = ?''',
+                         (RUNNING, worker_name, storage.utc_now(), row['job_id']))
+            conn.commit()
+            return self.get(row['job_id'])
+        finally:
+            conn.close()
+
+    def update(self, job_id, **fields):
+        """Actualiza columnas de un trabajo (video_hash, start_frame, ...)"""
+        if not fields:
+            return
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        conn = self._connect()
+        try:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                         list(fields.values()) + [job_id])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def complete(self, job_id, stats):
+        self.update(job_id, status=COMPLETED, stats=json.dumps(stats),
+                    finished_at=storage.utc_now())
+
+    def fail(self, job_id, error):
+        self.update(job_id, status=FAILED, error=str(error),
+                    finished_at=storage.utc_now())
+
+    def requeue_running(self):
+        """
+        Vuelve a encolar los trabajos que quedaron en ejecución tras un reinicio.
+        Como el procesamiento usa checkpoints, continúan donde se quedaron.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute("UPDATE jobs SET status = ?, worker = NULL WHERE status = ?",
+                                  (QUEUED, RUNNING))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def report_progress(self, job_id, progress):
+        """Guarda el último avance notificado por process_video para un trabajo"""
+        self.update(job_id, progress=json.dumps(progress))
+
+    def progress(self, job):
+        """
+        Devuelve el avance de un trabajo: frames procesados, velocidad en fps,
+        tiempo restante estimado y, si el worker lo ha notificado, los conteos
+        parciales por marca. Sin notificaciones se estima desde el checkpoint.
+        """
+        live = job['progress']
+        if live:
+            progress = dict(live)
+            remaining = max((live['total_frames'] or 0) - live['frames_done'], 0)
+            progress['eta_seconds'] = remaining / live['fps'] if live['fps'] else None
+            return progress
+
+        progress = {'frames_done': 0, 'total_frames': None, 'fps': None, 'eta_seconds': None}
+        if not job['video_hash']:
+            return progress
+
+        try:
+            checkpoint = self.store.get('video_checkpoints', job['video_hash'])
+        except sqlite3.OperationalError:
+            # El detector todavía no ha creado la tabla de checkpoints
+            checkpoint = None
+        if checkpoint is None:
+            return progress
+
+        frames_done = checkpoint['last_frame'] + 1
+        progress['frames_done'] = frames_done
+        progress['total_frames'] = checkpoint['total_frames']
+
+        # La velocidad solo cuenta los frames procesados en esta ejecución
+        if job['status'] == RUNNING and job['started_at']:
+            # Ambas fechas se guardan en UTC con storage.TIMESTAMP_FORMAT
+            elapsed = (storage.parse_timestamp(checkpoint['updated_at']) -
+                       storage.parse_timestamp(job['started_at'])).total_seconds()
+            processed = frames_done - (job['start_frame'] or 0)
+            if elapsed > 0 and processed > 0:
+                progress['fps'] = processed / elapsed
+                remaining = max((checkpoint['total_frames'] or 0) - frames_done, 0)
+                progress['eta_seconds'] = remaining / progress['fps']
+        return progress
+
+
+class WorkerPool:
+    """
+    Conjunto de hebras que sacan trabajos de la cola y los procesan. El número de
+    hebras limita cuántos videos se analizan a la vez; cada hebra crea su propio
+    detector con detector_factory para no compartir el modelo entre hebras.
+    """
+
+    def __init__(self, queue, detector_factory, num_workers=1, poll_interval=2.0):
+        self.queue = queue
+        self.detector_factory = detector_factory
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        requeued = self.queue.requeue_running()
+        if requeued:
+            print(f"Reencolados {requeued} trabajos interrumpidos")
+        for i in range(self.num_workers):
+            worker_name = f"{socket.gethostname()}-{i}"
+            thread = threading.Thread(target=self._run, args=(worker_name,),
+                                      name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Iniciados {self.num_workers} workers de análisis")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, worker_name):
+        detector = None
+        while not self._stop.is_set():
+            job = self.queue.claim(worker_name)
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            print(f"[{worker_name}] Procesando trabajo {job['job_id']}: {job['video_path']}")
+            try:
+                if detector is None:
+                    detector = self.detector_factory()
+                self.process_job(detector, job)
+            except Exception as e:
+                print(f"[{worker_name}] Error en el trabajo {job['job_id']}: {str(e)}")
+                self.queue.fail(job['job_id'], e)
+
+    def process_job(self, detector, job):
+        """Procesa un trabajo reclamado y guarda su resultado en la cola"""
+        video_hash = compute_file_hash(job['video_path'])
+        checkpoint = detector.get_checkpoint(video_hash)
+        start_frame = checkpoint['last_frame'] + 1 if checkpoint else 0
+        self.queue.update(job['job_id'], video_hash=video_hash, start_frame=start_frame, progress=None)
+
+        params = job['params']
+        stats = detector.process_video(job['video_path'], params['conf_thresholds'],
+                                       resume=True, video_hash=video_hash,
+                                       store_floor=params.get('store_floor'), display=False,
+                                       progress_callback=lambda progress: self.queue.report_progress(
+                                           job['job_id'], progress))
+        if stats is None:
+            raise Exception("No se pudo procesar el video")
+        self.queue.complete(job['job_id'], stats)
@@ -2,9 +2,15 @@ import os
 from ultralytics import YOLO
 import cv2
 import numpy as np
-from datetime import datetime
 import sqlite3
 import json
+import time
+import db_migration
+import storage
+import db_writer
+from utils.helpers import compute_file_hash, build_cache_key
+from utils.training import cpu_training_defaults, ThroughputMonitor
+from utils.image_cache import PackedImageCache, packed_cache_trainer
 
 class LogoDetector:
     def __init__(self, weights_path=None, data_yaml=None):
@@ -14,6 +20,8 @@ class LogoDetector:
         data_yaml: ruta al archivo data.yaml para entrenamiento
         """
         self.model = YOLO('yolov8n.pt')  # Comenzar con modelo pre-entrenado
+        self.weights_path = 'yolov8n.pt'
+        self._model_hash = None
         self.data_yaml = data_yaml
         
         # Imprimir la ruta actual para debugging
@@ -35,6 +43,10 @@ class LogoDetector:
         self.db_path = os.path.join(database_dir, "detections.db")
         
         print(f"Ruta de la base de datos: {self.db_path}")
+        # Backend de detecciones (SQLite en db_path salvo que STORAGE_URL indique otro)
+        self.store = storage.open_store(default_path=self.db_path)
+        # Todas las escrituras de detecciones del proceso pasan por un único escritor
+        self.writer = db_writer.get_writer(self.store)
         # Limpiar base de datos y carpeta de imágenes al inicio
                 
         # Crear el directorio database si no existe
@@ -49,6 +61,7 @@ class LogoDetector:
         if weights_path and os.path.exists(weights_path):
             try:
                 self.model = YOLO(weights_path)
+                self.weights_path = weights_path
                 print(f"Modelo cargado desde: {weights_path}")
             except Exception as e:
                 print(f"Error al cargar el modelo: {str(e)}")
@@ -95,58 +108,193 @@ class LogoDetector:
     def setup_database(self):
         """Configura la base de datos para guardar las detecciones."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            
-            # Crear tabla para los análisis de videos
-            c.execute('''CREATE TABLE IF NOT EXISTS video_analysis
-                        (video_name TEXT,
-                        analysis_date TEXT,
-                        total_frames INTEGER,
-                        duration_seconds REAL,
-                        detection_summary TEXT)''')
-            
-            # Crear tabla detections con la estructura completa
-            c.execute('''CREATE TABLE IF NOT EXISTS detections
-                        (video_name TEXT,
-                        frame_number INTEGER,
-                        brand TEXT,
-                        confidence REAL,
-                        bbox TEXT,
-                        timestamp REAL,
-                        image_path TEXT)''')
-            
-            # Verificar la estructura
-            c.execute("PRAGMA table_info(detections)")
-            columns = {col[1] for col in c.fetchall()}
-            
-            required_columns = {
-                'video_name', 'frame_number', 'brand', 
-                'confidence', 'bbox', 'timestamp', 'image_path'
-            }
-            
-            if columns != required_columns:
-                print("La estructura de la tabla no es correcta. Ejecutando migración...")
-                conn.close()
-                
-                # Importar y ejecutar la migración
-                import db_migration
-                db_migration.migrate_database(self.db_path)
-                return
-            
-            conn.commit()
+            if isinstance(self.store, storage.SQLiteStore):
+                # Verificar la estructura de una base de datos SQLite existente
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    columns = {col[1] for col in conn.execute("PRAGMA table_info(detections)")}
+                finally:
+                    conn.close()
+
+                if columns and columns != set(storage.DETECTION_COLUMNS):
+                    print("La estructura de la tabla no es correcta. Ejecutando migración...")
+                    db_migration.migrate_database(self.db_path)
+
+            self.store.create_schema()
             print("Base de datos configurada correctamente")
-            
+
         except sqlite3.OperationalError as e:
             print(f"Error configurando la base de datos: {str(e)}")
             raise
-        finally:
-            if conn:
-                conn.close()
 
 
-    def process_video(self, video_path, conf_thresholds={'adidas': 0.50, 'nike': 0.50, 'puma': 0.50}):
-        """Procesa un video y devuelve estadísticas de detección con visualización"""
+    @property
+    def model_hash(self):
+        """Hash de los pesos del modelo cargado (se calcula una sola vez)"""
+        if self._model_hash is None:
+            weights_file = getattr(self.model, 'ckpt_path', None) or self.weights_path
+            if weights_file and os.path.exists(weights_file):
+                self._model_hash = compute_file_hash(weights_file)
+            else:
+                self._model_hash = str(self.weights_path)
+        return self._model_hash
+
+    def get_cached_stats(self, cache_key):
+        """Devuelve las estadísticas guardadas para una clave de caché (o None)"""
+        row = self.store.get('analysis_cache', cache_key)
+        return json.loads(row['stats']) if row else None
+
+    def save_cached_stats(self, cache_key, video_hash, conf_thresholds, stats):
+        """Guarda las estadísticas de un análisis completo en la caché"""
+        self.store.upsert('analysis_cache', {
+            'cache_key': cache_key,
+            'video_hash': video_hash,
+            'model_hash': self.model_hash,
+            'thresholds': json.dumps(conf_thresholds, sort_keys=True),
+            'stats': json.dumps(stats),
+            'created_at': storage.utc_now()
+        })
+
+    def recompute_stats(self, checkpoint, conf_thresholds):
+        """
+        Recalcula las estadísticas a partir de las detecciones ya guardadas de un
+        video completado, sin volver a ejecutar el modelo. Solo es posible si los
+        umbrales pedidos son iguales o más altos que los usados al guardar.
+        """
+        stored_thresholds = json.loads(checkpoint['thresholds'])
+        if any(brand not in stored_thresholds or conf < stored_thresholds[brand]
+               for brand, conf in conf_thresholds.items()):
+            return None
+
+        total_frames = checkpoint['total_frames']
+        detections_count, frames_with_detections = self.store.aggregate(
+            conf_thresholds, video_hash=checkpoint['video_hash'])
+
+        detections = {
+            brand: {
+                'total_detections': count,
+                'frames_with_detections': frames_with_detections[brand],
+                'percentage_time': (frames_with_detections[brand] / total_frames) * 100 if total_frames else 0.0
+            }
+            for brand, count in detections_count.items()
+        }
+
+        return {
+            'total_frames': total_frames,
+            'duration': total_frames / checkpoint['fps'] if checkpoint['fps'] else 0.0,
+            'thresholds_used': conf_thresholds,
+            'video_hash': checkpoint['video_hash'],
+            'detections': detections
+        }
+
+    def get_checkpoint(self, video_hash):
+        """Devuelve el checkpoint guardado para un video (o None si no existe)"""
+        return self.store.get('video_checkpoints', video_hash)
+
+    def _threshold_array(self, thresholds):
+        """
+        Convierte un diccionario marca -> umbral en un array indexado por el id de
+        clase del modelo. Las clases sin umbral quedan en infinito (nunca pasan).
+        """
+        names = self.model.names
+        threshold_array = np.full(max(names) + 1, np.inf, dtype=np.float32)
+        for cls_idx, name in names.items():
+            if name in thresholds:
+                threshold_array[cls_idx] = thresholds[name]
+        return threshold_array
+
+    @staticmethod
+    def _postprocess_boxes(results, storage_thr, visible_thr):
+        """
+        Extrae de una sola vez las clases, confianzas y cajas de un frame y aplica
+        los umbrales por clase con máscaras vectorizadas.
+        Devuelve los índices de las cajas a guardar, sus clases, confianzas, cajas
+        (xyxy en float y en int) y la máscara de las que superan el umbral del usuario.
+        """
+        boxes = results.boxes
+        cls_ids = boxes.cls.cpu().numpy().astype(np.int64)
+        confs = boxes.conf.cpu().numpy()
+        xyxy = boxes.xyxy.cpu().numpy()
+
+        keep = np.flatnonzero(confs >= storage_thr[cls_ids])
+        cls_ids, confs, xyxy = cls_ids[keep], confs[keep], xyxy[keep]
+        visible = confs >= visible_thr[cls_ids]
+        return keep, cls_ids, confs, xyxy, xyxy.astype(np.int64), visible
+
+    @staticmethod
+    def _brand_stats(names, conf_thresholds, detections_count, frames_with_detections, frames):
+        """
+        Convierte los contadores por id de clase en las estadísticas por marca.
+        frames es el número de frames sobre el que se calcula el porcentaje de tiempo.
+        """
+        name_to_idx = {name: cls_idx for cls_idx, name in names.items()}
+        detections = {}
+        for brand in conf_thresholds:
+            cls_idx = name_to_idx.get(brand)
+            count = int(detections_count[cls_idx]) if cls_idx is not None else 0
+            brand_frames = int(frames_with_detections[cls_idx]) if cls_idx is not None else 0
+            detections[brand] = {
+                'total_detections': count,
+                'frames_with_detections': brand_frames,
+                'percentage_time': (brand_frames / frames) * 100 if frames else 0.0
+            }
+        return detections
+
+    def _commit_frames(self, video_hash, first_frame, last_frame, rows, checkpoint):
+        """
+        Guarda en una sola transacción las detecciones de un bloque de frames y
+        el checkpoint. Las filas previas de esos frames se reemplazan, de forma
+        que reprocesar un video nunca duplica detecciones.
+        Con escritor compartido devuelve un Future que se resuelve al confirmar.
+        """
+        # Copia del checkpoint en este momento: el diccionario sigue cambiando
+        checkpoint_row = dict(checkpoint, video_hash=video_hash, last_frame=last_frame,
+                              updated_at=storage.utc_now())
+
+        def write(conn):
+            self.store.delete(conn, video_hash=video_hash, frame_start=first_frame, frame_end=last_frame)
+            self.store.insert_batch(rows, conn)
+            self.store.upsert('video_checkpoints', checkpoint_row, conn)
+
+        if self.writer is None:
+            with self.store.transaction() as conn:
+                write(conn)
+            return None
+        return self.writer.submit(write, rows=len(rows))
+
+    @staticmethod
+    def _check_writes(pending_writes, wait=False):
+        """
+        Descarta las escrituras ya confirmadas (o espera a todas con wait) y
+        relanza el error de la primera que haya fallado.
+        """
+        remaining = []
+        for future in pending_writes:
+            if future is None:
+                continue
+            if wait or future.done():
+                future.result()
+            else:
+                remaining.append(future)
+        return remaining
+
+    def process_video(self, video_path, conf_thresholds={'adidas': 0.50, 'nike': 0.50, 'puma': 0.50},
+                      resume=False, checkpoint_interval=100, video_hash=None, store_floor=None,
+                      display=True, progress_callback=None, progress_interval=25):
+        """
+        Procesa un video y devuelve estadísticas de detección con visualización.
+        resume: si es True continúa desde el último frame confirmado del video
+        checkpoint_interval: número de frames que se confirman juntos en la base de datos
+        video_hash: hash del contenido si ya se ha calculado (por ejemplo al subir el fichero)
+        store_floor: si se indica, se guardan todas las cajas de cualquier marca con
+            confianza >= store_floor, de modo que después se pueden recalcular las
+            estadísticas para otros umbrales sin volver a ejecutar el modelo
+        display: muestra los frames en una ventana de OpenCV (desactivar al procesar
+            en segundo plano)
+        progress_callback: función que recibe cada progress_interval frames un
+            diccionario con frames procesados, fps actuales, conteos por marca y
+            porcentaje de tiempo en pantalla parcial
+        """
         print(f"Procesando video: {video_path}")
         video_name = os.path.basename(video_path)
 
@@ -155,38 +303,129 @@ class LogoDetector:
         os.makedirs(images_dir, exist_ok=True)
         print(f"Directorio de imágenes: {images_dir}")
 
+        # Identificar el video por su contenido para que el checkpoint no dependa del nombre
+        if video_hash is None:
+            video_hash = compute_file_hash(video_path)
+
+        # Umbrales con los que se guardan las cajas: los del usuario o el suelo común
+        if store_floor is not None:
+            storage_thresholds = {name: min(float(store_floor), float(conf_thresholds.get(name, 1.0)))
+                                  for name in self.model.names.values()}
+        else:
+            storage_thresholds = conf_thresholds
+        thresholds_json = json.dumps(storage_thresholds, sort_keys=True)
+
+        # Un video idéntico analizado con el mismo modelo y umbrales no se reprocesa
+        cache_key = build_cache_key(video_hash, self.model_hash, conf_thresholds)
+        cached_stats = self.get_cached_stats(cache_key)
+        if cached_stats:
+            print("Resultado recuperado de la caché")
+            return dict(cached_stats, cache_hit=True)
+
+        checkpoint = self.get_checkpoint(video_hash)
+        if checkpoint and checkpoint['model_hash'] != self.model_hash:
+            checkpoint = None
+
+        # Si solo han cambiado los umbrales se recalcula desde las detecciones guardadas
+        if checkpoint and checkpoint['status'] == 'completed':
+            stats = self.recompute_stats(checkpoint, conf_thresholds)
+            if stats:
+                print("Estadísticas recalculadas desde las detecciones guardadas")
+                self.save_cached_stats(cache_key, video_hash, conf_thresholds, stats)
+                return dict(stats, cache_hit=True)
+
+        start_frame = 0
+        if resume and checkpoint:
+            if checkpoint['thresholds'] == thresholds_json:
+                start_frame = checkpoint['last_frame'] + 1
+                print(f"Reanudando desde el frame {start_frame} ({checkpoint['status']})")
+            else:
+                print("Los umbrales han cambiado desde el último checkpoint. Procesando desde el inicio")
+
         try:
             cap = cv2.VideoCapture(video_path)
             if not cap.isOpened():
                 raise Exception("No se pudo abrir el video")
 
             # Crear ventana para visualización
-            cv2.namedWindow('Detecciones', cv2.WINDOW_NORMAL)
+            if display:
+                cv2.namedWindow('Detecciones', cv2.WINDOW_NORMAL)
             
             # Obtener propiedades del video para el video de salida
             frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             fps = cap.get(cv2.CAP_PROP_FPS)
             
-            # Configurar el video de salida
+            # Configurar el video de salida. Al reanudar se escribe un fichero
+            # aparte para no sobrescribir la parte ya procesada
             output_path = os.path.join(os.path.dirname(self.db_path), "processed_videos")
             os.makedirs(output_path, exist_ok=True)
-            output_video = os.path.join(output_path, f"processed_{video_name}")
+            if start_frame:
+                output_video = os.path.join(output_path, f"processed_{start_frame}_{video_name}")
+            else:
+                output_video = os.path.join(output_path, f"processed_{video_name}")
             fourcc = cv2.VideoWriter_fourcc(*'mp4v')
             out = cv2.VideoWriter(output_video, fourcc, fps, (frame_width, frame_height))
 
             try:
-                conn = sqlite3.connect(self.db_path)
-                c = conn.cursor()
-                
                 total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
                 duration = total_frames / fps
                 
-                # Inicializar contadores
-                detections_count = {brand: 0 for brand in conf_thresholds.keys()}
-                frames_with_detections = {brand: 0 for brand in conf_thresholds.keys()}
-
-                frame_number = 0
+                # Umbrales por id de clase para filtrar las cajas con máscaras
+                names = self.model.names
+                storage_thr = self._threshold_array(storage_thresholds)
+                visible_thr = self._threshold_array(conf_thresholds)
+                min_conf = float(min(storage_thresholds.values()))
+
+                # Inicializar contadores por id de clase (con lo ya confirmado si se reanuda)
+                detections_count = np.zeros(len(storage_thr), dtype=np.int64)
+                frames_with_detections = np.zeros(len(storage_thr), dtype=np.int64)
+                if start_frame:
+                    committed_counts, committed_frames = self.store.aggregate(
+                        conf_thresholds, video_hash=video_hash, last_frame=start_frame - 1)
+                    for cls_idx, name in names.items():
+                        detections_count[cls_idx] = committed_counts.get(name, 0)
+                        frames_with_detections[cls_idx] = committed_frames.get(name, 0)
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+                # La antigüedad que usa la retención cuenta desde el análisis que
+                # produjo las detecciones guardadas: se conserva al reanudar y se
+                # renueva al procesar el video desde el principio
+                if start_frame and checkpoint and checkpoint['created_at']:
+                    created_at = checkpoint['created_at']
+                else:
+                    created_at = storage.utc_now()
+
+                checkpoint = {
+                    'video_name': video_name,
+                    'video_path': os.path.abspath(video_path),
+                    'total_frames': total_frames,
+                    'fps': fps,
+                    'thresholds': thresholds_json,
+                    'model_hash': self.model_hash,
+                    'created_at': created_at,
+                    'status': 'processing'
+                }
+                pending_rows = []
+                pending_start = start_frame
+                pending_writes = []
+
+                frame_number = start_frame
+                stopped = False
+                run_started = time.perf_counter()
+
+                def report_progress(status):
+                    elapsed = time.perf_counter() - run_started
+                    processed = frame_number - start_frame
+                    progress_callback({
+                        'status': status,
+                        'video_hash': video_hash,
+                        'frames_done': frame_number,
+                        'total_frames': total_frames,
+                        'fps': processed / elapsed if elapsed > 0 else 0.0,
+                        'detections': self._brand_stats(names, conf_thresholds, detections_count,
+                                                        frames_with_detections, frame_number)
+                    })
                 while cap.isOpened():
                     ret, frame = cap.read()
                     if not ret:
@@ -196,92 +435,112 @@ class LogoDetector:
                     frame_with_boxes = frame.copy()
 
                     # Usar el valor mínimo de confianza para la predicción inicial
-                    min_conf = float(min(conf_thresholds.values()))
                     results = self.model.predict(frame, conf=min_conf, verbose=False)[0]
 
-                    frame_detections = {brand: False for brand in detections_count.keys()}
+                    # Postprocesado vectorizado: una sola copia a CPU por frame
+                    box_indices, cls_ids, confs, xyxy, xyxy_int, visible = self._postprocess_boxes(
+                        results, storage_thr, visible_thr)
+
+                    # Actualizar contadores con operaciones sobre arrays
+                    visible_cls = cls_ids[visible]
+                    detections_count += np.bincount(visible_cls, minlength=len(detections_count))
+                    frames_with_detections[np.unique(visible_cls)] += 1
 
-                    # Procesar cada detección
-                    for box in results.boxes:
+                    # Dibujar, recortar y preparar las filas de las cajas que se guardan
+                    for i in range(len(box_indices)):
                         try:
-                            cls_idx = int(box.cls[0])
-                            cls = results.names[cls_idx]
-                            conf = float(box.conf[0])
-
-                            if cls not in conf_thresholds or conf < conf_thresholds[cls]:
-                                continue
-
-                            xyxy = box.xyxy[0].cpu().numpy()
-                            x1, y1, x2, y2 = map(int, xyxy)
-
-                            # Dibujar bounding box y etiqueta
-                            cv2.rectangle(frame_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                            label = f"{cls}: {conf:.2f}"
-                            cv2.putText(frame_with_boxes, label, (x1, y1-10), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-                            # Extraer y guardar la imagen del bounding box
-                            bbox_image = frame[y1:y2, x1:x2]
-                            if bbox_image.size > 0:
-                                image_filename = f"{video_name}_frame{frame_number}_brand{cls}_{conf:.2f}.jpg"
-                                image_path = os.path.join(images_dir, image_filename)
-                                cv2.imwrite(image_path, bbox_image)
-
-                            # Guardar detección en la base de datos
-                            c.execute('''INSERT INTO detections
-                                        (video_name, frame_number, brand, confidence, bbox, timestamp, image_path)
-                                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                                    (video_name, frame_number, cls, conf, 
-                                    json.dumps(xyxy.tolist()), timestamp, image_filename))
-                            conn.commit()
-
-                            # Actualizar contadores
-                            detections_count[cls] += 1
-                            frame_detections[cls] = True
+                            cls = names[int(cls_ids[i])]
+                            conf = float(confs[i])
+                            x1, y1, x2, y2 = xyxy_int[i].tolist()
+
+                            # Las cajas por debajo del umbral del usuario solo se guardan
+                            image_filename = None
+                            if visible[i]:
+                                # Dibujar bounding box y etiqueta
+                                cv2.rectangle(frame_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                                label = f"{cls}: {conf:.2f}"
+                                cv2.putText(frame_with_boxes, label, (x1, y1-10), 
+                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+                                # Extraer y guardar la imagen del bounding box
+                                bbox_image = frame[y1:y2, x1:x2]
+                                if bbox_image.size > 0:
+                                    image_filename = f"{video_name}_frame{frame_number}_brand{cls}_{conf:.2f}.jpg"
+                                    image_path = os.path.join(images_dir, image_filename)
+                                    cv2.imwrite(image_path, bbox_image)
+
+                            # La detección se guarda junto con el resto del bloque de frames
+                            pending_rows.append((video_name, frame_number, cls, conf,
+                                                 json.dumps(xyxy[i].tolist()), timestamp, image_filename,
+                                                 video_hash, int(box_indices[i])))
 
                         except Exception as e:
                             print(f"Error procesando detección: {str(e)}")
                             continue
 
-                    # Actualizar frames_with_detections
-                    for brand, detected in frame_detections.items():
-                        if detected:
-                            frames_with_detections[brand] += 1
-
                     # Mostrar el frame con las detecciones
-                    cv2.imshow('Detecciones', frame_with_boxes)
+                    if display:
+                        cv2.imshow('Detecciones', frame_with_boxes)
                     out.write(frame_with_boxes)
 
+                    # Confirmar el bloque de frames y avanzar el checkpoint
+                    if frame_number - pending_start + 1 >= checkpoint_interval:
+                        pending_writes.append(self._commit_frames(video_hash, pending_start, frame_number,
+                                                                  pending_rows, checkpoint))
+                        pending_writes = self._check_writes(pending_writes)
+                        pending_rows = []
+                        pending_start = frame_number + 1
+
+                    frame_number += 1
+
                     # Permitir salir con 'q'
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                    if display and cv2.waitKey(1) & 0xFF == ord('q'):
+                        stopped = True
                         break
 
-                    frame_number += 1
                     if frame_number % 100 == 0:
                         print(f"Procesados {frame_number}/{total_frames} frames...")
 
+                    if progress_callback and frame_number % progress_interval == 0:
+                        report_progress('processing')
+
+                # Confirmar los frames pendientes y marcar el estado final. El
+                # número de frames de la cabecera es una estimación: el video
+                # está completo al agotarse el stream salvo que se saliera con 'q'
+                if not stopped:
+                    total_frames = frame_number
+                    duration = total_frames / fps
+                    checkpoint['total_frames'] = total_frames
+                if frame_number >= total_frames:
+                    checkpoint['status'] = 'completed'
+                if frame_number > pending_start or checkpoint['status'] == 'completed':
+                    pending_writes.append(self._commit_frames(video_hash, pending_start,
+                                                              max(frame_number - 1, pending_start - 1),
+                                                              pending_rows, checkpoint))
+                # Las estadísticas solo se devuelven con todo confirmado en la base de datos
+                self._check_writes(pending_writes, wait=True)
+
                 stats = {
                     'total_frames': total_frames,
                     'duration': duration,
                     'thresholds_used': conf_thresholds,
-                    'detections': {
-                        brand: {
-                            'total_detections': count,
-                            'frames_with_detections': frames_with_detections[brand],
-                            'percentage_time': (frames_with_detections[brand] / total_frames) * 100
-                        }
-                        for brand, count in detections_count.items()
-                    }
+                    'video_hash': video_hash,
+                    'detections': self._brand_stats(names, conf_thresholds, detections_count,
+                                                    frames_with_detections, total_frames)
                 }
 
+                if progress_callback:
+                    report_progress(checkpoint['status'])
+
+                if checkpoint['status'] == 'completed':
+                    self.save_cached_stats(cache_key, video_hash, conf_thresholds, stats)
+
                 return stats
 
             except Exception as e:
                 print(f"Error procesando el video: {str(e)}")
                 return None
             finally:
-                if 'conn' in locals():
-                    conn.close()
                 if 'out' in locals():
                     out.release()
 
@@ -291,7 +550,73 @@ class LogoDetector:
         finally:
             if 'cap' in locals():
                 cap.release()
-            cv2.destroyAllWindows()
+            if display:
+                cv2.destroyAllWindows()
+
+    def train(self, epochs=100, imgsz=640, batch=None, workers=None, cache=None, device='cpu',
+              resume=True, patience=20, packed_cache=True):
+        """
+        Entrena el modelo con el dataset de data_yaml. Los parámetros que no se
+        indiquen se eligen según la máquina: batch según la RAM libre, caché de
+        imágenes en RAM o en disco según el espacio y workers según los núcleos.
+        resume: si el último entrenamiento quedó a medias continúa desde su last.pt
+        packed_cache: si existe la caché empaquetada del split de entrenamiento
+            (python -m utils.image_cache) se lee de ella en lugar de decodificar
+            los JPEG en cada época
+        Guarda en throughput.json la duración de cada época y las imágenes/s.
+        Devuelve la ruta a los mejores pesos (o None si no se pudo entrenar).
+        """
+        if not self.data_yaml or not os.path.exists(self.data_yaml):
+            print(f"Error: No se encuentra data.yaml en {self.data_yaml}")
+            return None
+
+        project_root = os.path.dirname(os.path.dirname(self.db_path))
+        last_checkpoint = find_latest_run_file(project_root, "last.pt") if resume else None
+        model = None
+        if last_checkpoint:
+            print(f"Reanudando entrenamiento desde: {last_checkpoint}")
+            model = YOLO(last_checkpoint)
+            monitor = ThroughputMonitor({'resume': last_checkpoint})
+            monitor.register(model)
+            try:
+                model.train(resume=True)
+            except AssertionError as e:
+                # ultralytics no reanuda un entrenamiento que ya terminó
+                print(f"No se puede reanudar ({str(e)}), se inicia un entrenamiento nuevo")
+                model = None
+
+        if model is None:
+            train_images = os.path.join(os.path.dirname(self.data_yaml), "train", "images")
+            defaults = cpu_training_defaults(train_images, imgsz)
+            settings = {
+                'epochs': epochs,
+                'imgsz': imgsz,
+                'batch': batch or defaults['batch'],
+                'workers': workers if workers is not None else defaults['workers'],
+                'cache': cache if cache is not None else defaults['cache'],
+                'device': device,
+            }
+            trainer = None
+            if packed_cache and PackedImageCache.open(os.path.dirname(train_images), imgsz):
+                # Las imágenes ya están decodificadas en el mmap compartido
+                trainer = packed_cache_trainer()
+                settings['cache'] = False
+            print(f"Entrenando con {defaults['num_images']} imágenes y parámetros: {settings}")
+
+            model = YOLO('yolov8n.pt')
+            monitor = ThroughputMonitor({**settings, 'packed_cache': trainer is not None})
+            monitor.register(model)
+            model.train(data=self.data_yaml, project=os.path.join(project_root, "runs", "detect"),
+                        name='logo_detection', patience=patience, trainer=trainer, **settings)
+
+        best_weights = str(model.trainer.best)
+        if os.path.exists(best_weights):
+            self.model = YOLO(best_weights)
+            self.weights_path = best_weights
+            self._model_hash = None
+            print(f"Modelo entrenado guardado en: {best_weights}")
+            return best_weights
+        return None
 
     def generate_report(self, stats):
         """Genera un informe legible de las estadísticas"""
@@ -310,6 +635,22 @@ class LogoDetector:
             print(f"- Frames con detecciones: {brand_stats['frames_with_detections']}")
             print(f"- Porcentaje de tiempo en pantalla: {brand_stats['percentage_time']:.2f}%")
 
+def find_latest_run_file(project_root, filename):
+    """Busca un fichero de pesos del último entrenamiento en runs/detect (o None si no hay)"""
+    runs_dir = os.path.join(project_root, "runs", "detect")
+    if os.path.exists(runs_dir):
+        detection_folders = [f for f in os.listdir(runs_dir) if f.startswith('logo_detection')]
+        if detection_folders:
+            last_folder = sorted(detection_folders, key=lambda x: int(x.replace('logo_detection', '') or 0))[-1]
+            weights_path = os.path.join(runs_dir, last_folder, "weights", filename)
+            if os.path.exists(weights_path):
+                return weights_path
+    return None
+
+def find_latest_weights(project_root):
+    """Busca el best.pt del último entrenamiento en runs/detect (o None si no hay)"""
+    return find_latest_run_file(project_root, "best.pt")
+
 def main():
     # Ruta base del proyecto
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -318,15 +659,7 @@ def main():
     data_yaml = os.path.join(project_root, "data", "dataset_yolo", "data.yaml")
     
     # Buscar el último modelo entrenado
-    runs_dir = os.path.join(project_root, "runs", "detect")
-    last_model = None
-    if os.path.exists(runs_dir):
-        detection_folders = [f for f in os.listdir(runs_dir) if f.startswith('logo_detection')]
-        if detection_folders:
-            last_folder = sorted(detection_folders, key=lambda x: int(x.replace('logo_detection', '') or 0))[-1]
-            weights_path = os.path.join(runs_dir, last_folder, "weights", "best.pt")
-            if os.path.exists(weights_path):
-                last_model = weights_path
+    last_model = find_latest_weights(project_root)
 
     print(f"Usando data.yaml en: {data_yaml}")
     if last_model:
@@ -0,0 +1,298 @@
+# retention.py
+import os
+import re
+import sys
+import time
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+import storage
+
+# Filas borradas por transacción: transacciones cortas que no bloquean a la app
+DEFAULT_DELETE_BATCH = 2000
+# Los recortes recientes pueden pertenecer a un bloque aún sin confirmar
+CROP_GRACE_SECONDS = 3600
+# Se hace VACUUM cuando las páginas libres superan esta fracción del fichero
+VACUUM_FREE_RATIO = 0.2
+# Estado del checkpoint de un video al que la retención ha quitado detecciones
+EXPIRED = 'expired'
+# Estado del checkpoint que se crea para las detecciones anteriores a los checkpoints
+UNTRACKED = 'untracked'
+
+
+def parse_policies(max_age_days=None, brand_ages=None):
+    """
+    Construye la lista de políticas a partir de una antigüedad general y de
+    antigüedades por marca ('puma:30,nike:60'). Cada política es un diccionario
+    con max_age_days y, opcionalmente, brand.
+    """
+    policies = []
+    if max_age_days not in (None, ''):
+        policies.append({'max_age_days': float(max_age_days)})
+    if brand_ages:
+        for item in brand_ages.split(','):
+            brand, days = item.split(':')
+            policies.append({'brand': brand.strip(), 'max_age_days': float(days)})
+    return policies
+
+
+def video_created_at(checkpoint):
+    """
+    Instante (UTC) en que se registró un video según su checkpoint. Los
+    checkpoints anteriores a created_at usan su última actualización.
+    """
+    value = checkpoint['created_at'] or checkpoint['updated_at']
+    return storage.parse_timestamp(value) if value else None
+
+
+def expired_videos(store, max_age_days, now=None):
+    """
+    Videos registrados hace más de max_age_days días, como pares (video_hash,
+    video_name) del más antiguo al más reciente. La antigüedad sale de
+    created_at en video_checkpoints, que se conserva al reanudar o al aplicar
+    una política por marca y se renueva al volver a analizar el video desde el
+    principio; cada video se identifica por su hash, de modo que dos videos
+    con el mismo nombre no comparten la política.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=max_age_days)
+    expired = []
+    for checkpoint in store.rows('video_checkpoints'):
+        created_at = video_created_at(checkpoint)
+        if created_at is not None and created_at < cutoff:
+            expired.append((created_at, checkpoint['video_hash'], checkpoint['video_name']))
+    return [(video_hash, video_name) for _, video_hash, video_name in sorted(expired)]
+
+
+def track_untracked_videos(store, now=None):
+    """
+    Crea un checkpoint para los videos con detecciones pero sin checkpoint
+    (guardados antes de que existieran), con created_at igual a now. Así su
+    antigüedad empieza a contar y la retención los acaba seleccionando.
+    Devuelve el número de videos registrados.
+    """
+    now = now or datetime.now(timezone.utc)
+    with store.transaction() as conn:
+        tracked = {row['video_hash'] for row in store.rows('video_checkpoints', conn)}
+        untracked = [video for video in store.search_videos(conn=conn) if video['video_hash'] not in tracked]
+        for video in untracked:
+            store.upsert('video_checkpoints', {'video_hash': video['video_hash'], 'video_name': video['video_name'],
+                                               'last_frame': -1, 'status': UNTRACKED,
+                                               'created_at': now.strftime(storage.TIMESTAMP_FORMAT)}, conn)
+    return len(untracked)
+
+
+def archive_detections(store, archive_dir, video_hash, video_name, brand=None):
+    """
+    Guarda en un Parquet comprimido las detecciones que se van a borrar, con el
+    mismo formato que export_detections. Devuelve la ruta del archivo o None si
+    no había filas.
+    """
+    from export_detections import iter_record_batches, write_batches
+
+    os.makedirs(archive_dir, exist_ok=True)
+    # El hash distingue los archivos de dos videos con el mismo nombre
+    safe_name = re.sub(r'[^\w.-]', '_', f"{video_name}_{video_hash[:12]}")
+    suffix = f"_{brand}" if brand else ""
+    archive_path = os.path.join(archive_dir, f"{safe_name}{suffix}_{datetime.now():%Y%m%d%H%M%S}.parquet")
+
+    rows = write_batches(iter_record_batches(store, video_hash=video_hash, brand=brand),
+                         archive_path, 'parquet')
+    if rows == 0:
+        os.remove(archive_path)
+        return None
+    return archive_path
+
+
+def delete_in_batches(store, batch_size=DEFAULT_DELETE_BATCH, pause=0.0, **filters):
+    """
+    Borra las detecciones que cumplen los filtros en transacciones de
+    batch_size filas, dejando que otros procesos escriban entre lotes.
+    Devuelve el número de filas borradas.
+    """
+    deleted = 0
+    while True:
+        with store.transaction() as conn:
+            rowids = [row['rowid'] for row in store.query(['rowid'], order_by=None, limit=batch_size,
+                                                          conn=conn, **filters)]
+            if rowids:
+                deleted += store.delete(conn, rowids=rowids)
+        if len(rowids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def invalidate_video(store, video_hash):
+    """
+    Invalida lo derivado de las detecciones de un video tras borrar parte de
+    ellas: su caché de estadísticas y su checkpoint 'completed', que ya no
+    describe lo guardado. Si aún le quedan detecciones (política por marca) el
+    checkpoint se marca como caducado y desde el frame -1, de modo que un nuevo
+    análisis lo procesa entero y no reutiliza las detecciones incompletas; su
+    created_at se conserva. Si no le queda ninguna se elimina el checkpoint.
+    """
+    with store.transaction() as conn:
+        store.delete_key('analysis_cache', 'video_hash', video_hash, conn)
+        if store.query(['rowid'], order_by=None, limit=1, conn=conn, video_hash=video_hash):
+            store.upsert('video_checkpoints', {'video_hash': video_hash, 'status': EXPIRED, 'last_frame': -1},
+                         conn)
+        else:
+            store.delete_key('video_checkpoints', 'video_hash', video_hash, conn)
+
+
+def collect_garbage_crops(store, images_dir, thumbnails_dir=None, grace_seconds=CROP_GRACE_SECONDS):
+    """
+    Borra los recortes (y sus miniaturas) que ya no referencia ninguna
+    detección. Los ficheros más nuevos que grace_seconds se conservan porque
+    process_video guarda el recorte antes de confirmar su fila.
+    Devuelve el número de ficheros borrados.
+    """
+    if not os.path.isdir(images_dir):
+        return 0
+    referenced = {os.path.basename(row['image_path'])
+                  for row in store.query(['image_path'], order_by=None, distinct=True)
+                  if row['image_path']}
+
+    cutoff = time.time() - grace_seconds
+    directories = [images_dir]
+    if thumbnails_dir and os.path.isdir(thumbnails_dir):
+        directories += [os.path.join(thumbnails_dir, size) for size in os.listdir(thumbnails_dir)]
+
+    removed = 0
+    for directory in directories:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name in referenced:
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+    return removed
+
+
+def compact_database(db_path, vacuum_free_ratio=VACUUM_FREE_RATIO, force_vacuum=False):
+    """
+    Actualiza las estadísticas del planificador (ANALYZE) y, si una parte
+    importante del fichero son páginas libres tras los borrados, lo compacta
+    con VACUUM. Solo para el backend SQLite. Devuelve True si se ha hecho VACUUM.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if force_vacuum or (page_count and free_pages / page_count >= vacuum_free_ratio):
+            conn.execute("VACUUM")
+            # En modo WAL se devuelve también el espacio del fichero -wal
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return True
+        return False
+    finally:
+        conn.close()
+
+
+def run_retention(store, policies, images_dir=None, thumbnails_dir=None, archive_dir=None,
+                  batch_size=DEFAULT_DELETE_BATCH, dry_run=False, now=None):
+    """
+    Aplica las políticas de retención: para cada video expirado que tiene
+    detecciones afectadas (todas, o las de la marca de la política) las
+    archiva si se indica archive_dir, las borra por lotes e invalida su caché
+    y su checkpoint. Los videos sin nada que borrar no se tocan. Después
+    recoge los recortes huérfanos y, en SQLite, compacta la base de datos.
+    Devuelve un resumen de lo hecho.
+    """
+    report = {'videos': [], 'deleted': 0, 'archives': [], 'crops_removed': 0, 'vacuumed': False}
+
+    if not dry_run:
+        track_untracked_videos(store, now)
+    targets = [(video_hash, video_name, policy.get('brand'))
+               for policy in policies
+               for video_hash, video_name in expired_videos(store, policy['max_age_days'], now)]
+
+    for video_hash, video_name, brand in targets:
+        if not store.query(['rowid'], order_by=None, limit=1, video_hash=video_hash, brand=brand):
+            continue
+        if not dry_run:
+            if archive_dir:
+                archive_path = archive_detections(store, archive_dir, video_hash, video_name, brand)
+                if archive_path:
+                    report['archives'].append(archive_path)
+            deleted = delete_in_batches(store, batch_size, video_hash=video_hash, brand=brand)
+            if not deleted:
+                continue
+            report['deleted'] += deleted
+            invalidate_video(store, video_hash)
+        report['videos'].append({'video_hash': video_hash, 'video_name': video_name, 'brand': brand})
+
+    if not dry_run:
+        if images_dir:
+            report['crops_removed'] = collect_garbage_crops(store, images_dir, thumbnails_dir)
+        if isinstance(store, storage.SQLiteStore):
+            report['vacuumed'] = compact_database(store.db_path)
+    return report
+
+
+class RetentionScheduler:
+    """Hebra que ejecuta run_retention periódicamente (por ejemplo desde la API)"""
+
+    def __init__(self, store, policies, interval_hours=24.0, **options):
+        self.store = store
+        self.policies = policies
+        self.interval = interval_hours * 3600
+        self.options = options
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                report = run_retention(self.store, self.policies, **self.options)
+                print(f"Retención: {len(report['videos'])} videos, {report['deleted']} detecciones borradas, "
+                      f"{report['crops_removed']} recortes eliminados")
+            except Exception as e:
+                print(f"Error aplicando la retención: {str(e)}")
+
+
+def main(argv=None):
+    database_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database')
+    parser = argparse.ArgumentParser(description="Retención, archivado y compactación de detecciones")
+    parser.add_argument('--db', default=os.path.join(database_dir, 'detections.db'))
+    parser.add_argument('--max-age-days', type=float, help="Antigüedad máxima de cualquier video")
+    parser.add_argument('--brand-ages', help="Antigüedad máxima por marca: puma:30,nike:60")
+    parser.add_argument('--archive-dir', help="Guarda en Parquet lo que se borra")
+    parser.add_argument('--images-dir', default=os.path.join(database_dir, 'images'))
+    parser.add_argument('--thumbnails-dir', default=os.path.join(database_dir, 'thumbnails'))
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_DELETE_BATCH)
+    parser.add_argument('--dry-run', action='store_true', help="Solo muestra qué se borraría")
+    args = parser.parse_args(argv)
+
+    policies = parse_policies(args.max_age_days, args.brand_ages)
+    # STORAGE_URL indica el backend; sin ella se usa el fichero SQLite de --db
+    store = storage.open_store(default_path=args.db)
+    report = run_retention(store, policies, args.images_dir, args.thumbnails_dir, args.archive_dir,
+                           args.batch_size, args.dry_run)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
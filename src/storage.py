@@ -0,0 +1,641 @@
+# storage.py
+import os
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import db_migration
+
+# Definición única de las tablas compartidas por todos los backends. Los tipos
+# son lógicos ('text', 'integer', 'real') y cada backend los traduce a los suyos.
+SCHEMA = {
+    'detections': [
+        ('video_name', 'text'),
+        ('frame_number', 'integer'),
+        ('brand', 'text'),
+        ('confidence', 'real'),
+        ('bbox', 'text'),
+        ('timestamp', 'real'),
+        ('image_path', 'text'),
+        ('video_hash', 'text'),
+        ('box_index', 'integer'),
+    ],
+    'video_analysis': [
+        ('video_name', 'text'),
+        ('analysis_date', 'text'),
+        ('total_frames', 'integer'),
+        ('duration_seconds', 'real'),
+        ('detection_summary', 'text'),
+    ],
+    'video_checkpoints': [
+        ('video_hash', 'text'),
+        ('video_name', 'text'),
+        ('video_path', 'text'),
+        ('last_frame', 'integer'),
+        ('total_frames', 'integer'),
+        ('fps', 'real'),
+        ('thresholds', 'text'),
+        ('status', 'text'),
+        ('updated_at', 'text'),
+        ('model_hash', 'text'),
+        # Inicio (UTC) del análisis que produjo las detecciones guardadas; se
+        # conserva al reanudar y lo usa la retención
+        ('created_at', 'text'),
+    ],
+    # Copia de las detecciones que los usuarios borran desde la API (falsos
+    # positivos) para devolverlas al entrenamiento como negativos difíciles
+    'detection_tombstones': [
+        ('video_name', 'text'),
+        ('frame_number', 'integer'),
+        ('brand', 'text'),
+        ('confidence', 'real'),
+        ('bbox', 'text'),
+        ('timestamp', 'real'),
+        ('video_hash', 'text'),
+        ('box_index', 'integer'),
+        ('deleted_at', 'text'),
+    ],
+    'analysis_cache': [
+        ('cache_key', 'text'),
+        ('video_hash', 'text'),
+        ('model_hash', 'text'),
+        ('thresholds', 'text'),
+        ('stats', 'text'),
+        ('created_at', 'text'),
+    ],
+}
+
+# Tablas que solo existen en el backend SQLite: la cola de trabajos de la API
+# y el catálogo de videos que mantienen los triggers de db_migration. El
+# tercer elemento, si lo hay, son las restricciones de la columna.
+SQLITE_SCHEMA = {
+    'jobs': [
+        ('job_id', 'integer', 'PRIMARY KEY AUTOINCREMENT'),
+        ('video_path', 'text'),
+        ('video_hash', 'text'),
+        ('params', 'text'),
+        ('status', 'text'),
+        ('worker', 'text'),
+        ('start_frame', 'integer'),
+        ('stats', 'text'),
+        ('error', 'text'),
+        ('created_at', 'text'),
+        ('started_at', 'text'),
+        ('finished_at', 'text'),
+        ('progress', 'text'),
+    ],
+    'videos': [
+        ('video_id', 'integer', 'PRIMARY KEY'),
+        ('video_hash', 'text', 'UNIQUE'),
+        ('video_name', 'text'),
+        ('detection_count', 'integer', 'DEFAULT 0'),
+    ],
+}
+
+# Clave primaria de las tablas que se actualizan con upsert
+PRIMARY_KEYS = {
+    'video_checkpoints': 'video_hash',
+    'analysis_cache': 'cache_key',
+}
+
+DETECTION_COLUMNS = [name for name, _ in SCHEMA['detections']]
+# Columnas de detections que se conservan al registrar un borrado
+TOMBSTONE_COLUMNS = [name for name, _ in SCHEMA['detection_tombstones'] if name != 'deleted_at']
+
+# Índices de consulta sobre detections (nombre -> columnas)
+DETECTION_INDEXES = {
+    'idx_detections_video_brand_conf': ('video_hash', 'brand', 'confidence'),
+    'idx_detections_video_name_time': ('video_name', 'timestamp'),
+}
+# Índice único (video_hash, frame, caja) que hace idempotente insert_batch en
+# todos los backends: reprocesar un bloque nunca duplica detecciones
+UNIQUE_DETECTION_INDEXES = {
+    'idx_detections_video_frame_box': ('video_hash', 'frame_number', 'box_index'),
+}
+DETECTION_KEY = UNIQUE_DETECTION_INDEXES['idx_detections_video_frame_box']
+
+SQLITE_TYPES = {'text': 'TEXT', 'integer': 'INTEGER', 'real': 'REAL'}
+
+# Formato de las fechas que se guardan como texto, siempre en UTC
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def utc_now():
+    """Instante actual en UTC como texto con TIMESTAMP_FORMAT"""
+    return datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def parse_timestamp(value):
+    """
+    Fecha guardada como texto a datetime en UTC. Acepta también el formato ISO
+    de los registros anteriores a TIMESTAMP_FORMAT, que se toman como UTC.
+    """
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+def table_ddl(table, types=SQLITE_TYPES, if_not_exists=True, extra_columns=()):
+    """Sentencia CREATE TABLE de una tabla de SCHEMA o SQLITE_SCHEMA con los tipos de un backend"""
+    columns = list(extra_columns)
+    for name, logical_type, *constraints in SCHEMA[table] if table in SCHEMA else SQLITE_SCHEMA[table]:
+        definition = f"{name} {types[logical_type]}"
+        if PRIMARY_KEYS.get(table) == name:
+            definition += " PRIMARY KEY"
+        columns.append(' '.join([definition, *constraints]))
+    exists = "IF NOT EXISTS " if if_not_exists else ""
+    return f"CREATE TABLE {exists}{table} ({', '.join(columns)})"
+
+
+def missing_columns_ddl(table, existing_columns, types=SQLITE_TYPES):
+    """Sentencias ALTER TABLE que añaden a una tabla las columnas de SCHEMA que le faltan"""
+    return [f"ALTER TABLE {table} ADD COLUMN {name} {types[logical_type]}"
+            for name, logical_type in SCHEMA[table] if name not in existing_columns]
+
+
+def index_ddl():
+    """Sentencias CREATE INDEX de los índices de detections, iguales en todos los backends"""
+    statements = [f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON detections ({', '.join(columns)})"
+                  for index, columns in UNIQUE_DETECTION_INDEXES.items()]
+    statements += [f"CREATE INDEX IF NOT EXISTS {index} ON detections ({', '.join(columns)})"
+                   for index, columns in DETECTION_INDEXES.items()]
+    return statements
+
+
+class DetectionStore:
+    """
+    Repositorio de detecciones independiente del motor de base de datos. Las
+    subclases solo definen cómo conectarse y las pocas diferencias de dialecto
+    (marcador de parámetros, listas de valores, tipos e identificador de fila).
+    Todos los métodos aceptan una conexión abierta para componer varias
+    operaciones en una transacción; si no se pasa se usa una propia.
+    """
+
+    types = SQLITE_TYPES
+    extra_detection_columns = ()
+
+    def connect(self):
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """Abre una conexión y confirma (o deshace) todo lo hecho dentro del bloque"""
+        conn = self.connect()
+        try:
+            self._begin(conn)
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connection(self, conn):
+        if conn is not None:
+            yield conn
+        else:
+            with self.transaction() as own_conn:
+                yield own_conn
+
+    def _begin(self, conn):
+        """Inicia la transacción explícitamente si el driver no lo hace solo"""
+
+    def _sql(self, query):
+        """Adapta los marcadores '?' al estilo de parámetros del driver"""
+        return query
+
+    def _execute(self, conn, query, params=()):
+        return conn.execute(self._sql(query), params)
+
+    def _rowcount(self, cursor):
+        return cursor.rowcount
+
+    def _in_list(self, column, values):
+        """Condición 'column IN (valores)' con un único parámetro"""
+        raise NotImplementedError
+
+    def _floor(self, expression):
+        """Parte entera (hacia abajo) de una expresión numérica"""
+        return f"CAST(FLOOR({expression}) AS INTEGER)"
+
+    def bbox_coordinate(self, index):
+        """Expresión SQL con la coordenada index de la caja guardada como texto JSON"""
+        return f"json_extract(bbox, '$[{index}]')"
+
+    def create_schema(self):
+        """Crea las tablas de SCHEMA y los índices de detections si no existen"""
+        with self.transaction() as conn:
+            for table in SCHEMA:
+                extra = self.extra_detection_columns if table == 'detections' else ()
+                self._execute(conn, table_ddl(table, self.types, extra_columns=extra))
+                self._add_missing_columns(conn, table)
+            for statement in index_ddl():
+                self._execute(conn, statement)
+
+    def _add_missing_columns(self, conn, table):
+        """Añade a una tabla ya existente las columnas de SCHEMA que todavía no tiene"""
+        cursor = self._execute(conn, f"SELECT * FROM {table} LIMIT 0")
+        existing = {column[0] for column in cursor.description}
+        for statement in missing_columns_ddl(table, existing, self.types):
+            self._execute(conn, statement)
+
+    def clear(self, conn=None):
+        """Vacía todas las tablas de SCHEMA (detecciones, checkpoints, caché...)"""
+        with self._connection(conn) as conn:
+            for table in SCHEMA:
+                self._execute(conn, f"DELETE FROM {table}")
+
+    def filter_condition(self, rowids=None, video_hash=None, video_hashes=None, video_names=None,
+                         brand=None, min_confidence=None, max_confidence=None, frame_start=None,
+                         frame_end=None, image_paths=None, conf_thresholds=None):
+        """
+        Traduce los filtros de detecciones a una condición WHERE y sus parámetros.
+        conf_thresholds: solo las detecciones que superan el umbral de su marca
+        """
+        conditions, params = [], []
+        if conf_thresholds is not None:
+            # Sin marcas ninguna detección supera un umbral
+            conditions.append('(' + (' OR '.join('(brand = ? AND confidence >= ?)' for _ in conf_thresholds)
+                                     or '1=0') + ')')
+            for threshold_brand, conf in conf_thresholds.items():
+                params.extend([threshold_brand, float(conf)])
+        for column, values in (('rowid', rowids), ('video_hash', video_hashes),
+                               ('video_name', video_names), ('image_path', image_paths)):
+            if values is not None:
+                condition, param = self._in_list(column, list(values))
+                conditions.append(condition)
+                params.append(param)
+        for condition, value in (("video_hash = ?", video_hash),
+                                 ("brand = ?", brand),
+                                 ("confidence >= ?", min_confidence),
+                                 ("confidence < ?", max_confidence),
+                                 ("frame_number >= ?", frame_start),
+                                 ("frame_number <= ?", frame_end)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return " AND ".join(conditions) or "1=1", params
+
+    @staticmethod
+    def _on_conflict():
+        """
+        Cláusula que actualiza la detección existente con la misma clave. No se
+        usa INSERT OR REPLACE porque su borrado implícito no dispara los
+        triggers de borrado (el catálogo de videos de SQLite)
+        """
+        updates = ', '.join(f"{column} = excluded.{column}" for column in DETECTION_COLUMNS
+                            if column not in DETECTION_KEY)
+        return f"ON CONFLICT ({', '.join(DETECTION_KEY)}) DO UPDATE SET {updates}"
+
+    def insert_batch(self, rows, conn=None):
+        """
+        Inserta filas con las columnas de DETECTION_COLUMNS en ese orden. Una
+        fila con la misma (video_hash, frame, caja) que otra ya guardada la
+        sustituye en lugar de duplicarla.
+        """
+        if not rows:
+            return 0
+        placeholders = ', '.join('?' for _ in DETECTION_COLUMNS)
+        with self._connection(conn) as conn:
+            conn.cursor().executemany(
+                self._sql(f"INSERT INTO detections ({', '.join(DETECTION_COLUMNS)}) VALUES ({placeholders}) "
+                          f"{self._on_conflict()}"),
+                rows)
+        return len(rows)
+
+    def query(self, columns=None, order_by=('timestamp', 'rowid'), limit=None, after=None,
+              distinct=False, conn=None, **filters):
+        """
+        Devuelve como diccionarios las detecciones que cumplen los filtros.
+        after: valores de order_by de la última fila de la página anterior
+        (paginación por clave, sin OFFSET).
+        distinct: devuelve solo las combinaciones distintas de columns
+        """
+        columns = columns or ['rowid'] + DETECTION_COLUMNS
+        condition, params = self.filter_condition(**filters)
+        select = "SELECT DISTINCT" if distinct else "SELECT"
+        query = f"{select} {', '.join(columns)} FROM detections WHERE {condition}"
+        if after is not None:
+            query += f" AND ({', '.join(order_by)}) > ({', '.join('?' for _ in order_by)})"
+            params.extend(after)
+        if order_by:
+            query += f" ORDER BY {', '.join(order_by)}"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connection(conn) as conn:
+            rows = self._execute(conn, query, params).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def aggregate(self, conf_thresholds, video_hash=None, last_frame=None, conn=None):
+        """
+        Cuenta por marca las detecciones y los frames con detecciones que superan
+        el umbral de su marca. Devuelve dos diccionarios: detections_count y
+        frames_with_detections.
+        """
+        detections_count = {brand: 0 for brand in conf_thresholds}
+        frames_with_detections = {brand: 0 for brand in conf_thresholds}
+        if not conf_thresholds:
+            return detections_count, frames_with_detections
+
+        condition, params = self.filter_condition(conf_thresholds=conf_thresholds, video_hash=video_hash,
+                                                  frame_end=last_frame)
+        query = (f"SELECT brand, COUNT(*), COUNT(DISTINCT frame_number) FROM detections "
+                 f"WHERE {condition} GROUP BY brand")
+
+        with self._connection(conn) as conn:
+            for brand, count, frames in self._execute(conn, query, params).fetchall():
+                detections_count[brand] = count
+                frames_with_detections[brand] = frames
+        return detections_count, frames_with_detections
+
+    def max_timestamp(self, conn=None, **filters):
+        """Instante de la última detección que cumple los filtros (None si no hay)"""
+        condition, params = self.filter_condition(**filters)
+        with self._connection(conn) as conn:
+            return self._execute(conn, f"SELECT MAX(timestamp) FROM detections WHERE {condition}",
+                                 params).fetchone()[0]
+
+    def timeline(self, bucket_seconds, conn=None, **filters):
+        """
+        Agrupa las detecciones filtradas por intervalo de bucket_seconds segundos
+        y marca. Devuelve por intervalo y marca el instante de inicio, el número
+        de detecciones y la confianza máxima y media.
+        """
+        condition, params = self.filter_condition(**filters)
+        query = f"""
+            SELECT brand,
+                   {self._floor('timestamp / ?')} AS bucket,
+                   COUNT(*),
+                   MAX(confidence),
+                   AVG(confidence)
+            FROM detections
+            WHERE {condition}
+            GROUP BY bucket, brand
+            ORDER BY bucket, brand
+        """
+        with self._connection(conn) as conn:
+            rows = self._execute(conn, query, [bucket_seconds] + params).fetchall()
+        return [{
+            'brand': brand,
+            'time': bucket * bucket_seconds,
+            'count': count,
+            'max_confidence': max_conf,
+            'mean_confidence': mean_conf
+        } for brand, bucket, count, max_conf, mean_conf in rows]
+
+    def iter_batches(self, columns, batch_size, order_by=('rowid',), conn=None, **filters):
+        """
+        Recorre las detecciones filtradas en lotes de hasta batch_size filas
+        (listas de tuplas con columns), sin cargarlas todas en memoria. Sin
+        conexión se abre una propia fuera de transacción, de modo que una
+        lectura larga no reserva la escritura en la base de datos.
+        """
+        condition, params = self.filter_condition(**filters)
+        query = f"SELECT {', '.join(columns)} FROM detections WHERE {condition}"
+        if order_by:
+            query += f" ORDER BY {', '.join(order_by)}"
+        own_conn = conn is None
+        conn = self.connect() if own_conn else conn
+        try:
+            cursor = self._execute(conn, query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            if own_conn:
+                conn.close()
+
+    def delete(self, conn=None, **filters):
+        """Borra las detecciones que cumplen los filtros y devuelve cuántas eran"""
+        condition, params = self.filter_condition(**filters)
+        with self._connection(conn) as conn:
+            return self._rowcount(self._execute(conn, f"DELETE FROM detections WHERE {condition}", params))
+
+    def tombstone(self, conn=None, **filters):
+        """
+        Guarda en detection_tombstones una copia de las detecciones que cumplen
+        los filtros antes de borrarlas. Devuelve cuántas se han registrado.
+        """
+        condition, params = self.filter_condition(**filters)
+        columns = ', '.join(TOMBSTONE_COLUMNS)
+        deleted_at = utc_now()
+        with self._connection(conn) as conn:
+            return self._rowcount(self._execute(
+                conn, f"INSERT INTO detection_tombstones ({columns}, deleted_at) "
+                      f"SELECT {columns}, ? FROM detections WHERE {condition}",
+                [deleted_at] + params))
+
+    def update(self, values, conn=None, **filters):
+        """Actualiza columnas (p. ej. la marca) de las detecciones filtradas"""
+        condition, params = self.filter_condition(**filters)
+        assignments = ', '.join(f"{column} = ?" for column in values)
+        with self._connection(conn) as conn:
+            return self._rowcount(self._execute(
+                conn, f"UPDATE detections SET {assignments} WHERE {condition}",
+                list(values.values()) + params))
+
+    def upsert(self, table, values, conn=None):
+        """Inserta o reemplaza una fila de una tabla con clave primaria"""
+        key = PRIMARY_KEYS[table]
+        columns = list(values)
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column != key)
+        with self._connection(conn) as conn:
+            self._execute(conn, f"""
+                INSERT INTO {table} ({', '.join(columns)})
+                VALUES ({', '.join('?' for _ in columns)})
+                ON CONFLICT ({key}) DO UPDATE SET {updates}
+            """, [values[column] for column in columns])
+
+    def get(self, table, key_value, conn=None):
+        """Devuelve como diccionario la fila con esa clave primaria (o None)"""
+        columns = [name for name, _ in SCHEMA[table]]
+        with self._connection(conn) as conn:
+            row = self._execute(conn, f"SELECT {', '.join(columns)} FROM {table} WHERE {PRIMARY_KEYS[table]} = ?",
+                                [key_value]).fetchone()
+        return dict(zip(columns, row)) if row else None
+
+    def rows(self, table, conn=None):
+        """Todas las filas de una tabla auxiliar (checkpoints, caché...) como diccionarios"""
+        columns = [name for name, _ in SCHEMA[table]]
+        with self._connection(conn) as conn:
+            rows = self._execute(conn, f"SELECT {', '.join(columns)} FROM {table}").fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def delete_key(self, table, column, value, conn=None):
+        """Borra las filas de una tabla auxiliar con column = value"""
+        with self._connection(conn) as conn:
+            return self._rowcount(self._execute(conn, f"DELETE FROM {table} WHERE {column} = ?", [value]))
+
+    def search_videos(self, search=None, limit=None, conn=None):
+        """
+        Videos (uno por video_hash) cuyo nombre contiene search, con su nombre y
+        número de detecciones, ordenados por nombre. Sin catálogo se agrupa la
+        tabla detections.
+        """
+        from utils.video_catalog import like_pattern
+        query = ("SELECT video_hash, MAX(video_name), COUNT(*) FROM detections "
+                 "WHERE video_hash IS NOT NULL")
+        params = []
+        if search:
+            query += " AND LOWER(video_name) LIKE LOWER(?) ESCAPE '\\'"
+            params.append(like_pattern(search))
+        query += " GROUP BY video_hash ORDER BY MAX(video_name), video_hash"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connection(conn) as conn:
+            rows = self._execute(conn, query, params).fetchall()
+        return [{'video_hash': video_hash, 'video_name': video_name, 'detection_count': count}
+                for video_hash, video_name, count in rows]
+
+    def video_names(self, search=None, conn=None):
+        """Nombres de video distintos que contienen search"""
+        return list(dict.fromkeys(video['video_name'] for video in self.search_videos(search, conn=conn)))
+
+    def video_hashes(self, search=None, conn=None):
+        """Hashes de los videos cuyo nombre contiene search"""
+        return [video['video_hash'] for video in self.search_videos(search, conn=conn)]
+
+
+class SQLiteStore(DetectionStore):
+    """Backend por defecto: un fichero SQLite con las tablas auxiliares de la app"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _begin(self, conn):
+        # Reservar la escritura desde el principio evita lecturas desfasadas
+        # entre el SELECT y el DELETE de una misma operación
+        conn.execute("BEGIN IMMEDIATE")
+
+    def _in_list(self, column, values):
+        # json_each evita el límite de parámetros de SQLite con listas largas
+        return f"{column} IN (SELECT value FROM json_each(?))", json.dumps(values)
+
+    def _floor(self, expression):
+        # FLOOR no siempre está compilado en SQLite; los instantes nunca son negativos
+        return f"CAST({expression} AS INTEGER)"
+
+    def create_schema(self):
+        # Con WAL los lectores no bloquean al escritor ni al revés (es
+        # persistente y no puede activarse dentro de una transacción)
+        conn = self.connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        super().create_schema()
+        # Tablas propias de la versión SQLite: cola de trabajos y catálogo de videos
+        with self.transaction() as conn:
+            db_migration.create_auxiliary_schema(conn.cursor())
+
+    def search_videos(self, search=None, limit=None, conn=None):
+        # El catálogo (con índice trigram) evita agrupar toda la tabla detections
+        from utils.video_catalog import search_videos
+        with self._connection(conn) as conn:
+            return search_videos(conn, search, limit)
+
+
+class DuckDBStore(DetectionStore):
+    """
+    Backend columnar embebido para agregaciones analíticas sobre decenas de
+    millones de detecciones. Los lotes se insertan como tablas de Arrow.
+    """
+
+    types = {'text': 'VARCHAR', 'integer': 'INTEGER', 'real': 'DOUBLE'}
+
+    def __init__(self, db_path):
+        import duckdb
+        self._duckdb = duckdb
+        self.db_path = db_path
+
+    def connect(self):
+        return self._duckdb.connect(self.db_path)
+
+    def _begin(self, conn):
+        conn.begin()
+
+    def _in_list(self, column, values):
+        return f"{column} IN (SELECT UNNEST(?))", values
+
+    def _rowcount(self, cursor):
+        # DuckDB devuelve el número de filas afectadas como resultado
+        return cursor.fetchone()[0]
+
+    def bbox_coordinate(self, index):
+        return f"CAST(json_extract_string(bbox, '$[{index}]') AS DOUBLE)"
+
+    def insert_batch(self, rows, conn=None):
+        if not rows:
+            return 0
+        import pyarrow as pa
+        # Tipos explícitos: una columna toda a NULL (video_hash de detecciones
+        # antiguas) se inferiría como tipo nulo y fallaría al comparar la clave
+        arrow_types = {'text': pa.string(), 'integer': pa.int64(), 'real': pa.float64()}
+        schema = pa.schema([(name, arrow_types[logical_type]) for name, logical_type in SCHEMA['detections']])
+        batch = pa.Table.from_pylist([dict(zip(DETECTION_COLUMNS, row)) for row in rows], schema=schema)
+        with self._connection(conn) as conn:
+            conn.register('detections_batch', batch)
+            try:
+                conn.execute(f"INSERT INTO detections ({', '.join(DETECTION_COLUMNS)}) "
+                             f"SELECT {', '.join(DETECTION_COLUMNS)} FROM detections_batch "
+                             f"{self._on_conflict()}")
+            finally:
+                conn.unregister('detections_batch')
+        return len(rows)
+
+
+class PostgresStore(DetectionStore):
+    """
+    Backend para un servidor compatible con PostgreSQL (psycopg 3). Las filas
+    tienen un identificador explícito 'rowid' para que la API funcione igual.
+    """
+
+    types = {'text': 'TEXT', 'integer': 'INTEGER', 'real': 'DOUBLE PRECISION'}
+    extra_detection_columns = ('rowid BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY',)
+
+    def __init__(self, dsn):
+        try:
+            import psycopg
+        except ImportError as e:
+            raise ImportError("El backend PostgreSQL necesita psycopg: pip install psycopg") from e
+        self._psycopg = psycopg
+        self.dsn = dsn
+
+    def connect(self):
+        return self._psycopg.connect(self.dsn)
+
+    def _sql(self, query):
+        return query.replace('%', '%%').replace('?', '%s')
+
+    def _in_list(self, column, values):
+        return f"{column} = ANY(?)", values
+
+    def bbox_coordinate(self, index):
+        return f"CAST(bbox::json ->> {index} AS DOUBLE PRECISION)"
+
+
+def open_store(url=None, default_path=None):
+    """
+    Crea el backend indicado por url (o por la variable STORAGE_URL):
+    sqlite:///ruta.db, duckdb:///ruta.duckdb o postgresql://usuario@host/base.
+    Sin url se usa SQLite en default_path.
+    """
+    url = url or os.getenv('STORAGE_URL')
+    if not url:
+        return SQLiteStore(default_path)
+    scheme, _, rest = url.partition('://')
+    if scheme == 'sqlite':
+        return SQLiteStore(rest[1:] if rest.startswith('/') else rest)
+    if scheme == 'duckdb':
+        return DuckDBStore(rest[1:] if rest.startswith('/') else rest)
+    if scheme in ('postgres', 'postgresql'):
+        return PostgresStore(url)
+    raise ValueError(f"Backend de almacenamiento no soportado: {scheme}")
@@ -0,0 +1,49 @@
+import pandas as pd
+
+
+# Columnas necesarias para recalcular las estadísticas de un video
+STATS_COLUMNS = ['frame_number', 'brand', 'confidence', 'timestamp']
+
+
+def load_detections(store, video_hash, min_confidence=None):
+    """
+    Carga en un DataFrame las columnas necesarias para recalcular estadísticas
+    de un video. Se hace una sola vez y después se filtra en memoria.
+    """
+    rows = store.query(STATS_COLUMNS, order_by=('timestamp',), video_hash=video_hash,
+                       min_confidence=min_confidence)
+    return pd.DataFrame(rows, columns=STATS_COLUMNS)
+
+
+def filter_by_thresholds(df, conf_thresholds):
+    """Devuelve solo las filas cuya confianza supera el umbral de su marca"""
+    if df.empty:
+        return df
+    thresholds = df['brand'].map(conf_thresholds)
+    return df[thresholds.notna() & (df['confidence'] >= thresholds)]
+
+
+def compute_stats(df, conf_thresholds, total_frames, duration):
+    """
+    Recalcula las estadísticas de process_video para un conjunto de umbrales
+    a partir de las detecciones en memoria, sin volver a ejecutar el modelo.
+    """
+    filtered = filter_by_thresholds(df, conf_thresholds)
+    grouped = filtered.groupby('brand')['frame_number'].agg(['count', 'nunique'])
+
+    detections = {}
+    for brand in conf_thresholds:
+        count = int(grouped.at[brand, 'count']) if brand in grouped.index else 0
+        frames = int(grouped.at[brand, 'nunique']) if brand in grouped.index else 0
+        detections[brand] = {
+            'total_detections': count,
+            'frames_with_detections': frames,
+            'percentage_time': (frames / total_frames) * 100 if total_frames else 0.0
+        }
+
+    return {
+        'total_frames': total_frames,
+        'duration': duration,
+        'thresholds_used': conf_thresholds,
+        'detections': detections
+    }
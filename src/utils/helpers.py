@@ -0,0 +1,38 @@
+import hashlib
+
+# Tamaño de bloque para leer ficheros grandes sin cargarlos enteros en memoria
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def compute_file_hash(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Calcula el hash SHA-256 del contenido de un fichero leyendo por bloques.
+    Se usa como identificador estable de un video independientemente de su nombre.
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def build_cache_key(video_hash, model_hash, conf_thresholds):
+    """
+    Construye la clave de caché de un análisis a partir del contenido del video,
+    de los pesos del modelo y de los umbrales por marca.
+    """
+    thresholds = ','.join(f"{brand}={float(conf):.4f}" for brand, conf in sorted(conf_thresholds.items()))
+    return hashlib.sha256(f"{video_hash}|{model_hash}|{thresholds}".encode('utf-8')).hexdigest()
+
+
+def copy_stream_with_hash(src, dest_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Copia un objeto tipo fichero a disco por bloques de tamaño fijo y calcula
+    a la vez su hash SHA-256, sin cargar nunca el contenido completo en memoria.
+    """
+    hasher = hashlib.sha256()
+    with open(dest_path, 'wb') as out:
+        for chunk in iter(lambda: src.read(chunk_size), b''):
+            hasher.update(chunk)
+            out.write(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils.training import IMAGE_EXTENSIONS
+
+CACHE_VERSION = 1
+# Color del relleno del letterbox (el mismo que usa ultralytics)
+PAD_VALUE = 114
+
+
+def cache_paths(split_dir, imgsz=640):
+    """Rutas del array empaquetado y de su índice dentro del directorio de un split"""
+    prefix = os.path.join(split_dir, f"packed_{imgsz}")
+    return f"{prefix}.npy", f"{prefix}.json"
+
+
+def split_dir_of(img_path):
+    """Directorio del split a partir de la ruta que ultralytics recibe en data.yaml"""
+    img_path = os.path.normpath(str(img_path))
+    return os.path.dirname(img_path) if os.path.basename(img_path) == 'images' else img_path
+
+
+def resized_shape(height, width, imgsz):
+    """
+    Tamaño de la imagen con el lado largo a imgsz manteniendo la proporción,
+    calculado igual que YOLODataset.load_image de ultralytics
+    """
+    ratio = imgsz / max(height, width)
+    if ratio == 1:
+        return height, width
+    return min(int(np.ceil(height * ratio)), imgsz), min(int(np.ceil(width * ratio)), imgsz)
+
+
+def letterbox_into(slot, image):
+    """
+    Redimensiona la imagen (BGR) al lado largo del hueco y la coloca en su
+    esquina superior izquierda; el resto queda relleno con PAD_VALUE.
+    Devuelve el tamaño redimensionado (h, w).
+    """
+    height, width = resized_shape(image.shape[0], image.shape[1], slot.shape[0])
+    if (height, width) != image.shape[:2]:
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+    slot[...] = PAD_VALUE
+    slot[:height, :width] = image
+    return height, width
+
+
+def list_images(images_dir):
+    """Imágenes de un directorio ordenadas por nombre, con su tamaño y mtime"""
+    with os.scandir(images_dir) as entries:
+        files = sorted((entry.name, entry.stat()) for entry in entries
+                       if entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    return [{'name': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns} for name, stat in files]
+
+
+def build_packed_cache(split_dir, imgsz=640, workers=None, force=False):
+    """
+    Decodifica una vez todas las imágenes de split_dir/images, las redimensiona
+    a imgsz y las guarda en un único array uint8 (n, imgsz, imgsz, 3) en
+    formato .npy, junto a un índice JSON con el nombre, tamaño, mtime y
+    dimensiones de cada imagen. Si el índice ya corresponde a las imágenes
+    actuales no se rehace (salvo con force). Devuelve la ruta del índice.
+    """
+    images_dir = os.path.join(split_dir, 'images')
+    array_path, index_path = cache_paths(split_dir, imgsz)
+    images = list_images(images_dir)
+    if not force and os.path.exists(array_path) and os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        current = [{key: entry[key] for key in ('name', 'size', 'mtime_ns')} for entry in index['images']]
+        if index.get('version') == CACHE_VERSION and current == images:
+            print(f"Caché de {split_dir} al día ({len(images)} imágenes)")
+            return index_path
+
+    temp_path = f"{array_path}.tmp.npy"
+    packed = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8,
+                                       shape=(len(images), imgsz, imgsz, 3))
+
+    def pack(position):
+        image = cv2.imread(os.path.join(images_dir, images[position]['name']))
+        if image is None:
+            print(f"No se pudo leer {images[position]['name']}, se omite de la caché")
+            return None
+        return image.shape[:2], letterbox_into(packed[position], image)
+
+    # Cada hilo escribe su propio hueco del array; cv2 libera el GIL al decodificar
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for position, result in enumerate(executor.map(pack, range(len(images)))):
+            images[position]['shape'] = list(result[0]) if result else None
+            images[position]['resized'] = list(result[1]) if result else None
+            if (position + 1) % 500 == 0:
+                print(f"Empaquetadas {position + 1}/{len(images)} imágenes")
+    packed.flush()
+    del packed
+
+    os.replace(temp_path, array_path)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': CACHE_VERSION, 'imgsz': imgsz, 'images': images}, f)
+    size_gb = os.path.getsize(array_path) / 1024 ** 3
+    print(f"Caché de {len(images)} imágenes guardada en {array_path} ({size_gb:.2f} GB)")
+    return index_path
+
+
+class PackedImageCache:
+    """
+    Lectura de la caché empaquetada de un split. El array se abre con mmap en
+    modo copy-on-write: las imágenes son vistas sin copia que los procesos del
+    DataLoader comparten a través de la caché de páginas del sistema, y si una
+    transformación escribe en ellas solo se copia esa página en ese proceso.
+    Solo se sirven las imágenes cuyo tamaño y mtime no han cambiado desde que
+    se construyó la caché.
+    """
+
+    def __init__(self, split_dir, imgsz=640):
+        self.array_path, self.index_path = cache_paths(split_dir, imgsz)
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.imgsz = index['imgsz']
+        self.entries = index['images']
+
+        current = {entry['name']: (entry['size'], entry['mtime_ns'])
+                   for entry in list_images(os.path.join(split_dir, 'images'))}
+        self._positions = {
+            entry['name']: position for position, entry in enumerate(self.entries)
+            if entry['shape'] and current.get(entry['name']) == (entry['size'], entry['mtime_ns'])
+        }
+        self._array = None
+
+    @classmethod
+    def open(cls, split_dir, imgsz=640):
+        """Caché del split o None si no se ha construido"""
+        if not all(os.path.exists(path) for path in cache_paths(split_dir, imgsz)):
+            return None
+        return cls(split_dir, imgsz)
+
+    def __getstate__(self):
+        # Al pasar a otro proceso (spawn en Windows) se reabre el mmap allí
+        state = self.__dict__.copy()
+        state['_array'] = None
+        return state
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.load(self.array_path, mmap_mode='c')
+        return self._array
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, path):
+        return os.path.basename(str(path)) in self._positions
+
+    def position(self, path):
+        """Posición de una imagen (ruta o nombre) en el array, o None si no está al día"""
+        return self._positions.get(os.path.basename(str(path)))
+
+    def image(self, position):
+        """Imagen redimensionada sin el relleno (vista sin copia)"""
+        height, width = self.entries[position]['resized']
+        return self.array[position, :height, :width]
+
+    def letterboxed(self, position):
+        """Imagen con el relleno hasta imgsz x imgsz (vista sin copia)"""
+        return self.array[position]
+
+    def original_shape(self, position):
+        return tuple(self.entries[position]['shape'])
+
+    def load(self, path):
+        """(imagen, (h0, w0), (h, w)) como YOLODataset.load_image, o None si no está"""
+        position = self.position(path)
+        if position is None:
+            return None
+        image = self.image(position)
+        return image, self.original_shape(position), image.shape[:2]
+
+
+class PackedImageLoader:
+    """
+    Sustituto de YOLODataset.load_image que sirve las imágenes desde la caché
+    empaquetada y recurre a la lectura normal para las que no están. Es una
+    clase (y no un cierre) para que el dataset se pueda enviar a los workers.
+    """
+
+    def __init__(self, dataset, cache):
+        self.dataset = dataset
+        self.cache = cache
+
+    def __call__(self, i, rect_mode=True):
+        dataset = self.dataset
+        loaded = self.cache.load(dataset.im_files[i]) if rect_mode else None
+        if loaded is None:
+            return type(dataset).load_image(dataset, i, rect_mode)
+        # Mosaic elige las imágenes del buffer, así que se mantiene como ultralytics
+        if dataset.augment:
+            dataset.buffer.append(i)
+            if 1 < len(dataset.buffer) >= dataset.max_buffer_length:
+                dataset.buffer.pop(0)
+        return loaded
+
+
+def attach_packed_cache(dataset, imgsz):
+    """Hace que un YOLODataset lea de la caché de su split si existe. Devuelve la caché"""
+    cache = PackedImageCache.open(split_dir_of(dataset.img_path), imgsz)
+    if cache is not None and len(cache):
+        dataset.load_image = PackedImageLoader(dataset, cache)
+        print(f"Usando caché empaquetada para {len(cache)} imágenes de {dataset.img_path}")
+    return cache
+
+
+def packed_cache_trainer():
+    """Clase de entrenador de ultralytics cuyos datasets leen de la caché empaquetada"""
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    class PackedCacheTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            dataset = super().build_dataset(img_path, mode, batch)
+            attach_packed_cache(dataset, self.args.imgsz)
+            return dataset
+
+    return PackedCacheTrainer
+
+
+def main(argv=None):
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description="Empaqueta las imágenes del dataset YOLO en un array con mmap")
+    parser.add_argument('--dataset', default=os.path.join(project_root, 'data', 'dataset_yolo'))
+    parser.add_argument('--splits', nargs='+', default=['train', 'val', 'test'])
+    parser.add_argument('--imgsz', type=int, default=640, help="Tamaño de entrenamiento (imgsz de args.yaml)")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--force', action='store_true', help="Reconstruye aunque la caché esté al día")
+    args = parser.parse_args(argv)
+
+    for split in args.splits:
+        split_dir = os.path.join(args.dataset, split)
+        if not os.path.isdir(os.path.join(split_dir, 'images')):
+            print(f"Se omite {split}: no existe {os.path.join(split_dir, 'images')}")
+            continue
+        build_packed_cache(split_dir, args.imgsz, args.workers, args.force)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
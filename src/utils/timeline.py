@@ -0,0 +1,78 @@
+import numpy as np
+
+# Anchos de intervalo "redondos" (en segundos) entre los que se elige según la duración
+BUCKET_WIDTHS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 15, 30, 60, 120, 300, 600]
+
+
+def choose_bucket_width(duration, max_buckets=500):
+    """Elige el menor ancho de intervalo que deja el video en max_buckets intervalos o menos"""
+    for width in BUCKET_WIDTHS:
+        if duration / width <= max_buckets:
+            return width
+    return duration / max_buckets
+
+
+def binned_timeline(store, video_hash, max_buckets=500, bucket_seconds=None, conf_thresholds=None):
+    """
+    Agrupa en la base de datos las detecciones de un video (identificado por su
+    hash, no por el nombre, que pueden compartir varios videos) por intervalo
+    de tiempo y marca, devolviendo el número de detecciones y la confianza
+    máxima y media de cada intervalo. El ancho del intervalo se adapta a la
+    duración del video.
+    """
+    filters = {'video_hash': video_hash, 'conf_thresholds': conf_thresholds or None}
+    if bucket_seconds is None:
+        duration = store.max_timestamp(**filters)
+        if duration is None:
+            return bucket_seconds, []
+        bucket_seconds = choose_bucket_width(duration, max_buckets)
+    return bucket_seconds, store.timeline(bucket_seconds, **filters)
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: elige threshold puntos de la serie (x, y) que
+    conservan su forma visual. Devuelve los índices de los puntos elegidos.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Límites de los threshold - 2 intervalos interiores (el primero y el último se conservan)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Media del intervalo siguiente como tercer vértice del triángulo
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_end = max(next_end, next_start + 1)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample_lttb(points, max_points):
+    """Aplica LTTB por marca sobre la confianza máxima de los intervalos"""
+    by_brand = {}
+    for point in points:
+        by_brand.setdefault(point['brand'], []).append(point)
+
+    per_brand = max(max_points // max(len(by_brand), 1), 3)
+    result = []
+    for brand_points in by_brand.values():
+        indices = lttb_indices([p['time'] for p in brand_points],
+                               [p['max_confidence'] for p in brand_points], per_brand)
+        result.extend(brand_points[i] for i in indices)
+    result.sort(key=lambda p: (p['time'], p['brand']))
+    return result
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import shutil
+
+import psutil
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Memoria aproximada que ocupa cada imagen de un batch al entrenar YOLOv8n en
+# CPU a 640 px (activaciones y gradientes); escala con el área de la imagen
+MEMORY_PER_IMAGE_640 = 300 * 1024 ** 2
+# Fracción de la RAM libre que se reserva para los batches
+BATCH_MEMORY_FRACTION = 0.5
+# La caché en RAM solo se usa si cabe en esta fracción de la RAM libre
+RAM_CACHE_FRACTION = 0.3
+BATCH_SIZES = (64, 32, 16, 8, 4, 2)
+
+
+def count_images(images_dir):
+    """Número de imágenes de un directorio de un split"""
+    if not os.path.isdir(images_dir):
+        return 0
+    with os.scandir(images_dir) as entries:
+        return sum(1 for entry in entries if entry.name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def estimate_cache_bytes(num_images, imgsz):
+    """Tamaño de la caché de imágenes decodificadas (uint8 RGB al tamaño de entrenamiento)"""
+    return num_images * imgsz * imgsz * 3
+
+
+def choose_batch_size(imgsz, available_memory, reserved_memory=0):
+    """
+    Mayor batch de BATCH_SIZES cuyo consumo estimado cabe en la fracción de la
+    RAM libre (descontando la caché de imágenes) reservada para entrenar.
+    """
+    per_image = MEMORY_PER_IMAGE_640 * (imgsz / 640) ** 2
+    budget = (available_memory - reserved_memory) * BATCH_MEMORY_FRACTION
+    for batch in BATCH_SIZES:
+        if batch * per_image <= budget:
+            return batch
+    return BATCH_SIZES[-1]
+
+
+def choose_cache_mode(num_images, imgsz, available_memory, free_disk):
+    """
+    Decide dónde cachear las imágenes decodificadas: en RAM si caben con
+    holgura, en disco (ficheros .npy junto a las imágenes) si hay espacio, o
+    ninguna caché si no hay sitio en ninguno de los dos.
+    """
+    cache_bytes = estimate_cache_bytes(num_images, imgsz)
+    if cache_bytes <= available_memory * RAM_CACHE_FRACTION:
+        return 'ram'
+    if cache_bytes * 2 <= free_disk:
+        return 'disk'
+    return False
+
+
+def choose_workers(physical_cores, logical_cores=None):
+    """
+    Workers del DataLoader en CPU. Los núcleos se reparten entre la carga de
+    imágenes y los hilos de torch que hacen el cálculo, así que se usa la mitad
+    de los núcleos físicos (al menos uno y como mucho ocho).
+    """
+    cores = physical_cores or logical_cores or 1
+    return max(1, min(8, cores // 2))
+
+
+def cpu_training_defaults(train_images_dir, imgsz=640, cache_dir=None):
+    """
+    Parámetros de entrenamiento según la máquina: batch por RAM disponible,
+    modo de caché por RAM y disco libres y workers por núcleos.
+    """
+    num_images = count_images(train_images_dir)
+    memory = psutil.virtual_memory().available
+    free_disk = shutil.disk_usage(cache_dir or train_images_dir).free
+    cache = choose_cache_mode(num_images, imgsz, memory, free_disk)
+    reserved = estimate_cache_bytes(num_images, imgsz) if cache == 'ram' else 0
+    return {
+        'batch': choose_batch_size(imgsz, memory, reserved),
+        'cache': cache,
+        'workers': choose_workers(psutil.cpu_count(logical=False), psutil.cpu_count()),
+        'num_images': num_images,
+    }
+
+
+class ThroughputMonitor:
+    """
+    Callbacks de ultralytics que miden la duración de cada época y las
+    imágenes por segundo, y guardan el informe en throughput.json dentro del
+    directorio del entrenamiento.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings or {}
+        self.epochs = []
+        self._epoch_start = None
+
+    def register(self, model):
+        model.add_callback('on_train_epoch_start', self.on_train_epoch_start)
+        model.add_callback('on_train_epoch_end', self.on_train_epoch_end)
+        model.add_callback('on_train_end', self.on_train_end)
+
+    def on_train_epoch_start(self, trainer):
+        self._epoch_start = time.perf_counter()
+
+    def on_train_epoch_end(self, trainer):
+        if self._epoch_start is None:
+            return
+        seconds = time.perf_counter() - self._epoch_start
+        images = len(trainer.train_loader.dataset)
+        self.epochs.append({
+            'epoch': trainer.epoch + 1,
+            'seconds': seconds,
+            'images': images,
+            'images_per_second': images / seconds if seconds > 0 else 0.0
+        })
+        print(f"Época {trainer.epoch + 1}: {seconds:.1f} s, {images / seconds:.1f} imágenes/s")
+
+    def report(self):
+        seconds = [epoch['seconds'] for epoch in self.epochs]
+        images = sum(epoch['images'] for epoch in self.epochs)
+        return {
+            'settings': self.settings,
+            'epochs': self.epochs,
+            'mean_epoch_seconds': sum(seconds) / len(seconds) if seconds else None,
+            'images_per_second': images / sum(seconds) if seconds and sum(seconds) > 0 else None
+        }
+
+    def on_train_end(self, trainer):
+        report_path = os.path.join(str(trainer.save_dir), 'throughput.json')
+        with open(report_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Informe de rendimiento guardado en: {report_path}")
@@ -0,0 +1,60 @@
+import sqlite3
+
+# El tokenizador trigram solo indexa fragmentos de 3 o más caracteres
+MIN_FTS_QUERY_LENGTH = 3
+
+
+def like_pattern(text):
+    """Patrón LIKE que busca text literalmente (escapando % y _)"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def search_videos(conn, text=None, limit=None):
+    """
+    Busca en el catálogo los videos cuyo nombre contiene text y devuelve sus
+    video_id, video_hash, video_name y detection_count ordenados por nombre
+    (un video con el mismo nombre que otro es otra fila). Usa el índice
+    FTS5 trigram cuando la búsqueda es lo bastante larga; si no (o si SQLite no
+    tiene FTS5) filtra con LIKE la tabla videos, que tiene una fila por video.
+    """
+    use_fts = bool(text) and len(text) >= MIN_FTS_QUERY_LENGTH
+    columns = ['video_id', 'video_hash', 'video_name', 'detection_count']
+    query = f"SELECT {', '.join(columns)} FROM videos"
+    params = []
+    if use_fts:
+        # Entre comillas dobles FTS5 trata el texto como una frase literal
+        query += " WHERE video_id IN (SELECT rowid FROM videos_fts WHERE videos_fts MATCH ?)"
+        params.append('"' + text.replace('"', '""') + '"')
+    elif text:
+        query += " WHERE video_name LIKE ? ESCAPE '\\'"
+        params.append(like_pattern(text))
+    query += " ORDER BY video_name, video_hash"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    try:
+        rows = conn.execute(query, params).fetchall()
+    except sqlite3.OperationalError:
+        if not use_fts:
+            raise
+        # SQLite compilado sin FTS5 (o sin el tokenizador trigram)
+        query = (f"SELECT {', '.join(columns)} FROM videos "
+                 "WHERE video_name LIKE ? ESCAPE '\\' ORDER BY video_name, video_hash")
+        params = [like_pattern(text)]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = conn.execute(query, params).fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def resolve_video_names(conn, text):
+    """Nombres distintos de los videos del catálogo cuyo nombre contiene text"""
+    return list(dict.fromkeys(video['video_name'] for video in search_videos(conn, text)))
+
+
+def resolve_video_hashes(conn, text):
+    """Hashes de los videos del catálogo cuyo nombre contiene text"""
+    return [video['video_hash'] for video in search_videos(conn, text)]
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos de src se importan como paquetes de primer nivel (igual que en la app)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_PATH = os.path.join(PROJECT_ROOT, 'src')
+if SRC_PATH not in sys.path:
+    sys.path.insert(0, SRC_PATH)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Ruta a una base de datos de detecciones vacía dentro de un directorio temporal"""
+    database_dir = tmp_path / "database"
+    database_dir.mkdir()
+    return str(database_dir / "detections.db")
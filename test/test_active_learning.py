@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("yaml")
+
+import storage
+from active_learning import export_shard, label_frame, read_frames, select_frames
+
+FPS = 10
+
+
+@pytest.fixture
+def production(db_path, tmp_path):
+    """Base de datos con detecciones de un video de 60 frames y un dataset YOLO vacío"""
+    video_path = str(tmp_path / "partido.avi")
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), FPS, (160, 120))
+    for frame in range(60):
+        image = np.full((120, 160, 3), 40, dtype=np.uint8)
+        cv2.putText(image, str(frame), (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+        writer.write(image)
+    writer.release()
+
+    store = storage.SQLiteStore(db_path)
+    store.create_schema()
+    store.upsert('video_checkpoints', {'video_hash': 'hv', 'video_name': 'partido.avi', 'video_path': video_path,
+                                       'fps': FPS, 'status': 'completed'})
+    rows = [
+        ('partido.avi', 5, 'adidas', 0.92, "[10, 10, 50, 40]", 0.5, None, 'hv', 0),   # segura, se borra
+        ('partido.avi', 20, 'puma', 0.55, "[0, 0, 80, 60]", 2.0, None, 'hv', 0),     # dudosa, confirmada
+        ('partido.avi', 21, 'puma', 0.56, "[0, 0, 80, 60]", 2.1, None, 'hv', 0),     # pegada a la anterior
+        ('partido.avi', 40, 'nike', 0.45, "[100, 60, 200, 130]", 4.0, None, 'hv', 0), # dudosa, sin confirmar
+        ('partido.avi', 50, 'adidas', 0.95, "[0, 0, 10, 10]", 5.0, None, 'hv', 0),   # segura, no se exporta
+        ('otro.avi', 3, 'puma', 0.5, "[0, 0, 10, 10]", 0.3, None, 'sin_video', 0),
+    ]
+    store.insert_batch(rows)
+    with store.transaction() as conn:
+        store.tombstone(conn, video_hash='hv', frame_start=5, frame_end=5)
+        store.delete(conn, video_hash='hv', frame_start=5, frame_end=5)
+
+    dataset = tmp_path / "dataset_yolo"
+    dataset.mkdir()
+    (dataset / "data.yaml").write_text("nc: 3\nnames: ['adidas', 'puma', 'nike']\n")
+    return db_path, dataset
+
+
+def test_read_frames_returns_the_requested_frames(production, tmp_path):
+    frames = dict(read_frames(str(tmp_path / "partido.avi"), [50, 3, 4, 30]))
+    assert sorted(frames) == [3, 4, 30, 50]
+    reference = cv2.VideoCapture(str(tmp_path / "partido.avi"))
+    for _ in range(30):
+        reference.grab()
+    assert np.array_equal(reference.read()[1], frames[30])
+
+
+def test_select_frames_prioritizes_and_spaces_frames():
+    sources = {'a': {'video_path': 'a.mp4', 'fps': 10}}
+    candidates = [{'video_hash': 'a', 'frame_number': frame, 'reason': 'uncertain', 'score': score}
+                  for frame, score in [(10, 0.5), (12, 0.9), (30, 0.2), (45, 0.1)]]
+    candidates.append({'video_hash': 'b', 'frame_number': 1, 'reason': 'deleted', 'score': 2.0})
+    chosen = select_frames(candidates, sources, exported={'a:47'}, min_gap_seconds=1.0)
+    assert [frame['frame_number'] for frame in chosen] == [12, 30]
+    assert len(select_frames(candidates, sources, max_images=1)) == 1
+
+
+def test_export_shard_writes_labels_negatives_and_review(production):
+    db_path, dataset = production
+    summary = export_shard(db_path, str(dataset), conf_thresholds={'adidas': 0.5, 'puma': 0.5, 'nike': 0.5})
+    assert (summary['selected'], summary['exported'], summary['review'], summary['hard_negatives']) == (3, 3, 1, 1)
+
+    shard = dataset / "active_learning" / summary['shard'].split('/')[-1]
+    frames = {record['key']: record for record in json.loads((shard / "shard.json").read_text())['frames']}
+    assert set(frames) == {'hv:5', 'hv:20', 'hv:40'}
+    assert frames['hv:5']['reason'] == 'deleted' and frames['hv:5']['hard_negative']
+    assert (shard / "labels" / f"{frames['hv:5']['name']}.txt").read_text() == ""
+    assert (shard / "labels" / f"{frames['hv:20']['name']}.txt").read_text() == \
+        "1 0.250000 0.250000 0.500000 0.500000\n"
+    # La dudosa por debajo del umbral va a revisión con la caja como preanotación
+    review_label = (shard / "review" / "labels" / f"{frames['hv:40']['name']}.txt").read_text()
+    assert review_label == "2 0.812500 0.750000 0.375000 0.500000\n"
+    assert len(list((shard / "images").iterdir())) == 2
+
+    # Lo ya exportado (y lo pegado a ello, como el frame 21) no se repite en el siguiente shard
+    again = export_shard(db_path, str(dataset), conf_thresholds={'adidas': 0.5, 'puma': 0.5, 'nike': 0.5})
+    assert again['selected'] == 0 and again['shard'] is None
+
+
+def test_label_frame_sends_low_confidence_boxes_to_review():
+    class_ids = {'adidas': 0, 'puma': 1}
+    detections = [('adidas', 0.9, [0, 0, 1, 1]), ('puma', 0.45, [1, 1, 2, 2]), ('puma', 0.1, [2, 2, 3, 3]),
+                  ('otra', 0.9, [3, 3, 4, 4])]
+    labels, review = label_frame(detections, {'adidas': 0.5, 'puma': 0.5}, class_ids)
+    assert labels == [(0, [0, 0, 1, 1])]
+    # La caja muy por debajo del umbral sigue guardada: no puede quedar como fondo
+    assert review == [(1, [1, 1, 2, 2]), (1, [2, 2, 3, 3])]
+
+
+def test_export_shard_respects_size_budget(production):
+    db_path, dataset = production
+    summary = export_shard(db_path, str(dataset), conf_thresholds={'adidas': 0.5, 'puma': 0.5, 'nike': 0.5},
+                           max_bytes=1)
+    assert summary['exported'] == 0 and summary['over_budget'] == 3
+    shard = dataset / "active_learning" / summary['shard'].split('/')[-1]
+    assert not any((shard / "images").iterdir())
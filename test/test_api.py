@@ -0,0 +1,297 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+import db_migration
+import storage
+from utils.video_catalog import search_videos, resolve_video_hashes, resolve_video_names
+
+# api.py vive en app/ y se importa como módulo de primer nivel (igual que con uvicorn)
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+if APP_PATH not in sys.path:
+    sys.path.insert(0, APP_PATH)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''CREATE TABLE detections
+                    (video_name TEXT, frame_number INTEGER, brand TEXT, confidence REAL,
+                    bbox TEXT, timestamp REAL, image_path TEXT, video_hash TEXT, box_index INTEGER)''')
+    yield conn
+    conn.close()
+
+
+def insert_detections(conn, video_name, count, video_hash=None):
+    conn.executemany("INSERT INTO detections (video_name, frame_number, video_hash) VALUES (?, ?, ?)",
+                     [(video_name, i, video_hash or f"hash-{video_name}") for i in range(count)])
+
+
+def test_catalog_backfills_and_tracks_detection_counts(conn):
+    insert_detections(conn, 'real_madrid.mp4', 3)
+    db_migration.create_video_catalog_schema(conn.cursor())
+    insert_detections(conn, 'real_madrid.mp4', 2)
+    insert_detections(conn, 'barca.mp4', 1)
+
+    counts = {video['video_name']: video['detection_count'] for video in search_videos(conn)}
+    assert counts == {'barca.mp4': 1, 'real_madrid.mp4': 5}
+
+    conn.execute("DELETE FROM detections WHERE video_name = 'barca.mp4'")
+    assert resolve_video_names(conn, 'barca') == []
+
+
+def test_catalog_is_keyed_by_video_hash(conn):
+    db_migration.create_video_catalog_schema(conn.cursor())
+    insert_detections(conn, 'partido.mp4', 2, video_hash='a')
+    insert_detections(conn, 'partido.mp4', 3, video_hash='b')
+    # El mismo contenido subido con otro nombre: se busca por el nombre nuevo
+    insert_detections(conn, 'final.mp4', 1, video_hash='a')
+
+    assert {video['video_hash']: (video['video_name'], video['detection_count'])
+            for video in search_videos(conn)} == {'a': ('final.mp4', 3), 'b': ('partido.mp4', 3)}
+    assert resolve_video_hashes(conn, 'partido') == ['b']
+    assert resolve_video_hashes(conn, 'final') == ['a']
+
+
+def test_reinserting_detections_keeps_catalog_counts(db_path):
+    store = storage.SQLiteStore(db_path)
+    store.create_schema()
+    rows = [('partido.mp4', frame, 'nike', 0.9, "[0, 0, 1, 1]", frame / 30, None, 'a', 0)
+            for frame in range(4)]
+    store.insert_batch(rows)
+    store.insert_batch(rows[:2])
+    store.delete(video_hash='a', frame_start=0, frame_end=0)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert search_videos(conn)[0]['detection_count'] == 3
+        assert conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == 3
+    finally:
+        conn.close()
+
+
+def test_name_keyed_catalog_is_rebuilt(conn):
+    conn.execute("CREATE TABLE videos (video_id INTEGER PRIMARY KEY, video_name TEXT UNIQUE, "
+                 "detection_count INTEGER DEFAULT 0, first_seen TEXT)")
+    conn.execute("INSERT INTO videos (video_name, detection_count) VALUES ('partido.mp4', 7)")
+    insert_detections(conn, 'partido.mp4', 2)
+    db_migration.create_video_catalog_schema(conn.cursor())
+
+    assert [(video['video_hash'], video['detection_count']) for video in search_videos(conn)] == \
+        [('hash-partido.mp4', 2)]
+
+
+def test_search_matches_any_fragment_of_the_name(conn):
+    db_migration.create_video_catalog_schema(conn.cursor())
+    for name in ['Real_Madrid_vs_Barca.mp4', 'final_100%.mp4', 'ad.mp4']:
+        insert_detections(conn, name, 1)
+
+    assert resolve_video_names(conn, 'madrid') == ['Real_Madrid_vs_Barca.mp4']
+    assert resolve_video_names(conn, '100%') == ['final_100%.mp4']
+    # Búsquedas cortas (sin trigramas) recurren a LIKE sobre el catálogo
+    assert resolve_video_names(conn, 'ad') == ['Real_Madrid_vs_Barca.mp4', 'ad.mp4']
+    assert resolve_video_names(conn, 'x"y') == []
+
+
+def test_catalog_schema_is_idempotent(conn):
+    insert_detections(conn, 'partido.mp4', 2)
+    db_migration.create_video_catalog_schema(conn.cursor())
+    db_migration.create_video_catalog_schema(conn.cursor())
+
+    assert search_videos(conn) == [{'video_id': 1, 'video_hash': 'hash-partido.mp4', 'video_name': 'partido.mp4',
+                                    'detection_count': 2}]
+
+
+@pytest.fixture
+def api(monkeypatch, db_path, tmp_path):
+    """Módulo api con su repositorio, directorios y cola en un directorio temporal"""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    import api
+    from job_queue import JobQueue
+
+    store = storage.SQLiteStore(db_path)
+    store.create_schema()
+    monkeypatch.setattr(api, 'store', store)
+    monkeypatch.setattr(api, 'IMAGES_DIR', str(tmp_path / "images"))
+    monkeypatch.setattr(api, 'THUMBNAILS_DIR', str(tmp_path / "thumbnails"))
+    monkeypatch.setattr(api, 'VIDEOS_DIR', str(tmp_path / "videos"))
+    monkeypatch.setattr(api, 'job_queue', JobQueue(db_path, store))
+    os.makedirs(api.IMAGES_DIR)
+    os.makedirs(api.VIDEOS_DIR)
+    project = tmp_path / "proyecto"
+    (project / "data" / "dataset_yolo").mkdir(parents=True)
+    (project / "data" / "dataset_yolo" / "data.yaml").write_text("nc: 3\nnames: ['adidas', 'puma', 'nike']\n")
+    monkeypatch.setattr(api, 'PROJECT_DIRS', (str(project),))
+    return api
+
+
+@pytest.fixture
+def client(api):
+    from fastapi.testclient import TestClient
+    # Sin "with": no se lanzan los workers ni la retención del evento startup
+    return TestClient(api.app)
+
+
+def test_jobs_only_accept_videos_from_the_videos_dir(api, client, tmp_path):
+    (tmp_path / "videos" / "partido.mp4").write_bytes(b"video")
+    (tmp_path / "secreto.mp4").write_bytes(b"video")
+
+    response = client.post("/jobs", json={'video_path': "partido.mp4"})
+    assert response.status_code == 201
+    job = client.get(f"/jobs/{response.json()['job_id']}").json()
+    assert job['video_path'] == str(tmp_path / "videos" / "partido.mp4") and job['status'] == 'queued'
+    assert [job['job_id'] for job in client.get("/jobs").json()] == [response.json()['job_id']]
+
+    for path in (str(tmp_path / "secreto.mp4"), "../secreto.mp4", "/etc/passwd"):
+        assert client.post("/jobs", json={'video_path': path}).status_code == 422
+    assert client.post("/jobs", json={'video_path': "otro.mp4"}).status_code == 404
+    assert client.get("/jobs/999").status_code == 404
+
+
+def test_workers_find_the_weights_next_to_api_py(api, monkeypatch, tmp_path):
+    pytest.importorskip("ultralytics")
+    # Disposición de Docker: api.py en /app y runs montado en /app/runs
+    weights = tmp_path / "app" / "runs" / "detect" / "logo_detection2" / "weights" / "best.pt"
+    weights.parent.mkdir(parents=True)
+    weights.write_bytes(b"pesos")
+    monkeypatch.setattr(api, 'PROJECT_DIRS', (str(tmp_path / "raiz"), str(tmp_path / "app")))
+    monkeypatch.setattr(api, 'MODEL_WEIGHTS', None)
+    assert api.find_model_files()[0] == str(weights)
+
+    monkeypatch.setattr(api, 'MODEL_WEIGHTS', "/modelos/marcas.pt")
+    assert api.find_model_files()[0] == "/modelos/marcas.pt"
+
+
+def add_detections(api, video_hash, video_name, brands, frames=4):
+    """Una detección por frame y marca, con confianza 0.3, 0.5, 0.7... y caché de estadísticas"""
+    rows = [(video_name, frame, brand, round(0.3 + 0.2 * frame, 1), "[0, 0, 10, 10]", frame / 10,
+             f"{video_hash}_{frame}_{brand}.jpg", video_hash, box)
+            for frame in range(frames) for box, brand in enumerate(brands)]
+    api.store.insert_batch(rows)
+    api.store.upsert('analysis_cache', {'cache_key': f"key-{video_hash}", 'video_hash': video_hash, 'stats': '{}'})
+
+
+def remaining(api, **filters):
+    return sorted((row['video_hash'], row['frame_number'], row['brand'])
+                  for row in api.store.query(['video_hash', 'frame_number', 'brand'], order_by=None, **filters))
+
+
+def cached(api):
+    return sorted(row['video_hash'] for row in api.store.rows('analysis_cache'))
+
+
+def test_bulk_delete_by_filter_invalidates_only_affected_videos(api, client):
+    add_detections(api, 'a', 'partido.mp4', ['adidas', 'nike'])
+    add_detections(api, 'b', 'partido.mp4', ['adidas'])
+    add_detections(api, 'c', 'final.mp4', ['adidas'])
+
+    response = client.post("/detections/bulk-delete", json={'filter': {
+        'video_hash': 'a', 'brand': 'nike', 'max_confidence': 0.8, 'frame_start': 1}})
+    assert response.json() == {'rows_affected': 2, 'images_scheduled': 2}
+    assert remaining(api, video_hash='a', brand='nike') == [('a', 0, 'nike'), ('a', 3, 'nike')]
+    # Una limpieza por filtro no se guarda como falsos positivos
+    assert api.store.rows('detection_tombstones') == []
+    assert cached(api) == ['b', 'c']
+    assert sorted(os.listdir(api.IMAGES_DIR)) == []
+
+    # Por nombre se borran los videos con ese nombre exacto, con falsos positivos si se pide
+    response = client.post("/detections/bulk-delete", json={'filter': {'video_name': 'partido.mp4'},
+                                                           'false_positive': True})
+    assert response.json()['rows_affected'] == 6 + 4
+    assert remaining(api) == [('c', frame, 'adidas') for frame in range(4)]
+    assert len(api.store.rows('detection_tombstones')) == 10
+    assert cached(api) == ['c']
+
+    assert client.post("/detections/bulk-delete", json={}).status_code == 422
+
+
+def test_explicit_deletes_are_tombstoned(api, client):
+    add_detections(api, 'a', 'partido.mp4', ['adidas'])
+    rowids = [row['rowid'] for row in api.store.query(['rowid'])]
+
+    assert client.delete(f"/detections/{rowids[0]}").json()['rows_affected'] == 1
+    assert client.delete(f"/detections/{rowids[0]}").status_code == 404
+    assert client.post("/detections/bulk-delete", json={'rowids': rowids[1:3]}).json()['rows_affected'] == 2
+    assert client.post("/detections/bulk-delete",
+                       json={'rowids': rowids[3:], 'false_positive': False}).json()['rows_affected'] == 1
+
+    tombstones = api.store.rows('detection_tombstones')
+    assert sorted(row['frame_number'] for row in tombstones) == [0, 1, 2]
+    assert all(row['deleted_at'] for row in tombstones) and cached(api) == []
+
+
+def test_bulk_relabel_checks_the_brand_and_invalidates_the_cache(api, client):
+    add_detections(api, 'a', 'partido.mp4', ['adidas', 'nike'])
+    add_detections(api, 'b', 'final.mp4', ['adidas'])
+
+    response = client.post("/detections/bulk-relabel", json={'filter': {'video_hash': 'a', 'brand': 'nike'},
+                                                            'new_brand': 'puma'})
+    assert response.json() == {'rows_affected': 4, 'new_brand': 'puma'}
+    assert remaining(api, brand='puma') == [('a', frame, 'puma') for frame in range(4)]
+    assert cached(api) == ['b']
+
+    response = client.post("/detections/bulk-relabel", json={'filter': {'video_hash': 'b'}, 'new_brand': 'reebok'})
+    assert response.status_code == 422 and 'reebok' in response.json()['detail']
+    assert remaining(api, brand='reebok') == [] and cached(api) == ['b']
+
+
+def test_detections_by_name_keep_videos_apart(api, client):
+    # Filas antiguas del video 'a' guardadas con otro nombre antes de renombrarlo: siguen siendo suyas
+    api.store.insert_batch([('grabacion.mp4', 5, 'adidas', 0.9, "[0, 0, 10, 10]", 0.5, None, 'a', 0)])
+    add_detections(api, 'a', 'partido.mp4', ['adidas'], frames=2)
+    add_detections(api, 'b', 'partido.mp4', ['nike'], frames=2)
+    add_detections(api, 'c', 'final.mp4', ['adidas'], frames=2)
+
+    detections = client.get("/detections/", params={'video_name': 'PARTIDO'}).json()
+    assert sorted((row['video_name'], row['frame_number'], row['brand']) for row in detections) == [
+        ('grabacion.mp4', 5, 'adidas'), ('partido.mp4', 0, 'adidas'), ('partido.mp4', 0, 'nike'),
+        ('partido.mp4', 1, 'adidas'), ('partido.mp4', 1, 'nike')]
+    detections = client.get("/detections/", params={'video_name': 'partido', 'video_hash': 'b'}).json()
+    assert {row['brand'] for row in detections} == {'nike'}
+    assert client.get("/detections/", params={'video_name': 'copa'}).json() == []
+
+
+def test_keyset_pagination_is_stable_with_timestamp_ties(api, client):
+    # Tres detecciones por frame con el mismo timestamp: el desempate es el rowid
+    add_detections(api, 'a', 'partido.mp4', ['adidas', 'puma', 'nike'], frames=4)
+    expected = [row['rowid'] for row in client.get("/detections/").json()]
+    assert len(expected) == 12
+
+    pages, cursor = [], None
+    while True:
+        params = {'limit': 5, **({'cursor': cursor} if cursor else {})}
+        response = client.get("/detections/", params=params)
+        pages.append([row['rowid'] for row in response.json()])
+        if len(pages) == 1:
+            # Una detección nueva anterior al cursor no desplaza las páginas siguientes
+            api.store.insert_batch([('partido.mp4', 0, 'puma', 0.9, "[0, 0, 10, 10]", 0.0, None, 'a', 9)])
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [5, 5, 2]
+    assert [rowid for page in pages for rowid in page] == expected
+    assert client.get("/detections/", params={'limit': 5, 'cursor': 'x'}).status_code == 422
+
+
+def test_thumbnails_are_generated_once_and_cached(api, client):
+    from PIL import Image
+    Image.new("RGB", (400, 200), "red").save(os.path.join(api.IMAGES_DIR, "a_0_adidas.jpg"))
+    api.store.insert_batch([('partido.mp4', 0, 'adidas', 0.9, "[0, 0, 10, 10]", 0.0,
+                             "detections/a_0_adidas.jpg", 'a', 0)])
+    rowid = api.store.query(['rowid'])[0]['rowid']
+
+    response = client.get(f"/detections/{rowid}/thumbnail", params={'size': 100})
+    assert response.status_code == 200 and response.headers['content-type'] == 'image/jpeg'
+    thumbnail_path = os.path.join(api.THUMBNAILS_DIR, "100", "a_0_adidas.jpg")
+    with Image.open(thumbnail_path) as thumbnail:
+        assert thumbnail.size == (100, 50)
+
+    # Sin el recorte original la miniatura ya generada se sigue sirviendo desde disco
+    os.remove(os.path.join(api.IMAGES_DIR, "a_0_adidas.jpg"))
+    assert client.get(f"/detections/{rowid}/thumbnail", params={'size': 100}).content == response.content
+    assert client.get(f"/detections/{rowid}/thumbnail", params={'size': 200}).status_code == 404
+    assert client.get("/detections/999/thumbnail").status_code == 404
@@ -0,0 +1,279 @@
+import os
+import sys
+
+import pytest
+
+# Los scripts de preparación del dataset viven en data/
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from metodos_data.annotations import CLASS_MAP, format_yolo_lines, read_annotation, yolo_objects
+from metodos_data.dataset_manifest import assign_split, file_record, load_manifest
+
+
+def write_annotation(path, brands, width=100, height=50):
+    objects = ''.join(
+        f"<object><name>{brand}</name><bndbox><xmin>10</xmin><ymin>10</ymin>"
+        f"<xmax>30</xmax><ymax>20</ymax></bndbox></object>"
+        for brand in brands
+    )
+    path.write_text(f"<annotation><size><width>{width}</width><height>{height}</height></size>"
+                    f"{objects}</annotation>")
+
+
+@pytest.fixture
+def openlogo(tmp_path):
+    """Dataset con la estructura de QMUL-OpenLogo: 30 imágenes con logo y 10 sin marca relevante"""
+    root = tmp_path / "openlogo"
+    (root / "JPEGImages").mkdir(parents=True)
+    (root / "Annotations").mkdir()
+    for i in range(40):
+        (root / "JPEGImages" / f"img{i:03d}.jpg").write_bytes(bytes([i]) * 64)
+        write_annotation(root / "Annotations" / f"img{i:03d}.xml", [['adidas', 'puma', 'nike', 'other'][i % 4]])
+    return root
+
+
+def split_contents(output):
+    return {split: sorted(os.listdir(output / split / 'images')) for split in ('train', 'val', 'test')}
+
+
+def test_annotation_reader_normalizes_all_objects(tmp_path):
+    xml_path = tmp_path / "a.xml"
+    xml_path.write_text(
+        "<annotation><size><width>200</width><height>100</height></size>"
+        "<object><name> Nike </name><bndbox><xmin>20</xmin><ymin>10</ymin><xmax>60</xmax><ymax>50</ymax></bndbox>"
+        "<part><name>swoosh</name><bndbox><xmin>0</xmin><ymin>0</ymin><xmax>1</xmax><ymax>1</ymax></bndbox></part>"
+        "</object>"
+        "<object><name>reebok</name><bndbox><xmin>0</xmin><ymin>0</ymin><xmax>5</xmax><ymax>5</ymax></bndbox></object>"
+        "<object><name>adidas</name><bndbox><xmin>150</xmin><ymin>50</ymin><xmax>250</xmax><ymax>100</ymax></bndbox></object>"
+        "</annotation>")
+
+    annotation = read_annotation(str(xml_path))
+    assert annotation['names'] == ['nike', 'reebok', 'adidas']
+    assert annotation['boxes'].shape == (3, 4)
+
+    names, class_ids, boxes = yolo_objects(annotation)
+    assert names == ['nike', 'adidas']
+    assert class_ids.tolist() == [CLASS_MAP['nike'], CLASS_MAP['adidas']] == [2, 0]
+    assert boxes.tolist()[0] == [0.2, 0.3, 0.2, 0.4]
+    # Con clip la caja que se sale de la imagen queda dentro de [0, 1]
+    _, class_ids, clipped = yolo_objects(annotation, clip=True)
+    assert format_yolo_lines(class_ids, clipped)[1] == "0 1.000000 0.750000 0.500000 0.500000"
+
+
+def test_file_record_reuses_hash_when_unchanged(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(b"abc")
+    record = file_record(str(path))
+    assert file_record(str(path), {**record, 'hash': 'previo'})['hash'] == 'previo'
+
+    path.write_bytes(b"abcd")
+    assert file_record(str(path), record)['hash'] != record['hash']
+
+
+def test_assign_split_is_stable_and_follows_ratios():
+    keys = [f"img{i}" for i in range(3000)]
+    splits = [assign_split(key) for key in keys]
+    assert splits == [assign_split(key) for key in keys]
+    assert 0.65 < splits.count('train') / len(splits) < 0.75
+    assert assign_split("img1", (('train', 1.0), ('val', 0.0))) == 'train'
+
+
+def test_prepare_dataset_is_deterministic_across_workers(openlogo, tmp_path):
+    pytest.importorskip("sklearn")
+    from preparar_data_set import prepare_yolo_dataset
+
+    prepare_yolo_dataset(str(openlogo), str(tmp_path / "one"), workers=1)
+    prepare_yolo_dataset(str(openlogo), str(tmp_path / "four"), workers=4, link_mode='hardlink')
+
+    assert split_contents(tmp_path / "one") == split_contents(tmp_path / "four")
+    assert sum(len(images) for images in split_contents(tmp_path / "one").values()) == 30
+    label = next((tmp_path / "four" / "train" / "labels").iterdir())
+    assert label.read_text() == (tmp_path / "one" / "train" / "labels" / label.name).read_text()
+
+
+def test_prepare_dataset_rebuilds_incrementally(openlogo, tmp_path):
+    pytest.importorskip("sklearn")
+    from preparar_data_set import prepare_yolo_dataset
+
+    output = tmp_path / "dataset"
+    prepare_yolo_dataset(str(openlogo), str(output), workers=2)
+    before = load_manifest(str(output))
+
+    # Nuevas anotaciones, una borrada y otra que deja de tener logos
+    for i in range(40, 50):
+        (openlogo / "JPEGImages" / f"img{i:03d}.jpg").write_bytes(bytes([i]) * 64)
+        write_annotation(openlogo / "Annotations" / f"img{i:03d}.xml", ['nike'])
+    (openlogo / "Annotations" / "img000.xml").unlink()
+    write_annotation(openlogo / "Annotations" / "img001.xml", ['other'])
+
+    phases = []
+    prepare_yolo_dataset(str(openlogo), str(output), workers=2,
+                         progress_callback=lambda phase, done, total: phases.append((phase, total)))
+    after = load_manifest(str(output))
+
+    # Solo se han leído las 11 anotaciones nuevas o modificadas
+    assert ('anotaciones', 11) in phases
+    assert 'img000' not in after
+    assert after['img001']['split'] is None
+    assert not any(output.glob("*/images/img000.jpg")) and not any(output.glob("*/images/img001.jpg"))
+    # Las imágenes que ya estaban conservan su split
+    for key, entry in before.items():
+        if key in after and key not in ('img000', 'img001'):
+            assert after[key]['split'] == entry['split']
+    assert all(after[f"img{i:03d}"]['split'] for i in range(40, 50))
+    assert sum(len(images) for images in split_contents(output).values()) == 38
+
+
+@pytest.mark.parametrize('rebuild', [False, True])
+def test_prepare_dataset_removes_outputs_outside_the_new_split(openlogo, tmp_path, rebuild):
+    pytest.importorskip("sklearn")
+    from preparar_data_set import prepare_yolo_dataset
+
+    output = tmp_path / "dataset"
+    prepare_yolo_dataset(str(openlogo), str(output), workers=2)
+    # Dataset generado con otro reparto y sin manifiesto (o que se reconstruye)
+    for path in output.glob("train/*/*"):
+        os.replace(path, output / "val" / path.parent.name / path.name)
+    if not rebuild:
+        (output / "manifest.json").unlink()
+
+    prepare_yolo_dataset(str(openlogo), str(output), workers=2, rebuild=rebuild)
+
+    contents = split_contents(output)
+    images = [image for split in contents.values() for image in split]
+    assert len(images) == len(set(images)) == 30
+    for split in contents:
+        labels = sorted(os.listdir(output / split / 'labels'))
+        assert labels == [f"{image[:-4]}.txt" for image in contents[split]]
+
+
+def make_photo(path, seed, size=(240, 320)):
+    """Imagen sintética con formas a distintas escalas (el pHash de ruido puro no es estable)"""
+    cv2 = pytest.importorskip("cv2")
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    image = np.full((*size, 3), 255, dtype=np.uint8)
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        x, y = int(rng.integers(0, size[1])), int(rng.integers(0, size[0]))
+        cv2.circle(image, (x, y), int(rng.integers(10, 80)), color, -1)
+    cv2.imwrite(str(path), image)
+    return image
+
+
+def test_near_duplicates_are_clustered_and_kept_in_one_split(tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    from metodos_data.near_duplicates import (build_hash_index, cluster_near_duplicates, cross_split_duplicates,
+                                              split_by_cluster)
+
+    paths = []
+    for seed in range(20):
+        path = tmp_path / f"img{seed:02d}.jpg"
+        image = make_photo(path, seed)
+        paths.append(path)
+        if seed < 5:
+            # Copia reescalada y recomprimida, como las que devuelve el buscador
+            copy = tmp_path / f"img{seed:02d}_copia.jpg"
+            cv2.imwrite(str(copy), cv2.resize(image, (200, 150)), [cv2.IMWRITE_JPEG_QUALITY, 60])
+            paths.append(copy)
+
+    index_path = tmp_path / "phash_index.json"
+    hashes = build_hash_index(paths, workers=4, index_path=str(index_path))
+    assert build_hash_index(paths, index_path=str(index_path)) == hashes
+
+    clusters = cluster_near_duplicates(hashes)
+    for seed in range(5):
+        assert clusters[paths.index(tmp_path / f"img{seed:02d}.jpg")] == \
+            clusters[paths.index(tmp_path / f"img{seed:02d}_copia.jpg")]
+    assert len(set(clusters)) == 20
+
+    splits = split_by_cluster(clusters)
+    assert not cross_split_duplicates(paths, splits, hashes)
+    assert 12 <= splits.count('train') <= 19
+
+    # Un reparto imagen a imagen que separa una copia sí se detecta como fuga
+    naive = ['train'] * len(paths)
+    naive[paths.index(tmp_path / "img00_copia.jpg")] = 'test'
+    leaks = cross_split_duplicates(paths, naive, hashes)
+    assert len(leaks) == 1 and sorted(leaks[0]['splits']) == ['test', 'train']
+
+
+def test_organizer_links_files_from_index_and_keeps_splits(tmp_path):
+    pytest.importorskip("cv2")
+    from metodos_data.dataset_organaizer import organize_dataset
+    from metodos_data.nombrado_archivos import rename_logo_files
+
+    raw = tmp_path / "raw"
+    (raw / "images").mkdir(parents=True)
+    (raw / "xml").mkdir()
+    for seed in range(12):
+        make_photo(raw / "images" / f"foto{seed:02d}.jpg", seed)
+        # Los XML se llaman distinto a las imágenes salvo el nombre base
+        if seed != 3:
+            write_annotation(raw / "xml" / f"foto{seed:02d}.xml", ['adidas'])
+    write_annotation(raw / "xml" / "huerfano.xml", ['adidas'])
+    (raw / "fondo").mkdir()
+    for seed in range(20, 24):
+        make_photo(raw / "fondo" / f"b{seed}.jpg", seed)
+
+    source = tmp_path / "dataset_final"
+    registered = rename_logo_files(str(raw / "images"), str(raw / "xml"), str(source / "adidas"), prefix='adidas')
+    assert registered['adidas_0004']['annotation'] is None
+    assert registered['adidas_0005']['annotation'].endswith("foto04.xml")
+    rename_logo_files(str(raw / "fondo"), str(raw / "fondo"), str(source / "background"), prefix='background')
+    assert not any((source / "adidas").glob("*.jpg"))
+
+    output = tmp_path / "dataset_ok"
+    entries = organize_dataset(str(source), str(output), workers=4)
+    # adidas_0004 no tiene XML y no entra; background sí, con una anotación vacía
+    assert len(entries) == 11 + 4 and 'adidas_0004' not in entries
+    image = next(output.glob("*/images/adidas_0001.jpg"))
+    assert os.path.samefile(image, raw / "images" / "foto00.jpg")
+    label = next(output.glob("*/labels/adidas_0001.xml"))
+    assert os.path.samefile(label, raw / "xml" / "foto00.xml")
+    assert next(output.glob("*/labels/background_0001.xml")).read_text().startswith("<?xml")
+
+    # Imágenes nuevas: las anteriores no cambian de split ni se vuelven a enlazar
+    make_photo(raw / "images" / "foto12.jpg", 12)
+    write_annotation(raw / "xml" / "foto12.xml", ['adidas'])
+    assert list(rename_logo_files(str(raw / "images"), str(raw / "xml"), str(source / "adidas"),
+                                  prefix='adidas'))[-1] == 'adidas_0013'
+    again = organize_dataset(str(source), str(output), workers=4)
+    assert {name: entry['split'] for name, entry in again.items() if name in entries} == \
+        {name: entry['split'] for name, entry in entries.items()}
+    assert 'adidas_0013' in again
+
+    # Al borrar una imagen de origen desaparece también del dataset
+    (raw / "fondo" / "b20.jpg").unlink()
+    rename_logo_files(str(raw / "fondo"), str(raw / "fondo"), str(source / "background"), prefix='background')
+    organize_dataset(str(source), str(output), link_mode='symlink')
+    assert not any(output.glob("*/*/background_0001.*"))
+    assert sum(1 for _ in output.glob("*/images/*")) == 15
+
+
+def test_organizer_removes_files_outside_the_index_on_first_run(tmp_path):
+    pytest.importorskip("cv2")
+    from metodos_data.dataset_organaizer import organize_dataset
+    from metodos_data.dataset_index import INDEX_NAME
+
+    source = tmp_path / "dataset_final" / "adidas"
+    source.mkdir(parents=True)
+    for seed in range(10):
+        make_photo(source / f"adidas_{seed:04d}.jpg", seed)
+        write_annotation(source / f"adidas_{seed:04d}.xml", ['adidas'])
+
+    output = tmp_path / "dataset_ok"
+    organize_dataset(str(tmp_path / "dataset_final"), str(output))
+    # Árbol organizado antes con otro reparto y sin índice: todo en test
+    for path in list(output.glob("train/*/*")) + list(output.glob("valid/*/*")):
+        os.replace(path, output / "test" / path.parent.name / path.name)
+    (output / INDEX_NAME).unlink()
+
+    entries = organize_dataset(str(tmp_path / "dataset_final"), str(output))
+
+    images = sorted(path.name for path in output.glob("*/images/*"))
+    assert images == sorted(f"{name}.jpg" for name in entries)
+    for name, entry in entries.items():
+        assert [path.parent.parent.name for path in output.glob(f"*/*/{name}.*")] == [entry['split']] * 2
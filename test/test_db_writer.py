@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+
+import pytest
+
+import storage
+from db_writer import DetectionWriter, QueueFullError, get_writer
+
+PRODUCERS = 8
+BLOCKS_PER_PRODUCER = 40
+ROWS_PER_BLOCK = 25
+
+
+@pytest.fixture
+def store(db_path):
+    store = storage.SQLiteStore(db_path)
+    store.create_schema()
+    return store
+
+
+def block_write(store, video_hash, block):
+    """Escritura equivalente a la de un bloque de frames de process_video"""
+    first = block * ROWS_PER_BLOCK
+    rows = [(f"{video_hash}.mp4", frame, 'adidas', 0.9, "[0, 0, 1, 1]", frame / 30, None, video_hash, 0)
+            for frame in range(first, first + ROWS_PER_BLOCK)]
+    checkpoint = {'video_hash': video_hash, 'last_frame': first + ROWS_PER_BLOCK - 1, 'status': 'processing'}
+
+    def write(conn):
+        store.delete(conn, video_hash=video_hash, frame_start=first, frame_end=first + ROWS_PER_BLOCK - 1)
+        store.insert_batch(rows, conn)
+        store.upsert('video_checkpoints', checkpoint, conn)
+    return write
+
+
+def run_producers(store, writers, errors):
+    def produce(index):
+        writer = writers[index % len(writers)]
+        video_hash = f"video{index}"
+        futures = []
+        try:
+            for block in range(BLOCKS_PER_PRODUCER):
+                futures.append(writer.submit(block_write(store, video_hash, block), rows=ROWS_PER_BLOCK))
+            # Reescribir un bloque ya guardado no debe duplicar filas
+            futures.append(writer.submit(block_write(store, video_hash, 0), rows=ROWS_PER_BLOCK))
+            for future in futures:
+                future.result(timeout=60)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=produce, args=(i,)) for i in range(PRODUCERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_producers_share_one_writer(store, db_path):
+    writer = DetectionWriter(store, max_pending=8)
+    errors = []
+    run_producers(store, [writer], errors)
+    writer.close()
+
+    assert errors == []
+    conn = sqlite3.connect(db_path)
+    total = conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+    checkpoints = conn.execute("SELECT COUNT(*) FROM video_checkpoints").fetchone()[0]
+    conn.close()
+    assert total == PRODUCERS * BLOCKS_PER_PRODUCER * ROWS_PER_BLOCK
+    assert checkpoints == PRODUCERS
+    assert writer.stats['writes'] == PRODUCERS * (BLOCKS_PER_PRODUCER + 1)
+    # Los bloques encolados a la vez se confirman juntos
+    assert writer.stats['transactions'] < writer.stats['writes']
+
+
+def test_writers_in_separate_processes_do_not_lock(store, db_path):
+    # Un escritor por "proceso": compiten por el fichero sin errores de bloqueo
+    writers = [DetectionWriter(storage.SQLiteStore(db_path), max_pending=4) for _ in range(3)]
+    errors = []
+    run_producers(store, writers, errors)
+    for writer in writers:
+        writer.close()
+
+    assert errors == []
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0] == \
+        PRODUCERS * BLOCKS_PER_PRODUCER * ROWS_PER_BLOCK
+    conn.close()
+
+
+def test_full_queue_applies_backpressure(store):
+    writer = DetectionWriter(store, max_pending=2)
+    started, release = threading.Event(), threading.Event()
+    blocker = writer.submit(lambda conn: started.set() or release.wait(10))
+    started.wait(10)
+    # El escritor está ocupado: la cola admite dos escrituras más y luego rechaza
+    writer.submit(lambda conn: None, timeout=1)
+    writer.submit(lambda conn: None, timeout=1)
+    with pytest.raises(QueueFullError):
+        writer.submit(lambda conn: None, timeout=0.2)
+
+    release.set()
+    blocker.result(timeout=10)
+    writer.flush(timeout=10)
+    writer.close()
+
+
+def test_failed_write_does_not_affect_the_rest_of_the_group(store):
+    writer = DetectionWriter(store)
+    started, release = threading.Event(), threading.Event()
+    writer.submit(lambda conn: started.set() or release.wait(10))
+    started.wait(10)
+
+    def broken(conn):
+        raise ValueError("escritura inválida")
+    good = writer.submit(block_write(store, 'ok', 0), rows=ROWS_PER_BLOCK)
+    bad = writer.submit(broken)
+    release.set()
+
+    good.result(timeout=10)
+    with pytest.raises(ValueError):
+        bad.result(timeout=10)
+    assert len(store.query(video_hash='ok')) == ROWS_PER_BLOCK
+    writer.close()
+
+
+def hold_writer(writer):
+    """Bloquea la hebra del escritor hasta que se llame a la función devuelta"""
+    started, release = threading.Event(), threading.Event()
+    blocker = writer.submit(lambda conn: started.set() or release.wait(10))
+    started.wait(10)
+
+    def resume():
+        release.set()
+        blocker.result(timeout=10)
+    return resume
+
+
+@pytest.mark.parametrize('max_batch_rows, groups', [(1000, [5]), (20, [2, 2, 1])])
+def test_queued_writes_share_transactions_up_to_max_batch_rows(store, max_batch_rows, groups):
+    writer = DetectionWriter(store, max_batch_rows=max_batch_rows)
+    connections = []
+    resume = hold_writer(writer)
+    futures = [writer.submit(connections.append, rows=10) for _ in range(5)]
+    resume()
+    for future in futures:
+        future.result(timeout=10)
+    writer.close()
+
+    # Cada transacción usa su propia conexión: agrupar por conexión da los grupos
+    sizes = {}
+    for conn in connections:
+        sizes[id(conn)] = sizes.get(id(conn), 0) + 1
+    assert list(sizes.values()) == groups
+    assert writer.stats['writes'] == 1 + 5 and writer.stats['rows'] == 50
+
+
+def test_failed_group_is_retried_write_by_write(store):
+    writer = DetectionWriter(store)
+    resume = hold_writer(writer)
+
+    def half_written(conn):
+        store.insert_batch([("roto.mp4", 0, 'adidas', 0.9, "[0, 0, 1, 1]", 0.0, None, 'roto', 0)], conn)
+        raise sqlite3.IntegrityError("fallo a mitad de la escritura")
+    futures = [writer.submit(block_write(store, 'a', 0), rows=ROWS_PER_BLOCK),
+               writer.submit(half_written, rows=1),
+               writer.submit(block_write(store, 'b', 0), rows=ROWS_PER_BLOCK)]
+    resume()
+
+    futures[0].result(timeout=10)
+    futures[2].result(timeout=10)
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[1].result(timeout=10)
+    writer.close()
+    # La transacción conjunta se deshizo entera y solo se repitieron las buenas
+    assert len(store.query(video_hash='a')) == len(store.query(video_hash='b')) == ROWS_PER_BLOCK
+    assert store.query(video_hash='roto') == []
+    assert (writer.stats['failed'], writer.stats['transactions'], writer.stats['writes']) == (1, 3, 3)
+
+
+def test_writer_is_shared_per_database(db_path, tmp_path):
+    writer = get_writer(storage.SQLiteStore(db_path))
+    assert get_writer(storage.SQLiteStore(db_path)) is writer
+    assert get_writer(storage.SQLiteStore(str(tmp_path / "otra.db"))) is not writer
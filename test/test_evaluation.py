@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("yaml")
+
+from evaluation import (average_precision, compute_metrics, evaluate, list_split_images,
+                        load_recommended_thresholds, match_predictions, prediction_cache_path,
+                        save_prediction_cache, save_recommended_thresholds, xywh_to_xyxy)
+from utils.helpers import compute_file_hash
+
+CLASSES = ['adidas', 'puma', 'nike']
+
+
+def predictions(rows):
+    """rows: (imagen, clase, confianza, x1, y1, x2, y2)"""
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 7)
+    return {'image': rows[:, 0].astype(np.int32), 'cls': rows[:, 1].astype(np.int32),
+            'conf': rows[:, 2], 'boxes': rows[:, 3:]}
+
+
+def ground_truth(rows):
+    """rows: (imagen, clase, x1, y1, x2, y2)"""
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 6)
+    return {'image': rows[:, 0].astype(np.int32), 'cls': rows[:, 1].astype(np.int32), 'boxes': rows[:, 2:]}
+
+
+def test_match_predictions_pairs_each_label_once():
+    gt_boxes = np.array([[0.1, 0.1, 0.3, 0.3], [0.5, 0.5, 0.9, 0.9]])
+    pred_boxes = np.array([[0.1, 0.1, 0.3, 0.3],     # exacta
+                           [0.11, 0.1, 0.31, 0.3],   # duplicado de la primera
+                           [0.5, 0.5, 0.9, 0.9],     # clase equivocada
+                           [0.5, 0.5, 0.79, 0.9]])   # IoU 0.725 con la segunda
+    correct = match_predictions(np.array([0, 0, 1, 2]), pred_boxes, np.array([0, 2]), gt_boxes)
+    assert correct[:, 0].tolist() == [True, False, False, True]
+    # A partir de IoU 0.75 la última ya no cuenta
+    assert correct[3].tolist() == [True] * 5 + [False] * 5
+
+
+def test_average_precision_perfect_and_half():
+    assert average_precision(np.array([0.5, 1.0]), np.array([1.0, 1.0])) == pytest.approx(1.0)
+    assert average_precision(np.array([0.5, 0.5]), np.array([1.0, 0.5])) == pytest.approx(51 / 101)
+
+
+def test_metrics_sweep_and_recommended_thresholds():
+    gt = ground_truth([(0, 0, 0.1, 0.1, 0.3, 0.3), (1, 0, 0.1, 0.1, 0.3, 0.3), (2, 1, 0.5, 0.5, 0.7, 0.7)])
+    preds = predictions([
+        (0, 0, 0.9, 0.1, 0.1, 0.3, 0.3),
+        (1, 0, 0.6, 0.1, 0.1, 0.3, 0.3),
+        (2, 0, 0.3, 0.1, 0.1, 0.3, 0.3),  # falso positivo de baja confianza
+        (2, 1, 0.8, 0.5, 0.5, 0.7, 0.7),
+    ])
+    report = compute_metrics(preds, gt, CLASSES)
+
+    adidas = report['adidas']
+    assert adidas['map50'] == pytest.approx(1.0)
+    assert adidas['recommended_threshold'] == pytest.approx(0.6)
+    assert (adidas['precision'], adidas['recall']) == (1.0, 1.0)
+    sweep = {point['threshold']: point for point in adidas['sweep']}
+    assert sweep[0.3]['precision'] == pytest.approx(2 / 3) and sweep[0.3]['detections'] == 3
+    assert sweep[0.7]['recall'] == pytest.approx(0.5)
+    assert report['puma']['recommended_threshold'] == pytest.approx(0.8)
+    # Sin etiquetas se mantiene el umbral por defecto de process_video
+    assert report['nike']['labels'] == 0 and report['nike']['recommended_threshold'] == 0.5
+
+    # beta < 1 prima la precisión
+    strict = compute_metrics(preds, gt, CLASSES, beta=0.1)
+    assert strict['adidas']['recommended_threshold'] >= adidas['recommended_threshold']
+
+
+def test_evaluate_reuses_cached_predictions(tmp_path):
+    dataset = tmp_path / "dataset_yolo"
+    (dataset / "test" / "images").mkdir(parents=True)
+    (dataset / "test" / "labels").mkdir()
+    (dataset / "data.yaml").write_text("nc: 3\nnames: ['adidas', 'puma', 'nike']\n")
+    for name, label in {'a.jpg': "0 0.2 0.2 0.2 0.2\n", 'b.jpg': "2 0.5 0.5 0.2 0.2\n", 'c.jpg': ""}.items():
+        (dataset / "test" / "images" / name).write_bytes(name.encode())
+        (dataset / "test" / "labels" / name.replace('.jpg', '.txt')).write_text(label)
+    weights = tmp_path / "best.pt"
+    weights.write_bytes(b"pesos")
+
+    # Caché con las predicciones del modelo (en otro orden de clases que el dataset)
+    images = list_split_images(str(dataset / "test"))
+    cache_dir = tmp_path / "cache"
+    save_prediction_cache(prediction_cache_path(str(cache_dir), compute_file_hash(str(weights)), 640), {
+        'keys': [key for _, key in reversed(images)] + ['borrada.jpg|1|1'],
+        'image': np.array([2, 1, 3], dtype=np.int32),
+        'cls': np.array([1, 0, 0], dtype=np.int32),
+        'conf': np.array([0.9, 0.7, 0.9], dtype=np.float32),
+        'boxes': np.vstack([xywh_to_xyxy([[0.2, 0.2, 0.2, 0.2]]), xywh_to_xyxy([[0.5, 0.5, 0.2, 0.2]]),
+                            [[0, 0, 1, 1]]]).astype(np.float32),
+        'names': ['nike', 'adidas', 'puma']
+    })
+
+    report = evaluate(str(weights), str(dataset), cache_dir=str(cache_dir))
+    assert report['images'] == 3
+    assert report['brands']['adidas']['map50'] == pytest.approx(1.0)
+    assert report['brands']['nike']['map50'] == pytest.approx(1.0)
+    assert report['brands']['puma']['predictions'] == 0
+    assert report['conf_thresholds'] == {'adidas': 0.9, 'puma': 0.5, 'nike': 0.7}
+
+    # Los umbrales se guardan junto a los pesos para que la app los use por defecto
+    save_recommended_thresholds(report)
+    assert load_recommended_thresholds(str(weights), report['model_hash']) == report['conf_thresholds']
+    assert load_recommended_thresholds(str(weights), "otro modelo") is None
@@ -0,0 +1,67 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from utils.image_cache import PAD_VALUE, PackedImageCache, build_packed_cache, cache_paths, resized_shape
+
+
+@pytest.fixture
+def split_dir(tmp_path):
+    """Split con imágenes de distintas proporciones"""
+    images_dir = tmp_path / "train" / "images"
+    images_dir.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for name, (height, width) in {'wide.png': (120, 320), 'tall.png': (300, 90), 'small.png': (40, 40)}.items():
+        cv2.imwrite(str(images_dir / name), rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+    (images_dir / "notes.txt").write_text("no es una imagen")
+    return str(tmp_path / "train")
+
+
+def test_resized_shape_matches_long_side():
+    assert resized_shape(120, 320, 160) == (60, 160)
+    assert resized_shape(300, 90, 160) == (160, 48)
+    assert resized_shape(160, 160, 160) == (160, 160)
+
+
+def test_build_and_read_packed_cache(split_dir):
+    build_packed_cache(split_dir, imgsz=160, workers=2)
+    array_path, index_path = cache_paths(split_dir, 160)
+    assert np.load(array_path, mmap_mode='r').shape == (3, 160, 160, 3)
+
+    cache = PackedImageCache.open(split_dir, 160)
+    assert len(cache) == 3
+    image, original, resized = cache.load(os.path.join(split_dir, "images", "wide.png"))
+    assert original == (120, 320) and resized == (60, 160)
+    expected = cv2.resize(cv2.imread(os.path.join(split_dir, "images", "wide.png")), (160, 60),
+                          interpolation=cv2.INTER_LINEAR)
+    assert np.array_equal(image, expected)
+    # Vista sobre el mmap, sin copia, con el relleno fuera de la imagen
+    assert np.shares_memory(image, cache.array)
+    assert (cache.letterboxed(cache.position("wide.png"))[60:] == PAD_VALUE).all()
+
+    # Copy-on-write: escribir en una imagen no modifica el fichero
+    image[:] = 0
+    assert PackedImageCache(split_dir, 160).load("wide.png")[0].any()
+
+    # Se puede enviar a otro proceso sin serializar el array
+    assert len(pickle.dumps(cache)) < 10_000
+    assert pickle.loads(pickle.dumps(cache)).load("tall.png")[2] == (160, 48)
+
+
+def test_packed_cache_ignores_changed_images(split_dir, capsys):
+    build_packed_cache(split_dir, imgsz=160)
+    build_packed_cache(split_dir, imgsz=160)
+    assert "al día" in capsys.readouterr().out
+
+    tall = os.path.join(split_dir, "images", "tall.png")
+    cv2.imwrite(tall, np.zeros((50, 50, 3), dtype=np.uint8))
+    os.utime(tall, ns=(1, 1))
+    cache = PackedImageCache.open(split_dir, 160)
+    assert cache.load(tall) is None and len(cache) == 2
+
+    build_packed_cache(split_dir, imgsz=160)
+    assert PackedImageCache.open(split_dir, 160).load(tall)[1] == (50, 50)
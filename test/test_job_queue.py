@@ -0,0 +1,160 @@
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+import storage
+from job_queue import COMPLETED, FAILED, QUEUED, RUNNING, JobQueue, WorkerPool
+
+
+@pytest.fixture
+def queue(db_path):
+    store = storage.SQLiteStore(db_path)
+    store.create_schema()
+    return JobQueue(db_path, store)
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "partido.mp4"
+    path.write_bytes(b"video")
+    return str(path)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "tiempo de espera agotado"
+        time.sleep(0.02)
+
+
+def test_concurrent_claims_never_take_the_same_job(queue, db_path):
+    job_ids = [queue.submit(f"video{i}.mp4", {'adidas': 0.5}) for i in range(20)]
+    claimed = []
+    barrier = threading.Barrier(8)
+
+    def worker(i):
+        # Cada hebra con su propia cola (conexiones distintas), como varios procesos
+        own_queue = JobQueue(db_path, queue.store)
+        barrier.wait()
+        while True:
+            job = own_queue.claim(f"worker-{i}")
+            if job is None:
+                return
+            claimed.append(job['job_id'])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == job_ids
+    assert {job['status'] for job in queue.list(limit=100)} == {RUNNING}
+
+
+def test_claim_takes_the_oldest_queued_job(queue):
+    first = queue.submit("a.mp4", {'adidas': 0.5})
+    queue.submit("b.mp4", {'adidas': 0.5})
+
+    job = queue.claim("worker")
+    assert (job['job_id'], job['status'], job['worker']) == (first, RUNNING, "worker")
+    assert job['started_at'] and job['params'] == {'conf_thresholds': {'adidas': 0.5}, 'store_floor': None}
+
+
+def test_running_jobs_are_requeued_after_a_crash(queue, db_path):
+    job_id = queue.submit("a.mp4", {'adidas': 0.5})
+    queue.claim("worker-que-muere")
+
+    # El proceso se reinicia: otra cola sobre el mismo fichero
+    restarted = JobQueue(db_path, queue.store)
+    assert restarted.requeue_running() == 1
+    job = restarted.get(job_id)
+    assert (job['status'], job['worker']) == (QUEUED, None)
+    assert restarted.claim("worker-nuevo")['job_id'] == job_id
+    assert restarted.requeue_running() == 1 and restarted.requeue_running() == 0
+
+
+def test_status_and_progress_transitions(queue):
+    job_id = queue.submit("a.mp4", {'adidas': 0.5})
+    job = queue.get(job_id)
+    assert job['status'] == QUEUED
+    assert queue.progress(job) == {'frames_done': 0, 'total_frames': None, 'fps': None, 'eta_seconds': None}
+
+    queue.claim("worker")
+    queue.report_progress(job_id, {'frames_done': 50, 'total_frames': 150, 'fps': 25.0})
+    progress = queue.progress(queue.get(job_id))
+    assert progress['frames_done'] == 50 and progress['eta_seconds'] == pytest.approx(4.0)
+
+    queue.complete(job_id, {'total_frames': 150})
+    job = queue.get(job_id)
+    assert (job['status'], job['stats']) == (COMPLETED, {'total_frames': 150}) and job['finished_at']
+
+    other = queue.submit("b.mp4", {'adidas': 0.5})
+    queue.claim("worker")
+    queue.fail(other, ValueError("video corrupto"))
+    assert (queue.get(other)['status'], queue.get(other)['error']) == (FAILED, "video corrupto")
+    assert [job['job_id'] for job in queue.list(status=FAILED)] == [other]
+
+
+def test_progress_is_estimated_from_the_checkpoint(queue):
+    job_id = queue.submit("a.mp4", {'adidas': 0.5})
+    queue.claim("worker")
+    started_at = queue.get(job_id)['started_at']
+    queue.update(job_id, video_hash='hv', start_frame=10)
+    updated_at = (storage.parse_timestamp(started_at) + timedelta(seconds=2)).strftime(storage.TIMESTAMP_FORMAT)
+    queue.store.upsert('video_checkpoints', {'video_hash': 'hv', 'last_frame': 49, 'total_frames': 250,
+                                             'status': 'processing', 'updated_at': updated_at})
+
+    progress = queue.progress(queue.get(job_id))
+    # 40 frames en 2 segundos: 20 fps y 200 frames por delante
+    assert (progress['frames_done'], progress['total_frames']) == (50, 250)
+    assert progress['fps'] == pytest.approx(20.0) and progress['eta_seconds'] == pytest.approx(10.0)
+
+
+class FakeDetector:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def get_checkpoint(self, video_hash):
+        return None
+
+    def process_video(self, video_path, conf_thresholds, progress_callback=None, **options):
+        self.calls.append((video_path, options['resume'], options['display']))
+        if self.fail:
+            return None
+        progress_callback({'frames_done': 10, 'total_frames': 10, 'fps': 5.0})
+        return {'video_hash': options['video_hash'], 'total_frames': 10}
+
+
+def test_worker_pool_processes_and_fails_jobs(queue, video):
+    detectors = []
+
+    def factory():
+        detectors.append(FakeDetector(fail=len(detectors) > 0))
+        return detectors[-1]
+
+    ok = queue.submit(video, {'adidas': 0.5})
+    pool = WorkerPool(queue, factory, num_workers=1, poll_interval=0.02)
+    pool.start()
+    try:
+        wait_for(lambda: queue.get(ok)['status'] == COMPLETED)
+    finally:
+        pool.stop(timeout=5)
+
+    job = queue.get(ok)
+    assert job['stats']['total_frames'] == 10 and job['video_hash'] == job['stats']['video_hash']
+    assert job['start_frame'] == 0 and job['progress']['frames_done'] == 10
+    # Los workers siempre reanudan desde el checkpoint y sin ventana
+    assert detectors[0].calls == [(video, True, False)]
+
+    failing = queue.submit(video, {'adidas': 0.5})
+    pool = WorkerPool(queue, factory, num_workers=1, poll_interval=0.02)
+    pool.start()
+    try:
+        wait_for(lambda: queue.get(failing)['status'] == FAILED)
+    finally:
+        pool.stop(timeout=5)
+    assert queue.get(failing)['error'] == "No se pudo procesar el video"
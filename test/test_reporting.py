@@ -0,0 +1,57 @@
+import json
+import sqlite3
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+import storage
+from export_detections import export_detections, read_export
+
+
+@pytest.fixture
+def populated_store(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''CREATE TABLE detections
+                    (video_name TEXT, frame_number INTEGER, brand TEXT, confidence REAL,
+                    bbox TEXT, timestamp REAL, image_path TEXT, video_hash TEXT, box_index INTEGER)''')
+    rows = [(f"video{i % 2}.mp4", i, 'adidas' if i % 3 else 'nike', (i % 10) / 10,
+             json.dumps([i, i + 1.5, i + 10, i + 20.25]), i / 30, None, f"hash{i % 2}", 0)
+            for i in range(250)]
+    conn.executemany("INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return storage.SQLiteStore(db_path)
+
+
+@pytest.mark.parametrize("fmt, extension", [("parquet", "parquet"), ("arrow", "arrow")])
+def test_export_round_trip_splits_bbox(populated_store, tmp_path, fmt, extension):
+    output = str(tmp_path / f"detections.{extension}")
+    rows = export_detections(populated_store, output, fmt, batch_size=64)
+    table = read_export(output)
+
+    assert rows == table.num_rows == 250
+    assert table.column('frame_number').to_pylist() == list(range(250))
+    assert table.column('y1').to_pylist()[3] == 4.5
+    assert table.column('y2').to_pylist()[3] == 23.25
+    assert 'bbox' not in table.column_names
+
+
+def test_parquet_export_writes_one_row_group_per_batch(populated_store, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    output = str(tmp_path / "detections.parquet")
+    export_detections(populated_store, output, batch_size=100)
+
+    assert pq.ParquetFile(output).num_row_groups == 3
+
+
+def test_export_filters(populated_store, tmp_path):
+    output = str(tmp_path / "nike.arrow")
+    rows = export_detections(populated_store, output, 'arrow', video_names=['video0.mp4'],
+                             brand='nike', min_confidence=0.5)
+    table = read_export(output)
+
+    assert rows == table.num_rows > 0
+    assert set(table.column('video_name').to_pylist()) == {'video0.mp4'}
+    assert set(table.column('brand').to_pylist()) == {'nike'}
+    assert min(table.column('confidence').to_pylist()) >= 0.5
@@ -0,0 +1,144 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import storage
+from retention import (collect_garbage_crops, compact_database, delete_in_batches, expired_videos,
+                       parse_policies, run_retention)
+
+
+@pytest.fixture(params=['sqlite', 'duckdb'])
+def store(request, db_path):
+    if request.param == 'sqlite':
+        store = storage.SQLiteStore(db_path)
+    else:
+        pytest.importorskip("duckdb")
+        store = storage.DuckDBStore(db_path.replace('.db', '.duckdb'))
+    store.create_schema()
+    return store
+
+
+def add_video(store, video_name, days_old, brands=('adidas', 'nike'), frames=50, images_dir=None,
+              video_hash=None):
+    video_hash = video_hash or f"hash-{video_name}"
+    rows = []
+    for frame in range(frames):
+        for box, brand in enumerate(brands):
+            image = f"{video_name}_{frame}_{brand}.jpg" if images_dir else None
+            if image:
+                open(os.path.join(images_dir, image), 'wb').close()
+            rows.append((video_name, frame, brand, 0.9, "[0, 0, 1, 1]", frame / 30, image,
+                         video_hash, box))
+    store.insert_batch(rows)
+    created_at = datetime.now(timezone.utc) - timedelta(days=days_old)
+    store.upsert('video_checkpoints', {'video_hash': video_hash, 'video_name': video_name,
+                                       'last_frame': frames - 1, 'status': 'completed',
+                                       'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S')})
+    store.upsert('analysis_cache', {'cache_key': f"{video_hash}-key", 'video_hash': video_hash, 'stats': '{}'})
+
+
+def count(store, **filters):
+    return len(store.query(['rowid'], order_by=None, **filters))
+
+
+def test_age_policy_removes_old_videos_and_their_metadata(store):
+    add_video(store, 'old.mp4', days_old=100)
+    add_video(store, 'new.mp4', days_old=1)
+
+    report = run_retention(store, parse_policies(max_age_days=30), batch_size=7)
+
+    assert report['deleted'] == 100
+    assert count(store, video_hash='hash-old.mp4') == 0
+    assert count(store, video_hash='hash-new.mp4') == 100
+    assert store.search_videos() == [{**store.search_videos()[0], 'video_hash': 'hash-new.mp4'}]
+    assert [row['video_hash'] for row in store.rows('video_checkpoints')] == ['hash-new.mp4']
+    assert [row['video_hash'] for row in store.rows('analysis_cache')] == ['hash-new.mp4']
+
+
+def test_age_policy_tells_apart_videos_with_the_same_name(store):
+    add_video(store, 'partido.mp4', days_old=100, video_hash='old')
+    add_video(store, 'partido.mp4', days_old=1, video_hash='new')
+
+    report = run_retention(store, parse_policies(max_age_days=30))
+
+    assert [video['video_hash'] for video in report['videos']] == ['old']
+    assert count(store, video_hash='new') == 100
+    assert [row['video_hash'] for row in store.rows('video_checkpoints')] == ['new']
+
+
+def test_brand_policy_and_dry_run(store):
+    add_video(store, 'old.mp4', days_old=100)
+
+    report = run_retention(store, parse_policies(brand_ages='nike:30'), dry_run=True)
+    assert report['videos'] == [{'video_hash': 'hash-old.mp4', 'video_name': 'old.mp4', 'brand': 'nike'}]
+    assert count(store) == 100
+
+    run_retention(store, parse_policies(brand_ages='nike:30'))
+    assert count(store) == count(store, brand='adidas') == 50
+    assert store.search_videos()[0]['detection_count'] == 50
+    # Lo guardado ya no es el análisis completo: sin caché y sin checkpoint 'completed'
+    assert store.rows('analysis_cache') == []
+    checkpoint = store.get('video_checkpoints', 'hash-old.mp4')
+    assert (checkpoint['status'], checkpoint['last_frame']) == ('expired', -1)
+
+
+def test_brand_policy_ignores_videos_without_that_brand(store):
+    add_video(store, 'old.mp4', days_old=100)
+    checkpoint = store.get('video_checkpoints', 'hash-old.mp4')
+
+    for _ in range(2):
+        report = run_retention(store, parse_policies(brand_ages='puma:30'))
+        assert (report['videos'], report['deleted']) == ([], 0)
+    # Ni caché ni checkpoint cambian: el video no se vuelve a analizar
+    assert store.get('video_checkpoints', 'hash-old.mp4') == checkpoint
+    assert [row['video_hash'] for row in store.rows('analysis_cache')] == ['hash-old.mp4']
+    assert run_retention(store, parse_policies(brand_ages='puma:30'), dry_run=True)['videos'] == []
+
+
+def test_videos_without_checkpoint_start_aging(store):
+    add_video(store, 'legacy.mp4', days_old=0)
+    store.delete_key('video_checkpoints', 'video_hash', 'hash-legacy.mp4')
+    later = datetime.now(timezone.utc) + timedelta(days=40)
+
+    assert run_retention(store, parse_policies(max_age_days=30))['videos'] == []
+    assert store.get('video_checkpoints', 'hash-legacy.mp4')['status'] == 'untracked'
+    report = run_retention(store, parse_policies(max_age_days=30), now=later)
+    assert [video['video_hash'] for video in report['videos']] == ['hash-legacy.mp4']
+    assert count(store) == 0
+
+
+def test_archive_keeps_deleted_detections(store, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    add_video(store, 'old.mp4', days_old=100)
+
+    report = run_retention(store, parse_policies(max_age_days=30), archive_dir=str(tmp_path / "archive"))
+
+    assert len(report['archives']) == 1
+    assert pq.read_table(report['archives'][0]).num_rows == 100
+
+
+def test_delete_in_batches_returns_total(store):
+    add_video(store, 'a.mp4', days_old=0, frames=95, brands=('adidas',))
+    assert delete_in_batches(store, batch_size=10, video_hash='hash-a.mp4') == 95
+
+
+def test_garbage_collection_only_removes_old_orphans(store, tmp_path):
+    images_dir = tmp_path / "images"
+    images_dir.mkdir()
+    add_video(store, 'a.mp4', days_old=0, frames=2, brands=('adidas',), images_dir=str(images_dir))
+    for name in ('orphan.jpg', 'recent.jpg'):
+        (images_dir / name).write_bytes(b'')
+    os.utime(images_dir / 'orphan.jpg', (0, 0))
+    os.utime(images_dir / 'a.mp4_0_adidas.jpg', (0, 0))
+
+    assert collect_garbage_crops(store, str(images_dir)) == 1
+    assert sorted(os.listdir(images_dir)) == ['a.mp4_0_adidas.jpg', 'a.mp4_1_adidas.jpg', 'recent.jpg']
+
+
+def test_compaction_vacuums_after_large_deletes(db_path):
+    store = storage.SQLiteStore(db_path)
+    store.create_schema()
+    add_video(store, 'a.mp4', days_old=0, frames=2000)
+    delete_in_batches(store, video_hash='hash-a.mp4')
+    assert compact_database(db_path)
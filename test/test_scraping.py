@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("requests")
+pytest.importorskip("icrawler")
+
+# Los scripts de preparación del dataset viven en data/
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+if DATA_PATH not in sys.path:
+    sys.path.insert(0, DATA_PATH)
+
+from metodos_data import scrape_logos
+from metodos_data.scrape_logos import RateLimiter, run_scraping
+
+
+def encoded(width, height, seed):
+    image = np.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+@pytest.fixture
+def image_server():
+    """Servidor HTTP local que sustituye a los resultados de Google"""
+    images = {f"/img{i}.jpg": encoded(200, 150, i) for i in range(8)}
+    images["/grande.jpg"] = encoded(2000, 1000, 100)
+    images["/copia.jpg"] = images["/img0.jpg"]
+    images["/pequena.jpg"] = encoded(20, 20, 101)
+    images["/texto.jpg"] = b"esto no es una imagen"
+    requests_log = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_log.append((self.path, time.monotonic()))
+            body = images.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield base_url, requests_log
+    server.shutdown()
+    server.server_close()
+
+
+def test_scraping_validates_dedups_and_resumes(image_server, tmp_path):
+    base_url, requests_log = image_server
+    results = {
+        'adidas': [f"{base_url}{path}" for path in
+                   ("/img0.jpg", "/copia.jpg", "/texto.jpg", "/pequena.jpg", "/no-existe.jpg",
+                    "/grande.jpg", "/img1.jpg", "/img2.jpg")],
+        'puma': [f"{base_url}/img{i}.jpg" for i in range(3, 8)] + [f"{base_url}/img0.jpg"],
+    }
+
+    searches = []
+
+    def url_source(query, max_num, offset=0):
+        searches.append((query, offset))
+        return results[query][offset:offset + max_num]
+
+    jobs = [{'query': 'adidas', 'max_num': 4, 'output_dir': str(tmp_path / "adidas")},
+            {'query': 'puma', 'max_num': 3, 'output_dir': str(tmp_path / "puma")}]
+    manifest_path = str(tmp_path / "downloads.db")
+    summary = run_scraping(jobs, manifest_path, url_source=url_source, workers=4, rate=0)
+
+    assert summary['adidas']['total'] == 4 and summary['puma']['total'] == 3
+    assert summary['adidas']['duplicate'] == 1 and summary['adidas']['invalid'] == 3
+    assert len(os.listdir(tmp_path / "adidas")) == 4 and len(os.listdir(tmp_path / "puma")) == 3
+
+    # La imagen grande se reduce al guardarla
+    conn = sqlite3.connect(manifest_path)
+    width, height, file_path = conn.execute(
+        "SELECT width, height, file_path FROM downloads WHERE url LIKE '%grande.jpg'").fetchone()
+    assert (width, height) == (1280, 640)
+    assert cv2.imread(file_path).shape == (640, 1280, 3)
+    statuses = dict(conn.execute("SELECT url, status FROM downloads"))
+    conn.close()
+    # Mismo contenido desde dos URLs: se guarda solo el que llega primero
+    assert sorted([statuses[f"{base_url}/copia.jpg"], statuses[f"{base_url}/img0.jpg"]]) == ['duplicate', 'ok']
+    assert statuses[f"{base_url}/no-existe.jpg"] == 'invalid'
+
+    # Al reanudar no se vuelve a pedir nada que ya esté completo
+    requests_log.clear()
+    searches.clear()
+    jobs[1]['max_num'] = 5
+    summary = run_scraping(jobs, manifest_path, url_source=url_source, workers=4, rate=0)
+    assert summary['adidas'] == {'ok': 0, 'duplicate': 0, 'invalid': 0, 'error': 0, 'previous': 4, 'total': 4}
+    assert summary['puma']['total'] == 5 and summary['puma']['previous'] == 3
+    assert {path for path, _ in requests_log} <= {"/img6.jpg", "/img7.jpg", "/img0.jpg"}
+    assert len(os.listdir(tmp_path / "puma")) == 5
+    # La búsqueda sigue donde se quedó en lugar de empezar de nuevo
+    assert searches == [('puma', 3)]
+
+
+def test_missing_files_are_downloaded_again(image_server, tmp_path):
+    base_url, requests_log = image_server
+    urls = [f"{base_url}/img{i}.jpg" for i in range(4)]
+    jobs = [{'query': 'adidas', 'max_num': 3, 'output_dir': str(tmp_path / "adidas")}]
+    manifest_path = str(tmp_path / "downloads.db")
+    run_scraping(jobs, manifest_path, url_source=lambda query, n, offset: urls[offset:offset + n], rate=0)
+
+    conn = sqlite3.connect(manifest_path)
+    lost_url, lost_path = conn.execute("SELECT url, file_path FROM downloads WHERE status = 'ok'").fetchone()
+    conn.close()
+    os.remove(lost_path)
+
+    requests_log.clear()
+    summary = run_scraping(jobs, manifest_path, url_source=lambda query, n, offset: urls[offset:offset + n],
+                           rate=0)['adidas']
+    assert (summary['previous'], summary['ok'], summary['total']) == (2, 1, 3)
+    # Se recupera la misma imagen, sin pedir resultados nuevos
+    assert [path for path, _ in requests_log] == [lost_url[len(base_url):]]
+    assert os.path.exists(lost_path)
+
+
+def test_rate_limit_is_shared_by_all_threads(image_server, tmp_path):
+    base_url, requests_log = image_server
+    jobs = [{'query': f"q{i}", 'max_num': 2, 'output_dir': str(tmp_path / f"q{i}")} for i in range(3)]
+    urls = {f"q{i}": [f"{base_url}/img{2 * i}.jpg", f"{base_url}/img{2 * i + 1}.jpg"] for i in range(3)}
+    searches = []
+
+    def url_source(query, n, offset):
+        searches.append(time.monotonic())
+        return urls[query][offset:offset + n]
+    run_scraping(jobs, str(tmp_path / "downloads.db"), url_source=url_source, workers=6, rate=20)
+
+    times = sorted(moment for _, moment in requests_log)
+    assert len(times) == 6
+    assert times[-1] - times[0] >= 5 / 20 * 0.9
+    # Las búsquedas también pasan por el límite: nueve peticiones en total
+    times = sorted(times + searches)
+    assert times[-1] - times[0] >= 8 / 20 * 0.9
+
+
+def test_failures_of_one_url_do_not_stop_the_search(image_server, tmp_path, monkeypatch):
+    base_url, _ = image_server
+    broken = {encoded(200, 150, 1): OSError("disco lleno"), encoded(200, 150, 2): cv2.error("demasiados píxeles")}
+    ingest_image = scrape_logos.ingest_image
+
+    def failing_ingest(content, *args):
+        if content in broken:
+            raise broken[content]
+        return ingest_image(content, *args)
+    claim_content = scrape_logos.DownloadManifest.claim_content
+
+    def failing_claim(manifest, url, query, content_hash):
+        if url.endswith("/img3.jpg"):
+            raise sqlite3.OperationalError("database is locked")
+        return claim_content(manifest, url, query, content_hash)
+    monkeypatch.setattr(scrape_logos, 'ingest_image', failing_ingest)
+    monkeypatch.setattr(scrape_logos.DownloadManifest, 'claim_content', failing_claim)
+
+    urls = [f"{base_url}/img{i}.jpg" for i in range(6)]
+    manifest_path = str(tmp_path / "downloads.db")
+    summary = run_scraping([{'query': 'adidas', 'max_num': 3, 'output_dir': str(tmp_path / "adidas")}],
+                           manifest_path, url_source=lambda query, n, offset: urls[offset:offset + n],
+                           rate=0)['adidas']
+
+    # Las URLs que fallan se reponen con otros resultados
+    assert (summary['ok'], summary['error'], summary['total']) == (3, 3, 3)
+    conn = sqlite3.connect(manifest_path)
+    failed = dict(conn.execute("SELECT url, error FROM downloads WHERE status = 'error'"))
+    conn.close()
+    assert failed == {urls[1]: "disco lleno", urls[2]: "demasiados píxeles", urls[3]: "database is locked"}
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - start >= 5 / 50 * 0.9
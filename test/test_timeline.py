@@ -0,0 +1,89 @@
+import math
+
+import numpy as np
+import pytest
+
+import storage
+from utils.timeline import BUCKET_WIDTHS, binned_timeline, choose_bucket_width, downsample_lttb, lttb_indices
+
+
+@pytest.fixture(params=['sqlite', 'duckdb'])
+def store(request, db_path):
+    if request.param == 'sqlite':
+        store = storage.SQLiteStore(db_path)
+    else:
+        pytest.importorskip("duckdb")
+        store = storage.DuckDBStore(db_path.replace('.db', '.duckdb'))
+    store.create_schema()
+    return store
+
+
+def add_detections(store, video_hash, detections):
+    """detections: (timestamp, marca, confianza)"""
+    store.insert_batch([("partido.mp4", frame, brand, confidence, "[0, 0, 1, 1]", timestamp, None, video_hash, 0)
+                        for frame, (timestamp, brand, confidence) in enumerate(detections)])
+
+
+def test_bucket_width_is_the_smallest_that_fits():
+    assert choose_bucket_width(50, max_buckets=500) == 0.1
+    assert choose_bucket_width(50.1, max_buckets=500) == 0.2
+    assert choose_bucket_width(60, max_buckets=10) == 10
+    # Más allá del mayor ancho redondo se reparte la duración exacta
+    assert choose_bucket_width(BUCKET_WIDTHS[-1] * 20, max_buckets=10) == BUCKET_WIDTHS[-1] * 2
+
+
+def test_bins_include_their_start_and_exclude_their_end(store):
+    add_detections(store, 'ha', [(0.0, 'adidas', 0.2), (0.25, 'adidas', 0.6), (0.5, 'adidas', 0.4),
+                                 (0.75, 'nike', 0.8), (1.0, 'adidas', 0.9), (1.0, 'adidas', 0.1)])
+    add_detections(store, 'hb', [(0.0, 'adidas', 0.9)])
+
+    width, points = binned_timeline(store, 'ha', bucket_seconds=0.5)
+    assert width == 0.5
+    assert [(p['time'], p['brand'], p['count'], p['max_confidence']) for p in points] == [
+        (0.0, 'adidas', 2, 0.6), (0.5, 'adidas', 1, 0.4), (0.5, 'nike', 1, 0.8), (1.0, 'adidas', 2, 0.9)]
+    assert points[0]['mean_confidence'] == pytest.approx(0.4)
+
+
+def test_bucket_width_follows_the_duration_and_thresholds(store):
+    add_detections(store, 'ha', [(t / 10, 'adidas', 0.9) for t in range(600)] + [(120.0, 'nike', 0.3)])
+
+    # Duración de 120 s: con 50 intervalos como máximo, intervalos de 5 s
+    width, points = binned_timeline(store, 'ha', max_buckets=50)
+    assert width == 5 and len(points) == 13 and points[-1] == {
+        'brand': 'nike', 'time': 120.0, 'count': 1, 'max_confidence': 0.3, 'mean_confidence': 0.3}
+    # Con umbral la detección de nike desaparece y la duración baja a 59.9 s
+    width, points = binned_timeline(store, 'ha', max_buckets=50, conf_thresholds={'adidas': 0.5, 'nike': 0.5})
+    assert width == 2 and len(points) == 30 and {p['brand'] for p in points} == {'adidas'}
+
+    assert binned_timeline(store, 'otro', max_buckets=50) == (None, [])
+
+
+def test_lttb_keeps_the_ends_and_the_peaks():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[[137, 501, 868]] = 1.0
+
+    indices = lttb_indices(x, y, 20)
+    assert len(indices) == 20 and indices[0] == 0 and indices[-1] == 999
+    assert list(indices) == sorted(set(indices))
+    assert {137, 501, 868} <= set(indices.tolist())
+
+
+@pytest.mark.parametrize('threshold', [2, 10, 11])
+def test_lttb_leaves_short_series_unchanged(threshold):
+    assert list(lttb_indices(list(range(10)), [math.sin(i) for i in range(10)], threshold)) == list(range(10))
+
+
+def test_downsample_reduces_each_brand_and_keeps_its_ends():
+    points = [{'time': t, 'brand': brand, 'max_confidence': (t * 7 % 13) / 13}
+              for t in range(100) for brand in ('adidas', 'nike')]
+    points += [{'time': 200, 'brand': 'puma', 'max_confidence': 0.5}]
+
+    result = downsample_lttb(points, 30)
+    by_brand = {brand: [p['time'] for p in result if p['brand'] == brand] for brand in ('adidas', 'nike', 'puma')}
+    assert len(by_brand['adidas']) == len(by_brand['nike']) == 10
+    assert by_brand['adidas'][0] == 0 and by_brand['adidas'][-1] == 99
+    # Una marca con menos puntos que su parte pasa sin cambios
+    assert by_brand['puma'] == [200]
+    assert result == sorted(result, key=lambda p: (p['time'], p['brand']))
+    assert downsample_lttb(points[:20], 30) == sorted(points[:20], key=lambda p: (p['time'], p['brand']))
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip("psutil")
+
+from utils.training import (choose_batch_size, choose_cache_mode, choose_workers, count_images,
+                            cpu_training_defaults, estimate_cache_bytes)
+
+GB = 1024 ** 3
+
+
+def test_batch_size_scales_with_memory_and_image_size():
+    assert choose_batch_size(640, 32 * GB) == 32
+    assert choose_batch_size(640, 4 * GB) == 4
+    assert choose_batch_size(320, 4 * GB) == 16
+    # La caché en RAM reduce la memoria disponible para los batches
+    assert choose_batch_size(640, 32 * GB, reserved_memory=24 * GB) == 8
+    assert choose_batch_size(640, 0) == 2
+
+
+def test_cache_mode_prefers_ram_then_disk():
+    images = 10000
+    size = estimate_cache_bytes(images, 640)
+    assert choose_cache_mode(images, 640, available_memory=size * 4, free_disk=0) == 'ram'
+    assert choose_cache_mode(images, 640, available_memory=size, free_disk=size * 3) == 'disk'
+    assert choose_cache_mode(images, 640, available_memory=size, free_disk=size) is False
+
+
+def test_workers_leave_cores_for_torch():
+    assert choose_workers(1) == 1
+    assert choose_workers(8, 16) == 4
+    assert choose_workers(64) == 8
+    assert choose_workers(None, 4) == 2
+
+
+def test_defaults_count_training_images(tmp_path):
+    for name in ('a.jpg', 'b.PNG', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    assert count_images(str(tmp_path)) == 2
+
+    defaults = cpu_training_defaults(str(tmp_path))
+    assert defaults['num_images'] == 2
+    assert defaults['cache'] == 'ram'
+    assert defaults['batch'] in (64, 32, 16, 8, 4, 2)
+    assert defaults['workers'] >= 1
@@ -0,0 +1,237 @@
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+
+import storage
+import db_writer
+from models.logo_detector import LogoDetector
+
+
+class FakeTensor:
+    """Imita la interfaz mínima de un tensor de torch usada por process_video"""
+
+    def __init__(self, values):
+        self.values = np.asarray(values)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class FakeBoxes:
+    def __init__(self, cls, conf, xyxy):
+        self.cls = FakeTensor(np.asarray(cls, dtype=np.float32))
+        self.conf = FakeTensor(np.asarray(conf, dtype=np.float32))
+        self.xyxy = FakeTensor(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4))
+
+    def __len__(self):
+        return len(self.cls.values)
+
+
+class FakeResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class FakeModel:
+    """
+    Modelo sintético: detecta 'adidas' con confianza alta en los frames cuya
+    esquina superior izquierda es blanca y 'nike' con confianza baja siempre.
+    """
+    names = {0: 'adidas', 1: 'puma', 2: 'nike'}
+    ckpt_path = None
+
+    def predict(self, frame, conf=0.25, verbose=False):
+        cls, confs, boxes = [2], [0.30], [[10, 10, 30, 30]]
+        if frame[0, 0].mean() > 127:
+            cls.append(0)
+            confs.append(0.90)
+            boxes.append([5, 5, 40, 40])
+        keep = [i for i, c in enumerate(confs) if c >= conf]
+        return [FakeResult(FakeBoxes([cls[i] for i in keep], [confs[i] for i in keep],
+                                     [boxes[i] for i in keep]))]
+
+
+def make_synthetic_video(path, num_frames=60, size=64, fps=30):
+    """Genera un video en el que los frames pares tienen la esquina blanca"""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (size, size))
+    for i in range(num_frames):
+        frame = np.zeros((size, size, 3), dtype=np.uint8)
+        if i % 2 == 0:
+            frame[:8, :8] = 255
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def detector(db_path):
+    # Se evita __init__ para no descargar pesos de YOLO
+    detector = LogoDetector.__new__(LogoDetector)
+    detector.model = FakeModel()
+    detector.weights_path = 'fake.pt'
+    detector._model_hash = None
+    detector.data_yaml = None
+    detector.db_path = db_path
+    detector.store = storage.SQLiteStore(db_path)
+    detector.writer = db_writer.DetectionWriter(detector.store)
+    detector.setup_database()
+    return detector
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    return make_synthetic_video(tmp_path / "partido.mp4")
+
+
+def test_progress_callback_reports_partial_results(detector, video_path):
+    events = []
+    stats = detector.process_video(str(video_path), {'adidas': 0.5, 'nike': 0.5},
+                                   display=False, progress_callback=events.append,
+                                   progress_interval=10)
+
+    assert stats is not None
+    frames = [event['frames_done'] for event in events]
+    assert frames == sorted(frames)
+    assert events[-1]['status'] == 'completed'
+    assert events[-1]['frames_done'] == stats['total_frames']
+    assert events[-1]['detections'] == stats['detections']
+    assert events[0]['detections']['adidas']['total_detections'] > 0
+    assert all(event['detections']['nike']['total_detections'] == 0 for event in events)
+
+
+def test_reprocessing_does_not_duplicate_rows(detector, video_path):
+    thresholds = {'adidas': 0.5, 'nike': 0.5}
+    first = detector.process_video(str(video_path), thresholds, display=False, store_floor=0.1)
+    # Sin caché para forzar una segunda pasada completa sobre el mismo video
+    conn = sqlite3.connect(detector.db_path)
+    conn.execute("DELETE FROM analysis_cache")
+    conn.execute("DELETE FROM video_checkpoints")
+    conn.commit()
+    second = detector.process_video(str(video_path), thresholds, display=False, store_floor=0.1)
+
+    rows = conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+    conn.close()
+    assert first['detections'] == second['detections']
+    # Una caja 'nike' por frame y una 'adidas' en los frames pares
+    assert rows == first['total_frames'] + first['detections']['adidas']['total_detections']
+
+
+def test_thresholds_change_is_recomputed_without_inference(detector, video_path):
+    detector.process_video(str(video_path), {'adidas': 0.5, 'nike': 0.5},
+                           display=False, store_floor=0.1)
+    detector.model.predict = None  # cualquier inferencia fallaría
+
+    stats = detector.process_video(str(video_path), {'adidas': 0.5, 'nike': 0.2}, display=False)
+
+    assert stats['cache_hit']
+    assert stats['detections']['nike']['frames_with_detections'] == stats['total_frames']
+
+
+def test_created_at_is_kept_on_resume_and_renewed_on_reanalysis(detector, video_path):
+    thresholds = {'adidas': 0.5, 'nike': 0.5}
+    stats = detector.process_video(str(video_path), thresholds, display=False)
+    video_hash = stats['video_hash']
+    old = '2020-01-01 00:00:00'
+
+    # Ejecución interrumpida: al reanudar se conserva el inicio del análisis
+    detector.store.upsert('video_checkpoints', {'video_hash': video_hash, 'status': 'processing',
+                                                'last_frame': 29, 'created_at': old})
+    detector.store.delete_key('analysis_cache', 'video_hash', video_hash)
+    detector.process_video(str(video_path), thresholds, display=False, resume=True)
+    assert detector.store.get('video_checkpoints', video_hash)['created_at'] == old
+
+    # Tras la retención el video se analiza desde el principio: vuelve a ser nuevo
+    detector.store.upsert('video_checkpoints', {'video_hash': video_hash, 'status': 'expired',
+                                                'last_frame': -1, 'created_at': old})
+    detector.store.delete_key('analysis_cache', 'video_hash', video_hash)
+    detector.process_video(str(video_path), thresholds, display=False, resume=True)
+    checkpoint = detector.store.get('video_checkpoints', video_hash)
+    assert checkpoint['status'] == 'completed' and checkpoint['created_at'] > old
+
+
+class InterruptedModel(FakeModel):
+    """FakeModel que falla (como un proceso que muere) al llegar a un frame"""
+
+    def __init__(self, fail_at):
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def predict(self, frame, conf=0.25, verbose=False):
+        if self.calls == self.fail_at:
+            raise RuntimeError("proceso interrumpido")
+        self.calls += 1
+        return super().predict(frame, conf, verbose)
+
+
+def stored_detections(store):
+    return sorted((row['frame_number'], row['box_index'], row['brand'], row['confidence'], row['bbox'])
+                  for row in store.query(['frame_number', 'box_index', 'brand', 'confidence', 'bbox'],
+                                         order_by=None))
+
+
+def test_resumed_run_matches_a_full_run(detector, video_path, tmp_path):
+    thresholds = {'adidas': 0.5, 'nike': 0.5}
+    full_detector = LogoDetector.__new__(LogoDetector)
+    full_detector.__dict__.update(detector.__dict__)
+    full_detector.db_path = str(tmp_path / "completo" / "detections.db")
+    (tmp_path / "completo").mkdir()
+    full_detector.store = storage.SQLiteStore(full_detector.db_path)
+    full_detector.writer = db_writer.DetectionWriter(full_detector.store)
+    full_detector.setup_database()
+    full = full_detector.process_video(str(video_path), thresholds, display=False, store_floor=0.1,
+                                       checkpoint_interval=10)
+
+    detector.model = InterruptedModel(fail_at=25)
+    assert detector.process_video(str(video_path), thresholds, display=False, store_floor=0.1,
+                                  checkpoint_interval=10) is None
+    detector.writer.flush()
+    checkpoint = detector.get_checkpoint(full['video_hash'])
+    assert (checkpoint['status'], checkpoint['last_frame']) == ('processing', 19)
+
+    detector.model = InterruptedModel(fail_at=None)
+    resumed = detector.process_video(str(video_path), thresholds, display=False, store_floor=0.1,
+                                     checkpoint_interval=10, resume=True)
+    # Solo se vuelven a analizar los frames posteriores al último bloque confirmado
+    assert detector.model.calls == 40
+    assert resumed == full
+    assert stored_detections(detector.store) == stored_detections(full_detector.store)
+    assert detector.get_checkpoint(full['video_hash'])['status'] == 'completed'
+
+
+class OverestimatedCapture:
+    """VideoCapture cuya cabecera anuncia más frames de los que tiene el stream"""
+
+    open_capture = cv2.VideoCapture
+
+    def __init__(self, path):
+        self.capture = self.open_capture(path)
+
+    def get(self, prop):
+        value = self.capture.get(prop)
+        return value + 5 if prop == cv2.CAP_PROP_FRAME_COUNT else value
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+
+def test_end_of_stream_completes_the_video(detector, video_path, monkeypatch):
+    import models.logo_detector as logo_detector
+    monkeypatch.setattr(logo_detector.cv2, 'VideoCapture', OverestimatedCapture)
+    events = []
+
+    stats = detector.process_video(str(video_path), {'adidas': 0.5, 'nike': 0.5}, display=False,
+                                   progress_callback=events.append)
+
+    checkpoint = detector.get_checkpoint(stats['video_hash'])
+    assert (checkpoint['status'], checkpoint['last_frame'], checkpoint['total_frames']) == ('completed', 59, 60)
+    assert stats['total_frames'] == 60 and stats['duration'] == pytest.approx(2.0)
+    assert events[-1]['status'] == 'completed'
+    # Completado, el análisis queda en la caché
+    assert detector.process_video(str(video_path), {'adidas': 0.5, 'nike': 0.5}, display=False)['cache_hit']